@@ -16,36 +16,243 @@ from Polymer import *
 from Parser import *
 from ForceField import *
 from System import *
+import Sequence as S
+import Shared
 
 import sys, os
+import hashlib
+import argparse
+import multiprocessing
 
 import logging
+import logging.handlers
 
 
-def make_chain(length, percentage):
+#database, forcefield and parameters shared by processes building polymers (set once per process)
+_shared={}
+
+
+## generate a polymer conformation (no file is written).
+# the random number generator is reseeded, so that a polymer does not depend on which process builds it.
+# @param db Database object
+# @param ff ForceField object (empty string in pdb mode)
+# @param params Parser object
+# @param m molecule name
+# @param seed random seed for this polymer
+# @retval Polymer object
+def make_polymer(db,ff,params,m,seed):
+
+    np.random.seed(seed)
+
+    poly=Polymer(db,ff,m,params.mode,params.gromacs_nrxl)
+    poly.clash_thresh=params.clash_thresh
+    poly.search_batch=params.search_batch
+    poly.spin_step=params.spin_step
+    poly.precision=params.precision
+    poly.engine=params.engine
+    poly.cbmc_trials=params.cbmc_trials
+    poly.cbmc_backoff=params.cbmc_backoff
+    poly.cbmc_regrowths=params.cbmc_regrowths
+    poly.temperature=params.temperature
+    poly.make(params.chain[m])
+
+    return poly
+
+
+## generate a polymer and write its coordinates and topology files.
+# the random number generator is reseeded, so that a polymer does not depend on which process builds it.
+# @param db Database object
+# @param ff ForceField object (empty string in pdb mode)
+# @param params Parser object
+# @param folder output folder
+# @param m molecule name
+# @param seed random seed for this polymer
+# @retval Polymer object
+def build_polymer(db,ff,params,folder,m,seed):
+
+    poly=make_polymer(db,ff,params,m,seed)
+
+    if params.mode=="pdb":
+        poly.write_polymer(typef="pdb",mypath=folder)
+    elif params.mode=="gromacs":
+        poly.write_polymer(typef="gromacs",mypath=folder)
+        poly.write_gromacs(mypath=folder)
+
+    return poly
+
+
+#initialize a process of the pool building polymers
+def _init_worker(db,ff,params,folder):
+
+    _shared["db"]=db
+    _shared["ff"]=ff
+    _shared["params"]=params
+    _shared["folder"]=folder
+
+    #log handlers inherited from parent process (if forked) must not write, records are sent back to parent instead
+    logger=logging.getLogger('assemble')
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.setLevel(logging.INFO)
+
+
+#build a polymer in a process of the pool.
+#return molecule name, sequence, coordinates and mass (None if failed) and the log records produced
+def _build_worker(job):
+
+    m,seed=job
+
+    logger=logging.getLogger('assemble')
+    buf=logging.handlers.BufferingHandler(sys.maxsize)
+    logger.addHandler(buf)
+
+    try:
+        poly=build_polymer(_shared["db"],_shared["ff"],_shared["params"],_shared["folder"],m,seed)
+        result=[m,poly.chain,poly.get_xyz().copy(),poly.mass]
+    except Exception as e:
+        logger.exception(e)
+        result=[m,None,None,None]
+
+    logger.removeHandler(buf)
+
+    #make records picklable (format messages and tracebacks now)
+    for r in buf.buffer:
+        r.msg=r.getMessage()
+        r.args=None
+        if r.exc_info:
+            r.exc_text=logging.Formatter().formatException(r.exc_info)
+            r.exc_info=None
+
+    result.append(buf.buffer)
+    return result
+
+
+#build a conformation of a polymer in a process of the pool, storing its coordinates in a shared memory array.
+#return polymer index, conformation index, success and the log records produced (warnings and errors only)
+def _conformer_worker(job):
+
+    i,m,k,seed,desc=job
+
+    logger=logging.getLogger('assemble')
+    buf=logging.handlers.BufferingHandler(sys.maxsize)
+    logger.addHandler(buf)
+    logger.setLevel(logging.WARNING)
+
+    try:
+        poly=make_polymer(_shared["db"],_shared["ff"],_shared["params"],m,seed)
+        conformers,shm=Shared.attach(*desc)
+        conformers[k]=poly.get_xyz()
+        del conformers
+        shm.close()
+        ok=True
+    except Exception as e:
+        logger.exception(e)
+        ok=False
+
+    logger.removeHandler(buf)
+    logger.setLevel(logging.INFO)
+
+    for r in buf.buffer:
+        r.msg=r.getMessage()
+        r.args=None
+        if r.exc_info:
+            r.exc_text=logging.Formatter().formatException(r.exc_info)
+            r.exc_info=None
+
+    return i,k,ok,buf.buffer
+
+
+## build alternative conformations of polymers (same sequence), stored in shared memory.
+# the conformation of every polymer is the first of its stack, and stacks are attached to polymers (conformers attribute).
+# conformations whose build failed are excluded from stacks.
+# @param polymers list of Polymer objects
+# @param db Database object
+# @param ff ForceField object
+# @param params Parser object
+# @param folder output folder
+# @param seeds random seed of every additional conformation (one row per polymer)
+# @retval list of SharedMemory objects holding conformations (see Shared.release)
+def build_conformers(polymers,db,ff,params,folder,seeds):
+
+    logger=logging.getLogger('assemble')
+
+    handles=[]
+    jobs=[]
+    for i,(p,row) in enumerate(zip(polymers,seeds)):
+        conformers,shm=Shared.create((params.conformers,p.natoms,3))
+        conformers[0]=p.get_xyz()
+        p.conformers=conformers
+        handles.append(shm)
+        for k in range(1,params.conformers,1):
+            jobs.append([i,p.molname,k,row[k-1],Shared.describe(conformers,shm)])
+
+    workers=min(params.workers,len(jobs))
+    logger.info("\n> generating %s conformations per polymer with %s workers..."%(params.conformers,workers))
+
+    failed=[[] for p in polymers]
+    try:
+        if workers==1:
+            state=np.random.get_state()
+            level=logger.level
+            logger.setLevel(logging.WARNING)
+            for i,m,k,seed,desc in jobs:
+                try:
+                    polymers[i].conformers[k]=make_polymer(db,ff,params,m,seed).get_xyz()
+                except Exception as e:
+                    logger.exception(e)
+                    failed[i].append(k)
+            logger.setLevel(level)
+            np.random.set_state(state)
+
+        else:
+            pool=multiprocessing.Pool(workers,_init_worker,(db,ff,params,folder))
+            for i,k,ok,records in pool.imap_unordered(_conformer_worker,jobs):
+                for r in records:
+                    logger.handle(r)
+                if not ok:
+                    failed[i].append(k)
+            pool.close()
+            pool.join()
+
+    except:
+        for p in polymers:
+            p.conformers=None
+        for shm in handles:
+            Shared.release(shm)
+        raise
+
+    #failed conformations are left out, valid ones are moved at the beginning of stacks
+    for p,f in zip(polymers,failed):
+        if len(f)==0:
+            continue
+        valid=[k for k in range(params.conformers) if k not in f]
+        p.conformers[:len(valid)]=p.conformers[valid]
+        p.conformers=p.conformers[:len(valid)]
+        logger.warning(">> WARNING: %s conformations of polymer %s could not be built, %s used"%(len(f),p.molname,len(valid)))
+
+    return handles
+
+
+## generate a random chain.
+# @param length number of monomers
+# @param percentage list of [monomer code, percentage]
+# @param model sequence model (see Sequence.MODELS)
+# @param transitions transition probabilities between monomers, ordered as percentage (markov model only)
+# @param rng numpy random Generator (seeded from the global generator if not provided)
+# @retval chain string
+def make_chain(length, percentage, model="bernoulli", transitions=None, rng=None):
         
         logger=logging.getLogger('assemble')
-        
-        c=""
-        #make roulette array
-        roulette=[percentage[0][1]]
-        for r in range(1,len(percentage),1):
-            roulette.append(roulette[r-1]+percentage[r][1])
-    
-        #pick a random monomer according to desired percentages
-        counter=np.zeros(len(roulette))
-        for x in range(0,length,1):
-            rnd=np.random.rand(1)[0]*100        
-            index=0
-            while True:
-                if roulette[index]>rnd:
-                    break
-                else:
-                    index+=1
-            c+=percentage[index][0]
-            counter[index]+=1
+
+        if rng is None:
+            rng=np.random.default_rng(np.random.randint(0,2**31-1))
+
+        codes=[p[0] for p in percentage]
+        seq=S.make_sequence(rng,model,[p[1] for p in percentage],length,transitions)
+        c=S.to_string(seq,codes)
     
         #chain completed, report produced percentages:
+        counter=np.bincount(seq,minlength=len(codes)).astype(float)
         counter/=float(length)
         counter*=100.0
         logger.info(">> chain: %s"%c)
@@ -56,7 +263,55 @@ def make_chain(length, percentage):
         return c
 
 
-def run(infile):
+## draw a population of chains having polydisperse lengths. Identical chains are gathered in a single molecule,
+# named after a hash of their sequence (so that they share coordinates and topology files).
+# @param name molecule name
+# @param count number of chains
+# @param distribution length distribution name and parameters (see Sequence.sample_lengths)
+# @param percentage list of [monomer code, percentage]
+# @param model sequence model (see Sequence.MODELS)
+# @param transitions transition probabilities between monomers, ordered as percentage (markov model only)
+# @param rng numpy random Generator
+# @retval list of [molecule name, chain string, number of chains]
+def make_population(name, count, distribution, percentage, model="bernoulli", transitions=None, rng=None):
+
+    logger=logging.getLogger('assemble')
+
+    lengths=S.sample_lengths(rng,distribution[0],distribution[1],count)
+    codes=[p[0] for p in percentage]
+
+    molecules={}
+    for l in lengths:
+        c=S.to_string(S.make_sequence(rng,model,[p[1] for p in percentage],l,transitions),codes)
+        if c not in molecules:
+            molecules[c]=["%s_%s"%(name,hashlib.sha1(c.encode()).hexdigest()[:10]),c,0]
+        molecules[c][2]+=1
+
+    #number and weight average lengths of the population
+    mn=np.mean(lengths)
+    mw=np.sum(lengths**2)/float(np.sum(lengths))
+    logger.info(">> %s chains, %s distinct sequences"%(count,len(molecules)))
+    logger.info(">> number average length: %s, weight average length: %s, dispersity: %s"%(mn,mw,mw/mn))
+
+    return list(molecules.values())
+
+
+## share the concentration of a polydisperse molecule between the chains of its population.
+# @param population list of [molecule name, chain, amount of chains] (see make_population)
+# @param concentration concentration of polydisperse molecule
+# @param masses mass of every chain, if concentration is a mass fraction (shared by amount of chains otherwise)
+# @retval list of [molecule name, concentration]
+def split_concentration(population, concentration, masses=None):
+
+    weights=np.array([p[2] for p in population],dtype=float)
+    if masses is not None:
+        weights*=masses
+
+    weights/=np.sum(weights)
+    return [[p[0],concentration*w] for p,w in zip(population,weights)]
+
+
+def run(infile,workers=None):
      
     if os.path.isfile(infile)!=1 :
         print("ERROR: setup file not found!")
@@ -66,7 +321,12 @@ def run(infile):
     params=Parser()
     params.set_default_values()
     params.parse(infile) #parse input file
+    if workers is not None: #command line overrides input file
+        params.workers=workers
     params.check_variables() #check consistency of defined variables
+
+    if params.seed>=0:
+        np.random.seed(params.seed)
    
     #folder name equal path + system name
     folder="%s/%s"%(params.output_folder,params.output)
@@ -106,11 +366,19 @@ def run(infile):
     else:
         ff=""
     
+    #monomers used by chains, explicitly defined or to generate from compositions (others are loaded only if needed)
+    codes=set()
+    for m in params.molecule:
+        if m in params.chain:
+            codes.update(params.chain[m])
+        elif m in params.percentage:
+            codes.update([p[0] for p in params.percentage[m]])
+
     #load molecules objects into hash table from database list
     db=Database()
     if params.db!="":
         try:
-            db.load(params.db,params.mode)
+            db.load(params.db,params.mode,params.db_cache,codes,params.workers)
         except Exception as e:
             logger.exception(e)
             fh.close()
@@ -135,35 +403,107 @@ def run(infile):
 
     
     #create random chains for all the molecules not having a chain explicitly defined
+    rng=None
+    for m in params.molecule:
+        if m not in params.chain and m not in params.length_distribution:
+            if rng is None:
+                rng=np.random.default_rng(np.random.randint(0,2**31-1))
+            model=params.chain_model.get(m,"bernoulli")
+            logger.info("\n> randomizing polymer chain for molecule %s (%s model)..."%(m,model))
+            params.chain[m]=make_chain(params.length[m],params.percentage[m],model,params.transition.get(m),rng)
+
+    if params.mode=="gromacs":
+        db.set_forcefield(ff)
+
+    #polydisperse molecules are replaced by the distinct chains of their population, sharing their concentration
+    molecules=[]
     for m in params.molecule:
-        if m not in params.chain:
-            logger.info("\n> randomizing polymer chain for molecule %s..."%m)
-            params.chain[m]=make_chain(params.length[m],params.percentage[m])
+        if m not in params.length_distribution:
+            molecules.append(m)
+            continue
+
+        if rng is None:
+            rng=np.random.default_rng(np.random.randint(0,2**31-1))
+        model=params.chain_model.get(m,"bernoulli")
+        logger.info("\n> sampling polymer chains for molecule %s (%s length distribution, %s model)..."%(m,params.length_distribution[m][0],model))
+        population=make_population(m,params.chain_count[m],params.length_distribution[m],params.percentage[m],model,params.transition.get(m),rng)
+
+        #mass fractions are shared according to the mass of chains (known in gromacs mode only)
+        masses=None
+        if params.concentration_unit=="mass" and params.mode=="gromacs":
+            masses=[db.get_chain_mass(chain) for name,chain,cnt in population]
+
+        concentration=[c for c in params.concentration if c[0]==m]
+        params.concentration=[c for c in params.concentration if c[0]!=m]
+        for c in concentration:
+            params.concentration+=split_concentration(population,c[1],masses)
+
+        for name,chain,cnt in population:
+            molecules.append(name)
+            params.chain[name]=chain
+
+    params.molecule=np.array(molecules)
+
+    #compile junctions between monomers, and verify that all chains can be built before starting
+    if params.mode=="gromacs":
+        logger.info("\n> compiling junctions between monomers...")
+        try:
+            db.validate_junctions([params.chain[m] for m in params.molecule])
+        except Exception as e:
+            logger.exception(e)
+            fh.close()
+            logger.removeHandler(fh)
+            logger.removeHandler(ch)
+            sys.exit(1)
    
     
+    #every polymer gets its own random seed, so that results do not depend on the amount of workers
+    #(the generator state is restored afterwards for the rest of the run)
+    seeds=np.random.randint(0,2**31-1,len(params.molecule))
+    if params.conformers>1:
+        conformer_seeds=np.random.randint(0,2**31-1,(len(params.molecule),params.conformers-1))
+    state=np.random.get_state()
+
     polymers=[]
-    for m in params.molecule:        
+    if params.workers==1 or len(params.molecule)==1:
 
-        try:
+        for m,seed in zip(params.molecule,seeds):
+            try:
+                polymers.append(build_polymer(db,ff,params,folder,m,seed))
+            except Exception as e:
+                logger.exception(e)
+                fh.close()
+                logger.removeHandler(fh)
+                logger.removeHandler(ch)
+
+    else:
+        logger.info("\n> generating polymers with %s workers..."%min(params.workers,len(params.molecule)))
+        pool=multiprocessing.Pool(min(params.workers,len(params.molecule)),_init_worker,(db,ff,params,folder))
+
+        #results are collected in input order, and logs of each polymer reported as a whole
+        for m,chain,crds,mass,records in pool.imap(_build_worker,zip(params.molecule,seeds)):
+
+            for r in records:
+                logger.handle(r)
+
+            if chain is None:
+                fh.close()
+                logger.removeHandler(fh)
+                logger.removeHandler(ch)
+                continue
 
-            #generate polymer
             poly=Polymer(db,ff,m,params.mode,params.gromacs_nrxl)
             poly.clash_thresh=params.clash_thresh
-            poly.make(params.chain[m])
-        
-            if params.mode=="pdb":
-                poly.write_polymer(typef="pdb",mypath=folder)
-            elif params.mode=="gromacs":
-                poly.write_polymer(typef="gromacs",mypath=folder)
-                poly.write_gromacs(mypath=folder)
-            
+            poly.search_batch=params.search_batch
+            poly.spin_step=params.spin_step
+            poly.precision=params.precision
+            poly.set_chain(chain,crds,mass)
             polymers.append(poly)
-            
-        except Exception as e:
-            logger.exception(e)
-            fh.close()
-            logger.removeHandler(fh)
-            logger.removeHandler(ch)
+
+        pool.close()
+        pool.join()
+
+    np.random.set_state(state)
     
     if np.any(params.box_grid_shape==0):
         logger.warning("\n> no box size information provided, skipping system generation...")
@@ -173,9 +513,24 @@ def run(infile):
         return
     
     if params.mode=="gromacs":
+
+        #conformers are drawn at random when filling the box (chains are built in place in growth packing)
+        handles=[]
+        if params.conformers>1 and params.packing!="growth":
+            handles=build_conformers(polymers,db,ff,params,folder,[conformer_seeds[list(params.molecule).index(p.molname)] for p in polymers])
+
         logger.info("\n> generating system...\n")
         system=System(polymers,ff,params)
-        system.create_system(mypath=folder)
+        try:
+            system.create_system(mypath=folder)
+
+        #shared memory is freed even if system generation fails
+        finally:
+            for p in polymers:
+                p.conformers=None
+            for shm in list(system.shared.values())+handles:
+                Shared.release(shm)
+            system.shared={}
     
     
     logger.info("\n> All done! Thank you for using Assemble! <")
@@ -189,5 +544,9 @@ if __name__=="__main__":
     assembled=os.path.abspath(os.path.dirname(str(sys.argv[0])))
     os.environ["ASSEMBLEPATH"]="%s;%s"%(cwd,assembled)
     
-    infile=str(sys.argv[1])
-    run(infile)
\ No newline at end of file
+    parser=argparse.ArgumentParser(description="Assemble! generate polymeric mixtures for Gromacs")
+    parser.add_argument("infile",help="input file")
+    parser.add_argument("-w","--workers",type=int,default=None,help="number of processes building polymers (overrides workers keyword)")
+    args=parser.parse_args()
+
+    run(args.infile,args.workers)
\ No newline at end of file
@@ -0,0 +1,228 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# from CellList import CellList
+# c=CellList(0.9)
+# c.add(chain_coordinates)
+# c.clash(new_monomer_coordinates) #True if any atom is closer than 0.9 to stored ones
+# c.truncate(10) #forget all points but the first 10
+# p=CellList(0.9,box=[10,10,10]) #periodic box, distances follow minimum image convention
+# s=CellList(0.9,source=lambda: buf) #points added are kept by the caller in buf (in the same order), they are not copied
+
+import numpy as np
+
+#offsets used to pack three integer cell indices into a single integer key
+_KEY_OFFSET=2**20
+_KEY_BASE=2**21
+
+class CellList(object):
+
+    ## uniform grid spatial index, storing points in cubic cells having the size of the cutoff distance.
+    # Two points closer than the cutoff necessarily sit in the same or in adjacent cells.
+    # @param cutoff distance below which two points are considered as clashing
+    # @param box size of periodic box (3 values, box origin is at 0). If not provided, space is not periodic.
+    # @param source function returning the array in which the caller stores added points, in the order they are added.
+    # If provided, the index only stores points indices. Otherwise, points are copied in an internal buffer.
+    def __init__(self,cutoff,box=None,source=None):
+
+        self.cutoff=float(cutoff)
+
+        #a null cutoff never reports a clash, any cell size will do
+        if self.cutoff>0:
+            self.cell_size=self.cutoff
+        else:
+            self.cell_size=1.0
+
+        #in a periodic box, cells tile the box exactly (hence they can be slightly larger than the cutoff)
+        self.box=None
+        if box is not None:
+            self.box=np.asarray(box,dtype=float)
+            self._ncells=np.maximum(np.floor(self.box/self.cell_size),1).astype(np.int64)
+            self._cell_dims=self.box/self._ncells
+
+        #hashtable: cell key to list of indices of points in that cell
+        self.cells={}
+
+        #stored points, in a buffer growing geometrically (not needed if points are kept by the caller)
+        self.source=source
+        self._points=None
+        if source is None:
+            self._points=np.zeros((64,3))
+        self.size=0
+
+        #relative position of the 27 cells surrounding (and including) a cell
+        r=np.arange(-1,2,1)
+        self._neighbours=np.array(np.meshgrid(r,r,r,indexing="ij")).reshape(3,-1).T
+
+
+    ## stored points (the first size rows are valid).
+    @property
+    def points(self):
+        if self.source is None:
+            return self._points
+        return self.source()
+
+
+    #integer cell indices of an ensemble of points
+    def _cell_index(self,points):
+        if self.box is None:
+            return np.floor(points/self.cell_size).astype(np.int64)
+        else:
+            return np.mod(np.floor(points/self._cell_dims).astype(np.int64),self._ncells)
+
+
+    #vectors between points, following minimum image convention in a periodic box
+    def _delta(self,a,b):
+        d=a-b
+        if self.box is not None:
+            d-=self.box*np.round(d/self.box)
+        return d
+
+
+    #pack an array of 3d cell indices into integer keys
+    def _key(self,idx):
+        idx=idx+_KEY_OFFSET
+        return (idx[...,0]*_KEY_BASE+idx[...,1])*_KEY_BASE+idx[...,2]
+
+
+    ## insert points in the index.
+    # @param points Nx3 numpy array
+    def add(self,points):
+
+        points=np.asarray(points).reshape(-1,3)
+        n=len(points)
+
+        #grow buffer if needed, and copy points (unless the caller keeps them)
+        if self.source is None:
+            if self.size+n>len(self._points):
+                buf=np.zeros((max(2*len(self._points),self.size+n),3))
+                buf[:self.size]=self._points[:self.size]
+                self._points=buf
+
+            self._points[self.size:self.size+n]=points
+
+        keys=self._key(self._cell_index(points))
+        for i in range(0,n,1):
+            k=int(keys[i])
+            if k in self.cells:
+                self.cells[k].append(self.size+i)
+            else:
+                self.cells[k]=[self.size+i]
+
+        self.size+=n
+
+
+    ## get indices of all stored points sitting in cells adjacent to the provided points.
+    # @param points Nx3 numpy array
+    # @retval numpy array of indices
+    def neighbours(self,points):
+
+        idx=self._cell_index(np.asarray(points,dtype=float).reshape(-1,3))
+        idx=idx[:,np.newaxis,:]+self._neighbours[np.newaxis,:,:]
+        if self.box is not None:
+            idx=np.mod(idx,self._ncells)
+        keys=np.unique(self._key(idx))
+
+        found=[]
+        for k in keys.tolist():
+            if k in self.cells:
+                found.extend(self.cells[k])
+
+        return np.array(found,dtype=int)
+
+
+    ## get all couples of provided and stored points sitting in adjacent cells (candidate neighbours).
+    # @param points Nx3 numpy array
+    # @retval two numpy arrays: index of provided point, and index of stored point, for every couple
+    def pairs(self,points):
+
+        points=np.asarray(points,dtype=float).reshape(-1,3)
+        idx=self._cell_index(points)[:,np.newaxis,:]+self._neighbours[np.newaxis,:,:]
+        if self.box is not None:
+            idx=np.mod(idx,self._ncells)
+        keys,inverse=np.unique(self._key(idx).ravel(),return_inverse=True)
+
+        #stored points of every involved cell, concatenated
+        found=[]
+        counts=np.zeros(len(keys),dtype=int)
+        for i,k in enumerate(keys.tolist()):
+            if k in self.cells:
+                found.extend(self.cells[k])
+                counts[i]=len(self.cells[k])
+        found=np.array(found,dtype=int)
+        starts=np.cumsum(counts)-counts
+
+        #expand every (point, adjacent cell) into couples with the points stored in that cell
+        n=counts[inverse]
+        total=np.sum(n)
+        query=np.repeat(np.arange(len(inverse))//len(self._neighbours),n)
+        offset=np.arange(total)-np.repeat(np.cumsum(n)-n,n)
+        stored=found[np.repeat(starts[inverse],n)+offset]
+
+        return query,stored
+
+
+    #distance of couples of provided and stored points
+    def _pair_distances(self,points,query,stored):
+        return np.sqrt(np.sum(self._delta(self.points[stored],points[query])**2,axis=1))
+
+
+    ## check whether any of the provided points is closer than the cutoff to any stored point.
+    # @param points Nx3 numpy array
+    # @retval True if clash detected, False otherwise
+    def clash(self,points):
+
+        points=np.asarray(points,dtype=float).reshape(-1,3)
+        query,stored=self.pairs(points)
+        if len(query)==0:
+            return False
+
+        return np.any(self._pair_distances(points,query,stored)<self.cutoff)
+
+
+    ## check a stack of point ensembles for clashes against stored points, all at once.
+    # @param points BxNx3 numpy array (B ensembles of N points)
+    # @retval boolean numpy array of length B, True where a clash is detected
+    def clash_batch(self,points):
+
+        points=np.asarray(points,dtype=float)
+        flat=points.reshape(-1,3)
+        query,stored=self.pairs(flat)
+
+        result=np.zeros(len(points),dtype=bool)
+        if len(query)==0:
+            return result
+
+        close=self._pair_distances(flat,query,stored)<self.cutoff
+        result[query[close]//points.shape[1]]=True
+        return result
+
+
+    ## remove the most recently added points, keeping only the first ones.
+    # @param size amount of points to keep
+    def truncate(self,size):
+
+        if size>=self.size:
+            return
+
+        #points are removed from last to first, so each one is always at the end of its cell list
+        keys=self._key(self._cell_index(self.points[size:self.size]))
+        for k in reversed(keys.tolist()):
+            self.cells[k].pop()
+            if len(self.cells[k])==0:
+                del self.cells[k]
+
+        self.size=size
@@ -12,15 +12,115 @@
 # Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
 
 from Molecule import *
+import Library
 import logging
 import os
+import numpy as np
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MoleculeTable(dict):
+
+    ## dictionary of database molecules (one letter code as key). Deferred molecules are listed among keys,
+    # and loaded when first accessed by key (values and items only return molecules already loaded).
+    # @param loader function loading a deferred molecule, given its code and the arguments provided to defer
+    def __init__(self,loader):
+        dict.__init__(self)
+        self.loader=loader
+        self.deferred={}
+
+
+    ## register a molecule to load on first access.
+    # @param code one letter code
+    # @param args arguments passed to loader, after code
+    def defer(self,code,*args):
+        dict.__setitem__(self,code,None)
+        self.deferred[code]=args
+
+
+    ## codes of molecules already loaded.
+    # @retval list of one letter codes
+    def loaded(self):
+        return [c for c in self if dict.__getitem__(self,c) is not None]
+
+
+    def __getitem__(self,code):
+
+        m=dict.__getitem__(self,code)
+        if m is None:
+            m=self.loader(code,*self.deferred.pop(code))
+            dict.__setitem__(self,code,m)
+
+        return m
+
+
+    #a molecule set or removed replaces the deferred one (None values are deferred molecules being copied)
+    def __setitem__(self,code,m):
+        if m is not None:
+            self.deferred.pop(code,None)
+        dict.__setitem__(self,code,m)
+
+
+    def __delitem__(self,code):
+        dict.__delitem__(self,code)
+        self.deferred.pop(code,None)
+
+
+    def get(self,code,default=None):
+        return self[code] if code in self else default
+
+
+    ## molecules already loaded (deferred ones are not loaded).
+    # @retval list of Molecule objects
+    def values(self):
+        return [dict.__getitem__(self,c) for c in self.loaded()]
+
+
+    ## codes and molecules already loaded (deferred ones are not loaded).
+    # @retval list of (one letter code, Molecule object) tuples
+    def items(self):
+        return [(c,dict.__getitem__(self,c)) for c in self.loaded()]
+
+
+    #copies keep deferred molecules deferred
+    def __reduce__(self):
+        return (self.__class__,(self.loader,),self.__dict__,None,iter(dict.items(self)))
+
 
 class Database(object):
 
     def __init__(self):
-        self.molecules={}
+        self.molecules=MoleculeTable(self._load_deferred)
+        self.library=None
         self.logger=logging.getLogger('assemble')
 
+        #force field, needed to compile junctions between monomers (gromacs mode)
+        self.ff=None
+        #table of parameters connecting ordered pairs of monomers, and failed pairs
+        self.junctions={}
+        self.junction_errors={}
+
+        #per monomer (and terminal variant) atom types, masses and charges tables.
+        #atom types are indices in atomtypes list (force field nonbonded types)
+        self.properties={}
+        self.atomtypes=[]
+        self.type_mass=np.array([])
+        self.type_charge=np.array([])
+
+
+    #attach force field to database (invalidates compiled junctions and properties)
+    def set_forcefield(self,ff):
+        self.ff=ff
+        self.junctions={}
+        self.junction_errors={}
+        self.properties={}
+
+        self.atomtypes=list(ff.nonbonded)
+        self._type_index=dict((t,i) for i,t in enumerate(self.atomtypes))
+        self.type_mass=np.array([ff.nonbonded[t][1] for t in self.atomtypes]).astype(float)
+        self.type_charge=np.array([ff.nonbonded[t][2] for t in self.atomtypes]).astype(float)
+
 
     def findfile(self, infile):
 
@@ -45,9 +145,16 @@ class Database(object):
         return fname
     
 
-    def load(self, infile, mode):
+    ## load a database file. If a library is requested, molecules are read from this compiled binary file as long as
+    # their source files are unchanged, and parsed from source files otherwise (the library is then updated).
+    # @param infile database file
+    # @param mode pdb or gromacs
+    # @param library library file name, "auto" for a file next to database file (named after mode), None or "none" for no library
+    # @param codes one letter codes of molecules to load immediately (all if None). Other molecules are loaded when first accessed
+    # @param workers threads parsing source files at the same time
+    def load(self, infile, mode, library=None, codes=None, workers=1):
              
-        files=[]
+        entries=[]
         
         self.logger.info("\n> Preparing molecules database...")
         try:
@@ -59,6 +166,7 @@ class Database(object):
         thisdir=os.path.dirname(os.path.abspath(infile))
         os.environ["ASSEMBLEPATH"]="%s;%s"%(thisdir, os.environ["ASSEMBLEPATH"])
         
+        #resolve files of every molecule
         for line in f:  
             
             w=line.split()
@@ -75,37 +183,118 @@ class Database(object):
             fname=self.findfile(w[1])            
             if fname=="":
                 raise IOError("PDB file %s not found for molecule %s"%(w[1],w[0]))
+
+            topname=""
+            if mode=="gromacs":
+                if len(w)!=3:
+                    raise IOError("Could not load topology file for molecule %s!\nin gromacs mode, a topology file is expected for molecule %s!"%(w[0],w[0]))
+
+                topname=self.findfile(w[2])
+                if topname=="":
+                    raise IOError("Could not load topology file %s for molecule %s!\ntopology file %s not found for molecule %s"%(w[2],w[0],w[2],w[0]))
+
+            entries.append([w[0],fname,topname])
             
-            try:
-                self.logger.info(">> loading PDB %s"%fname)
-                m=Molecule()
-                m.import_pdb(fname, mode)
-                
-            except IOError:
-                raise IOError("loading of PDB file %s failed for molecule %s"%(fname,w[0]))
+        f.close()
 
-            try:
-                if mode=="gromacs":
-                    if len(w)==3:
- 
-                        fname=self.findfile(w[2])            
-                        if fname=="":
-                            raise IOError("topology file %s not found for molecule %s"%(w[2],w[0]))
-
-                        self.logger.info(">> loading topology %s"%fname)
-                        m.import_topology(fname)
-                    else:
-                        raise IOError("in gromacs mode, a topology file is expected for molecule %s!"%w[0])
+        if library=="auto":
+            library="%s.%s.lib"%(os.path.abspath(infile),mode)
+
+        self.library=None
+        if library is not None and library!="none":
+            self.library=Library.Reader(library,mode)
+
+        #last entry of a duplicate key is the one kept
+        files={}
+        for code,fname,topname in entries:
+            if code in files or code in self.molecules:
+                self.logger.warning("\n> WARNING: duplicate key %s in database %s. Overwriting."%(code, infile))
+            files[code]=[fname,topname]
 
+        if codes is None:
+            codes=list(files)
+
+        #molecules needed now: read from library, or parsed from source files in parallel
+        load=[c for c in files if c in codes]
+        compiled=[c for c in load if self.library is not None and self.library.available(c,*files[c])]
+        parse=[c for c in load if c not in compiled]
+
+        if len(compiled)>0:
+            self.logger.info(">> loading %s molecules from compiled library %s"%(len(compiled),library))
+
+        molecules={}
+        for c in compiled:
+            molecules[c]=self.library.get(c)
+
+        for c in parse:
+            self.logger.info(">> loading PDB %s"%files[c][0])
+            if mode=="gromacs":
+                self.logger.info(">> loading topology %s"%files[c][1])
+
+        with ThreadPoolExecutor(max_workers=max(1,min(workers,len(parse)))) as pool:
+            for c,m in zip(parse,pool.map(lambda c: self._load_molecule(c,files[c][0],files[c][1],mode),parse)):
+                molecules[c]=m
+
+        #update library with parsed molecules, keeping those it already holds which are still valid
+        if len(parse)>0 and self.library is not None:
+            keep={}
+            for c in files:
+                if c in molecules:
+                    keep[c]=molecules[c]
+                elif self.library.available(c,*files[c]):
+                    keep[c]=self.library.get(c)
+
+            try:
+                Library.write(library,keep,mode)
+                self.logger.info(">> %s molecules compiled in library %s"%(len(parse),library))
+            #library is only a cache, failing to write it does not stop the run
             except Exception as e:
-                raise IOError("Could not load topology file %s for molecule %s!\n%s"%(w[2],w[0],e))
+                self.logger.warning(">> WARNING: could not write library %s: %s"%(library,e))
 
-            if w[0] in list(self.molecules):
-                self.logger.warning("\n> WARNING: duplicate key %s in database %s. Overwriting."%(w[0], infile))
-                            
-            self.molecules[w[0]]=m
+        for code in files:
+            if code in molecules:
+                #molecules are templates shared by all polymers, protect them from edits
+                m=molecules[code]
+                m.freeze()
+                self.molecules[code]=m
+            else:
+                self.molecules.defer(code,files[code][0],files[code][1],mode)
+            self._forget_compiled(code)
+
+
+    #load a molecule whose loading has been deferred (see load), from library if possible
+    def _load_deferred(self,code,fname,topname,mode):
+
+        if self.library is not None and self.library.available(code,fname,topname):
+            m=self.library.get(code)
+        else:
+            self.logger.info(">> loading PDB %s"%fname)
+            if mode=="gromacs":
+                self.logger.info(">> loading topology %s"%topname)
+            m=self._load_molecule(code,fname,topname,mode)
+
+        m.freeze()
+        return m
+
+
+    #load a molecule from its pdb and topology files
+    def _load_molecule(self,code,fname,topname,mode):
+
+        try:
+            m=Molecule()
+            m.import_pdb(fname, mode)
             
-        f.close()
+        except IOError:
+            raise IOError("loading of PDB file %s failed for molecule %s"%(fname,code))
+
+        try:
+            if mode=="gromacs":
+                m.import_topology(topname)
+
+        except Exception as e:
+            raise IOError("Could not load topology file %s for molecule %s!\n%s"%(topname,code,e))
+
+        return m
 
             
     def add(self,code,pdb,topology=-1):
@@ -127,15 +316,19 @@ class Database(object):
         except Exception as e:
             raise IOError(e)
         
+        m.freeze()
         self.molecules[code]=m
+        self._forget_compiled(code)
     
         
     def remove(self,code):
         try:
             del self.molecules[code]
-        except IOError:
+        except KeyError:
             raise IOError("ERROR: molecule %s not found, cannot remove!"%code)
         
+        self._forget_compiled(code)
+        
         
     def save(self,filename):
         
@@ -145,4 +338,390 @@ class Database(object):
             line="%s %s %s\n"%(x,self.molecules[x].pdbfile,self.molecules[x].topfile)
             fout.write(line)
             
-        fout.close()
\ No newline at end of file
+        fout.close()
+
+    ## get parameters connecting the tail of a monomer to the head of the next one in a chain (gromacs mode).
+    # parameters are compiled once per ordered pair of monomers, and cached.
+    # @param code_tail one letter code of monomer at the end of the chain
+    # @param code_head one letter code of monomer to append
+    # @retval dictionary with bond length, and names, indices, angle and dihedral values of atoms used to place tail and head hooks
+    def get_junction(self,code_tail,code_head):
+
+        key=(code_tail,code_head)
+        if key in self.junctions:
+            return self.junctions[key]
+
+        if key in self.junction_errors:
+            raise IOError(self.junction_errors[key])
+
+        try:
+            self.junctions[key]=self._compile_junction(code_tail,code_head)
+        except Exception as e:
+            self.junction_errors[key]=str(e)
+            raise IOError(e)
+
+        return self.junctions[key]
+
+
+    ## compile junctions for every ordered pair of monomers loaded in database (deferred monomers are not loaded).
+    # @retval dictionary of incompatible pairs, associated to the reason of failure
+    def compile_junctions(self):
+
+        errors={}
+        codes=self.molecules.loaded()
+        for code_tail in codes:
+            for code_head in codes:
+                try:
+                    self.get_junction(code_tail,code_head)
+                except IOError as e:
+                    errors[(code_tail,code_head)]=str(e)
+
+        self.logger.info(">> %s junctions compiled, %s incompatible monomer pairs"%(len(self.junctions),len(errors)))
+        return errors
+
+
+    ## check, before building anything, that every couple of consecutive monomers in chains can be connected.
+    # junctions between all loaded monomers are compiled, and incompatible pairs reported.
+    # @param chains list of sequences (one letter codes strings)
+    def validate_junctions(self,chains):
+
+        errors=self.compile_junctions()
+
+        #only pairs actually needed by chains are fatal
+        needed=[]
+        for c in chains:
+            for x in range(1,len(c),1):
+                if (c[x-1],c[x]) in errors and (c[x-1],c[x]) not in needed:
+                    needed.append((c[x-1],c[x]))
+
+        for pair in list(errors):
+            if pair not in needed:
+                self.logger.info(">> WARNING: monomer %s cannot be followed by %s (unused in chains)"%pair)
+
+        if len(needed)>0:
+            msg=""
+            for pair in needed:
+                msg+="\n%s followed by %s: %s"%(pair[0],pair[1],errors[pair])
+            raise IOError("incompatible consecutive monomers in chains:%s"%msg)
+
+
+    ## get atom types, masses and charges of a monomer (gromacs mode), computed once and cached.
+    # @param code one letter code of monomer
+    # @param variant "middle", "nterminal", "cterminal" or "both" (monomer being both N and C terminal, i.e. a chain of one)
+    # @retval dictionary with arrays of atom types ids (index in atomtypes), masses and charges (one per atom, in pdb order), and total mass
+    def get_properties(self,code,variant="middle"):
+
+        key=(code,variant)
+        if key not in self.properties:
+            self.properties[key]=self._compile_properties(code,variant)
+
+        return self.properties[key]
+
+
+    ## get mass of a chain (gromacs mode), from monomers properties tables.
+    # @param chain sequence of monomers one letter codes
+    # @retval mass of chain
+    def get_chain_mass(self,chain):
+
+        #sum masses of all monomers, then correct for terminal ones
+        codes,inverse=np.unique(list(chain),return_inverse=True)
+        total=np.array([self.get_properties(c)["total_mass"] for c in codes])
+        mass=np.sum(total[inverse])
+
+        if len(chain)==1:
+            terminals=[(chain[0],"both")]
+        else:
+            terminals=[(chain[0],"nterminal"),(chain[-1],"cterminal")]
+
+        for c,variant in terminals:
+            mass+=self.get_properties(c,variant)["total_mass"]-self.get_properties(c)["total_mass"]
+
+        return mass
+
+
+    #remove compiled junctions and properties involving a monomer (when it is added, replaced or removed)
+    def _forget_compiled(self,code):
+        for table in [self.junctions,self.junction_errors,self.properties]:
+            for key in list(table):
+                if code in key:
+                    del table[key]
+
+
+    #find type, mass and charge of every atom of a monomer, from its topology and force field
+    def _compile_properties(self,code,variant):
+
+        if self.ff is None:
+            raise IOError("a force field must be attached to the database to get monomers properties")
+
+        try:
+            m=self.molecules[code]
+        except KeyError as e:
+            raise IOError("molecule %s not found in database!"%e)
+
+        #terminal monomers may have different atom types
+        top=m.topology
+        if variant!="middle":
+            top=deepcopy(top)
+        if variant=="nterminal" or variant=="both":
+            top.make_terminal("nterminal")
+        if variant=="cterminal" or variant=="both":
+            top.make_terminal("cterminal")
+
+        mapping=dict((l[0],l[1]) for l in top.mapping[::-1]) #first occurrence wins
+
+        types=[]
+        for a in m.get_atomnames():
+            atomtype=mapping[a]
+            if atomtype not in self._type_index:
+                raise IOError("Could not find mass of atom %s (type %s not in force field)"%(a,atomtype))
+            types.append(self._type_index[atomtype])
+
+        types=np.array(types,dtype=int)
+        mass=self.type_mass[types]
+        charge=self.type_charge[types]
+
+        return {"types":types,"mass":mass,"charge":charge,"total_mass":np.sum(mass)}
+
+
+    #find junction parameters between two monomers, from their topologies and force field
+    def _compile_junction(self,code_tail,code_head):
+
+        if self.ff is None:
+            raise IOError("a force field must be attached to the database to connect monomers")
+
+        try:
+            m=self.molecules[code_tail]
+            m_new=self.molecules[code_head]
+        except KeyError as e:
+            raise IOError("molecule %s not found in database!"%e)
+
+        #get head and tail atomnames
+        tailname=m.topology.tail[0]
+        headname=m_new.topology.head[0]
+        
+        ###GET BOND###
+        #get bond type within head and tail (must be one and one only!)
+        b1=m.topology.search_next_bond(tailname,headname) #with plus
+        b2=m_new.topology.search_prev_bond(tailname,headname) #with minus
+        
+        #check consistency between head and tail molecule topologies for bonds
+        b=[]              
+        if len(b1)>0 and len(b2)>0:             
+            b=np.unique(np.concatenate((b1[:,2],b2[:,2])))
+        elif len(b1)>0 and len(b2)==0:
+            b=np.unique(b1[:,2])
+        elif len(b1)==0 and len(b2)>0:
+            b=np.unique(b2[:,2])
+        if len(b)>1:
+            raise IOError("inconsistency in bond descriptions in topologies of %s and %s"%(code_head,code_tail))
+        if len(b)==0:
+            #print "ERROR: connection between %s and %s not found!"%(tailname,headname)
+            raise IOError("connection between %s and %s not found!"%(tailname,headname))
+       
+        #get bond distance in angstrom (same for both current and new molecules)
+        try:
+            bond=self.ff.get_bond(b[0])
+        except:
+            raise IOError("bond type %s not found in force field"%b[0])
+
+        junction={"bond":bond}
+
+        ###GET DIHEDRAL CURRENT###
+        keep=[0]
+        a_tmp=m.topology.search_next_dihedral(tailname,headname,'+') #need 1 plus     
+        a=self._remove_prev_to_next(a_tmp) 
+                                                                                                                                                                                                                                                                                               
+        #if search failed on current molecule, look for parameters on next one
+        if len(a)==0:  
+            keep=[]                  
+            a_tmp=m_new.topology.search_next_dihedral(tailname,headname,'-') #need double minus!
+            a=self._remove_prev_to_next(a_tmp) 
+            
+            #verify existence of all atoms in current molecule, if getting info from next one, and reformat
+            for i in range(0,len(a),1):
+                               
+                for j in range(0,4,1):
+                    if "-" in  a[i,j]:
+                        atomname=a[i,j].split("-")[1]
+                        if atomname in m.atom:
+                            keep.append(i)
+                            a[i,j]=atomname
+                    else:
+                            keep.append(i)
+                            atomname="+%s"%a[i,j]
+                            a[i,j]=atomname
+                            
+        #check if a match was found in topologies of current or next molecule
+        if len(keep)==0:
+            raise IOError("no match found for dihedral for forward hook involving atoms\n %s in %s and %s in %s!"%(tailname, m.topfile, headname, m_new.topfile))
+  
+  
+        #get dihedral angle value
+        try:
+            dihedral_val_tail=self.ff.get_dihedral(a[keep[0],4])
+        except:
+            raise IOError("dihedral type %s not found in force field"%a[keep[0],4])  
+        
+        #extract names of atoms forming angle and dihedral with head and tail
+        if "+" in a[keep[0],0] and a[keep[0],1]==tailname:
+            anglename=a[keep[0],2]
+            dihedralname=a[keep[0],3]
+        elif "+" in a[keep[0],3] and a[keep[0],2]==tailname:
+            anglename=a[keep[0],1]
+            dihedralname=a[keep[0],0]
+        else:
+            raise IOError("umm... a dihedral potential looks weird...")
+        
+                       
+        #SEARCH FOR ANGLENAME AS WELL!
+        ###GET ANGLE CURRENT###
+        keep=[0]
+        a=m.topology.search_next_angle(tailname,headname,'+') #need 1 plus   
+        #if search failed on current molecule, look for parameters on next one
+        if len(a)==0:
+            keep=[]                    
+            a=m_new.topology.search_next_angle(tailname,headname,'-') #need double minus!
+            #verify existence of all atoms in current molecule, if getting info from next one
+            for i in range(0,len(a),1):
+                for j in range(0,3,1):
+                    if "-" in  a[i,j]:
+                        atomname=a[i,j].split("-")[1]
+                        if  atomname in m.atom:
+                            keep.append(i)
+                            a[i,j]=atomname
+                    else:
+                            keep.append(i)
+                            atomname="+%s"%a[i,j]
+                            a[i,j]=atomname
+                                      
+        #check that one solution was found
+        if len(keep)==0:
+            raise IOError("no match found for angle for forward hook involving atoms\n %s in %s and %s in %s!"%(tailname, m.topfile, headname, m_new.topfile))
+        
+        try:
+            angle_val_tail=self.ff.get_angle(a[keep[0],3])
+        except:
+            raise IOError("angle type %s not found in force field"%a[keep[0],3])         
+
+        
+        #atoms defining hooking point position for current molecule
+        junction["tail_atoms"]=[tailname,anglename,dihedralname]
+        junction["tail_angle"]=angle_val_tail
+        junction["tail_dihedral"]=dihedral_val_tail
+
+        ###GET DIHEDRAL NEXT###
+        keep=[0]
+        a_tmp=m_new.topology.search_prev_dihedral(tailname,headname,'-') #need 1 minus 
+        a=self._remove_prev_to_next(a_tmp) 
+        
+        #if search failed on current molecule, look for parameters on next one
+        if len(a)==0:  
+            keep=[]                  
+            a_tmp=m.topology.search_prev_dihedral(tailname,headname,'+') #need double plus!
+            a=self._remove_prev_to_next(a_tmp) 
+            
+            #verify existence of all atoms in current molecule, if getting info from next one
+            for i in range(0,len(a),1):
+                for j in range(0,4,1):
+                    if "+" in a[i,j]:
+                        atomname=a[i,j].split("+")[1]
+                        if  atomname in m.atom:
+                            keep.append(i)
+                            a[i,j]=atomname
+                    else:
+                            keep.append(i)
+                            atomname="-%s"%a[i,j]
+                            a[i,j]=atomname
+                        
+        #check that one solution was found
+        if len(keep)==0:
+            raise IOError("no match found for dihedral for backward hook involving atoms\n %s in %s and %s in %s!"%(headname, m_new.topfile,tailname, m.topfile))
+        
+        try:
+            dihedral_val_head=self.ff.get_dihedral(a[keep[0],4])
+        except:
+            raise IOError("dihedral type %s not found in force field"%a[keep[0],4])
+        
+        #extract names of atoms forming angle and dihedral with head and tail
+        if "-" in a[keep[0],0] and a[keep[0],1]==headname:
+            anglename=a[keep[0],2]
+            dihedralname=a[keep[0],3]
+        elif "-" in a[keep[0],3] and a[keep[0],2]==headname:
+            anglename=a[keep[0],1]
+            dihedralname=a[keep[0],0]
+        else:
+            raise IOError("%s dihedral potential looks weird..."%a[keep[0],:])
+         
+        ###GET ANGLE NEXT###
+        keep=[0]
+        a=m_new.topology.search_prev_angle(tailname,headname,'-') #need 1 minus 
+        #if search failed on current molecule, look for parameters on next one
+        if len(a)==0:                    
+            a=m.topology.search_prev_angle(tailname,headname,'+') #need double plus!
+            #verify existence of all atoms in current molecule, if getting info from next one
+            keep=[]
+            for i in range(0,len(a),1):
+                for j in range(0,3,1):
+                    if "+" in  a[i,j]:
+                        atomname=a[i,j].split("+")[1]
+                        if atomname in m.atom:
+                            keep.append(i)
+                            a[i,j]=atomname
+                    else:
+                            keep.append(i)
+                            atomname="-%s"%a[i,j]
+                            a[i,j]=atomname
+        
+        #check that one solution was found
+        if len(keep)==0:
+            raise IOError("no match found for angle for backward hook involving atoms\n %s in %s and %s in %s!"%(headname, m_new.topfile,tailname, m.topfile))
+       
+        try:
+            angle_val_head=self.ff.get_angle(a[keep[0],3])
+        except:
+            raise IOError("angle type %s not found in force field"%a[keep[0],3])
+
+        #atoms defining hooking point position for next molecule
+        junction["head_atoms"]=[headname,anglename,dihedralname]
+        junction["head_angle"]=angle_val_head
+        junction["head_dihedral"]=dihedral_val_head
+    
+
+
+        #index of hooks atoms within their monomer
+        for k in ["tail","head"]:
+            if k=="tail":
+                mol=m
+            else:
+                mol=m_new
+            
+            idx=[]
+            for name in junction["%s_atoms"%k]:
+                try:
+                    idx.append(mol.atomselect("*","*",name,True)[1][0])
+                except (KeyError,IndexError):
+                    raise IOError("atom %s not found in %s"%(name,mol.pdbfile))
+            junction["%s_index"%k]=np.array(idx)
+
+        return junction
+
+
+    #test for connection between previous and next molecule. If existing, remove from pool
+    def _remove_prev_to_next(self, a):
+        keep = []
+        for i in range(0, len(a), 1):    
+            prevmol = False
+            nextmol = False
+            for j in range(0, 4, 1):
+                if "-" in a[i, j]:
+                    prevmol = True
+                if "+" in a[i, j]:
+                    nextmol = True                                
+                
+            if not (prevmol and nextmol):
+                keep.append(i)
+        
+        if len(keep)>0:
+            return a[keep]
+        else:
+            return []
@@ -0,0 +1,205 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# import Geometry as G
+# R=G.rotation_matrix(np.array([0,0,1]),np.pi/2) #3x3 rotation matrix
+# R=G.rotation_matrix(axes,angles) #one rotation matrix per axis (stack of Nx3x3)
+# U,rmsd=G.kabsch(m1,m2) #rotation superimposing m2 onto m1 (m1 and m2 can be stacks of point sets)
+# crds=G.align_axes(crds) #center and align structure on its principal axes
+#
+# All functions operate on numpy arrays, and accept stacks (leading dimensions) of inputs.
+
+import numpy as np
+
+
+## compute matrix needed to rotate the system around an arbitrary axis (using Euler-Rodrigues formula).
+# @param axis 3d vector (numpy array), representing the axis around which to rotate. A stack of axes returns a stack of matrices.
+# @param theta desired rotation angle (one per axis, if axes are stacked)
+# @retval 3x3 rotation matrix, to be applied as np.dot(points,R)
+def rotation_matrix(axis,theta):
+
+    axis=np.asarray(axis,dtype=float)
+    theta=np.asarray(theta,dtype=float)
+
+    #if rotation angle is equal to zero, no rotation is needed
+    if np.all(theta==0):
+        return np.tile(np.identity(3),axis.shape[:-1]+(1,1))
+
+    #method taken from http://stackoverflow.com/questions/6802577/python-rotation-of-3d-vector
+    axis=axis/np.sqrt(np.sum(axis*axis,axis=-1))[...,np.newaxis]
+    b,c,d=np.moveaxis(-axis*np.sin(theta/2)[...,np.newaxis],-1,0)
+    a=np.broadcast_to(np.cos(theta/2),b.shape)
+    return np.moveaxis(np.array([[a*a+b*b-c*c-d*d, 2*(b*c-a*d), 2*(b*d+a*c)],
+                                 [2*(b*c+a*d), a*a+c*c-b*b-d*d, 2*(c*d-a*b)],
+                                 [2*(b*d-a*c), 2*(c*d+a*b), a*a+d*d-b*b-c*c]]),(0,1),(-2,-1))
+
+
+## compute rotation matrix superimposing m2 onto m1 (Kabsch algorithm), and corresponding RMSD.
+# @param m1 NxM numpy array (or stack of them)
+# @param m2 NxM numpy array (or stack of them)
+# @retval rotation matrix (to be applied as np.dot(m2,U)) and RMSD, one per point set if stacks are provided
+def kabsch(m1,m2):
+
+    L=m1.shape[-2]
+
+    #center point sets (copies, input is untouched)
+    m1=m1-np.mean(m1,axis=-2)[...,np.newaxis,:]
+    m2=m2-np.mean(m2,axis=-2)[...,np.newaxis,:]
+
+    E0=np.sum(m1*m1,axis=(-2,-1))+np.sum(m2*m2,axis=(-2,-1))
+
+    #V and Wt are the orthonormal bases that when multiplied by each other give the rotation matrix, U.
+    #S, (Sigma, from SVD) provides the error
+    V,S,Wt=np.linalg.svd(np.matmul(np.swapaxes(m2,-1,-2),m1))
+
+    #correct for reflections
+    flip=np.linalg.det(V)*np.linalg.det(Wt)<0
+    S[...,-1]=np.where(flip,-S[...,-1],S[...,-1])
+    V[...,:,-1]=np.where(flip[...,np.newaxis],-V[...,:,-1],V[...,:,-1])
+
+    RMSD=E0-(2.0*np.sum(S,axis=-1))
+    RMSD=np.sqrt(np.abs(RMSD/L))
+
+    return np.matmul(V,Wt),RMSD
+
+
+## return random normalized vectors orthogonal to the given ones.
+# @param normal 3d vector (or stack of vectors)
+# @retval orthogonal unit vector (or stack of vectors)
+def random_orthonormal(normal):
+
+    normal=np.asarray(normal,dtype=float)
+    a=np.moveaxis(normal,-1,0)
+    zero=np.zeros(a[0].shape)
+
+    #candidate orthogonal vectors, keep the one built discarding the smallest component
+    candidates=np.stack([np.stack([zero,-a[2],a[1]],axis=-1),
+                         np.stack([a[2],zero,-a[0]],axis=-1),
+                         np.stack([-a[1],a[0],zero],axis=-1)])
+    pick=np.argmin(np.fabs(normal),axis=-1)
+    u=np.take_along_axis(np.moveaxis(candidates,0,-2),pick[...,np.newaxis,np.newaxis],axis=-2)[...,0,:]
+    u/=np.linalg.norm(u,axis=-1)[...,np.newaxis]
+    v=np.cross(normal,u)
+    v/=np.linalg.norm(v,axis=-1)[...,np.newaxis]
+
+    alpha=np.random.uniform(0.0,np.pi*2,u.shape[:-1])[...,np.newaxis]
+    return np.cos(alpha)*u+np.sin(alpha)*v
+
+
+## draw random rotations, uniformly distributed (via random unit quaternions).
+# @param n number of rotations (a single one if not provided)
+# @retval 3x3 rotation matrix (or stack of n matrices), to be applied as np.dot(points,R)
+def random_rotation(n=None):
+
+    if n is None:
+        return random_rotation(1)[0]
+
+    u1,u2,u3=np.random.rand(3,n)
+    x=np.sqrt(1-u1)*np.sin(2*np.pi*u2)
+    y=np.sqrt(1-u1)*np.cos(2*np.pi*u2)
+    z=np.sqrt(u1)*np.sin(2*np.pi*u3)
+    w=np.sqrt(u1)*np.cos(2*np.pi*u3)
+
+    return np.moveaxis(np.array([[1-2*(y*y+z*z), 2*(x*y-z*w), 2*(x*z+y*w)],
+                                 [2*(x*y+z*w), 1-2*(x*x+z*z), 2*(y*z-x*w)],
+                                 [2*(x*z-y*w), 2*(y*z+x*w), 1-2*(x*x+y*y)]]),(0,1),(-2,-1))
+
+
+## place pseudoatoms given bond, angle and dihedral values with respect to three atoms (NERF).
+# coordinates and values broadcast against each other, a stack of positions is returned if any of them is stacked.
+# @param coor_bond position of atom bonded to pseudoatom
+# @param coor_angle position of atom defining angle with pseudoatom
+# @param coor_dihedral position of furthest atom, defining dihedral with pseudoatom
+# @param bond bond length
+# @param ang angle value (degrees)
+# @param di dihedral value (degrees)
+# @retval position of pseudoatom (or stack of positions)
+def place_pseudoatom(coor_bond,coor_angle,coor_dihedral,bond,ang,di):
+
+    angle=np.deg2rad(ang)
+    dihed=np.deg2rad(di)
+
+    ###inspired by https://github.com/molmod/molmod/blob/master/molmod/zmatrix.py###
+    #define frame axes
+    new_z=np.asarray(coor_angle,dtype=float)-coor_bond #pos of angle atom - pos of tail/head
+    norm_z=np.linalg.norm(new_z,axis=-1)[...,np.newaxis]
+    new_z=np.where(norm_z<1e-15,np.array([0.0,0.0,1.0]),new_z/np.where(norm_z<1e-15,1.0,norm_z))
+
+    new_x=np.asarray(coor_dihedral,dtype=float)-coor_bond #bond atom - origin
+    new_x=new_x-np.sum(new_x*new_z,axis=-1)[...,np.newaxis]*new_z
+    norm_x=np.linalg.norm(new_x,axis=-1)[...,np.newaxis]
+    if np.any(norm_x<1e-15):
+        new_x=np.where(norm_x<1e-15,random_orthonormal(new_z),new_x/np.where(norm_x<1e-15,1.0,norm_x))
+    else:
+        new_x=new_x/norm_x
+
+    #we must make our axes frame left handed due to the poor IUPAC definition of the sign of a dihedral angle.
+    new_y=-np.cross(new_z,new_x)
+
+    #coordinates of new atom
+    x=(bond*np.cos(dihed)*np.sin(angle))[...,np.newaxis]
+    y=(bond*np.sin(dihed)*np.sin(angle))[...,np.newaxis]
+    z=(bond*np.cos(angle))[...,np.newaxis]
+
+    return coor_bond+x*new_x+y*new_y+z*new_z
+
+
+## compute inertia tensor of a structure, with respect to origin.
+# @param points Nx3 numpy array
+# @param masses N masses (unitary if not provided)
+# @retval 3x3 inertia tensor
+def inertia_tensor(points,masses=None):
+
+    if masses is None:
+        c=np.dot(points.T,points)
+    else:
+        c=np.dot(points.T*masses,points)
+
+    return np.identity(3)*np.trace(c)-c
+
+
+## compute structure's principal axes, with respect to origin.
+# @param points Nx3 numpy array
+# @param masses N masses (unitary if not provided)
+# @retval 3x3 numpy array, axes as rows (ranked from smallest to biggest moment)
+def principal_axes(points,masses=None):
+
+    e_values,e_vectors=np.linalg.eigh(inertia_tensor(points,masses))
+    return e_vectors.T[np.argsort(e_values)]
+
+
+## center a structure to origin and align it on its principal axes.
+# first principal axis aligned along x, second along y and third along z.
+# @param points Nx3 numpy array
+# @param masses N masses (unitary if not provided)
+# @retval aligned coordinates
+def align_axes(points,masses=None):
+
+    points=points-np.mean(points,axis=0)
+    axes=principal_axes(points,masses)
+
+    #keep a right handed frame, so that alignment is a rotation
+    if np.linalg.det(axes)<0:
+        axes[2]*=-1
+
+    return np.dot(points,axes.T)
+
+
+## size of the box enclosing a structure.
+# @param points Nx3 numpy array (or stack of them)
+# @retval extent along each axis
+def extent(points):
+    return np.max(points,axis=-2)-np.min(points,axis=-2)
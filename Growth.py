@@ -0,0 +1,84 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# from Growth import Grower
+# g=Grower(0.9)
+# unsolved=g.grow([p1,p2,p3],["AAB","AAB","BBA"],50.0) #three chains grown together in a periodic cubic box of side 50
+# crds=p1.get_xyz() #unwrapped coordinates of first chain
+#
+# Polymers are grown with their own settings (search grid, clash threshold...), and share a periodic spatial index.
+
+import numpy as np
+import logging
+from CellList import CellList
+import Geometry as G
+
+class Grower(object):
+
+    ## growth of several polymer chains at the same time, in a periodic cubic box.
+    # the first monomer of every chain is inserted at a random position and orientation, away from those already
+    # inserted. Chains are then extended one monomer per round, in a random order at every round,
+    # so that all of them compete for space. Clashes are detected against all atoms of all chains (and their periodic images).
+    # @param cutoff minimal distance between atoms
+    # @param attempts insertion attempts for the first monomer of a chain
+    # @param batch insertion attempts tested at once
+    def __init__(self,cutoff,attempts=1000,batch=16):
+
+        self.cutoff=cutoff
+        self.attempts=attempts
+        self.batch=batch
+
+        self.logger=logging.getLogger('assemble')
+
+
+    ## grow chains.
+    # @param polymers list of Polymer objects, one per chain (their content is replaced)
+    # @param chains sequence of monomers one letter codes of every chain
+    # @param box box side
+    # @retval number of monomers for which no clash free placement has been found
+    def grow(self,polymers,chains,box):
+
+        self.cells=CellList(self.cutoff,box=np.full(3,float(box)))
+        self.box=float(box)
+
+        unsolved=0
+        for p,chain in zip(polymers,chains):
+            rot,trans,solved=self._insert(p.db.molecules[chain[0]].get_xyz())
+            p.start_chain(chain,self.cells,rot,trans)
+            unsolved+=not solved
+
+        #one monomer per chain and round
+        growing=[p for p in polymers if p.nres<len(p.chain)]
+        while len(growing)>0:
+            for i in np.random.permutation(len(growing)):
+                unsolved+=not growing[i].grow_monomer()
+            growing=[p for p in growing if p.nres<len(p.chain)]
+
+        return unsolved
+
+
+    #random position and orientation of a monomer, not clashing with atoms already in box (the last attempt, if none is found)
+    def _insert(self,crds):
+
+        for start in range(0,self.attempts,self.batch):
+            n=min(self.batch,self.attempts-start)
+            rot=G.random_rotation(n)
+            trans=np.random.rand(n,3)*self.box
+            ok=np.flatnonzero(np.logical_not(self.cells.clash_batch(np.matmul(crds,rot)+trans[:,np.newaxis,:])))
+            if len(ok)>0:
+                return rot[ok[0]],trans[ok[0]],True
+
+        return rot[-1],trans[-1],False
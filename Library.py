@@ -0,0 +1,227 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# import Library as L
+# L.write("database.lib",molecules,"gromacs") #compile loaded molecules (dictionary, one letter code as key)
+# r=L.Reader("database.lib","gromacs")
+# if r.available("A",pdbfile,topfile): #molecule A is in library, its source files are the provided ones and are unchanged
+#     m=r.get("A")
+#
+# A library is a single binary file: a text header line (format version and header size), a JSON header
+# (mode, source files and molecules description) and arrays data. Arrays are read as views on the memory mapped file,
+# so that processes reading the same library share its pages.
+
+import os
+import json
+import mmap
+import hashlib
+import numpy as np
+import Topology as T
+from Molecule import Molecule
+
+#format version, increase when library content changes
+VERSION=1
+
+#alignment of arrays in file, in bytes
+ALIGN=64
+
+#topology arrays stored in library (gromacs mode only)
+TOPOLOGY_ARRAYS=["bonds","angles","dihedrals","impropers","mapping"]
+
+
+## compute hash of a file content.
+# @param fname file name
+# @retval hexadecimal SHA1 digest
+def file_hash(fname):
+
+    h=hashlib.sha1()
+    f=open(fname,"rb")
+    for block in iter(lambda: f.read(1<<20),b""):
+        h.update(block)
+    f.close()
+    return h.hexdigest()
+
+
+## describe a source file: name, modification time, size and content hash.
+# @param fname file name
+# @retval list of values
+def source(fname):
+
+    s=os.stat(fname)
+    return [fname,s.st_mtime_ns,s.st_size,file_hash(fname)]
+
+
+#check that a source file is unchanged: same modification time and size, or same content
+def _unchanged(src):
+
+    fname,mtime,size,digest=src
+    try:
+        s=os.stat(fname)
+    except OSError:
+        return False
+
+    if s.st_mtime_ns==mtime and s.st_size==size:
+        return True
+
+    return file_hash(fname)==digest
+
+
+## write molecules in a library file (written in a temporary file first, and then renamed).
+# @param fname library file name
+# @param molecules dictionary of Molecule objects (one letter code as key)
+# @param mode pdb or gromacs
+def write(fname,molecules,mode):
+
+    arrays=[]
+    offset=0
+
+    #register an array to write, return its description
+    def add(a):
+        nonlocal offset
+        a=np.ascontiguousarray(a)
+        desc={"offset":offset,"dtype":a.dtype.str,"shape":list(a.shape)}
+        arrays.append(a)
+        offset+=(a.nbytes+ALIGN-1)//ALIGN*ALIGN
+        return desc
+
+    sources={}
+    items=[]
+    for code in molecules:
+        m=molecules[code]
+        for f in [m.pdbfile,m.topfile]:
+            if f!="" and f not in sources:
+                sources[f]=source(f)
+
+        item={"code":code,"pdbfile":m.pdbfile,"topfile":m.topfile,"atom":m.atom,"res":m.res,"chain":m.chain,"atomtype":m.atomtype,"limit":m.limit,"data":add(m.data)}
+        if mode=="gromacs":
+            t=m.topology
+            item["topology"]={"head":t.head,"tail":t.tail,"replace_cter":t.replace_cter,"replace_nter":t.replace_nter}
+            for name in TOPOLOGY_ARRAYS:
+                item["topology"][name]=add(getattr(t,name))
+        items.append(item)
+
+    header=json.dumps({"mode":mode,"sources":list(sources.values()),"molecules":items}).encode()
+    first=("ASSEMBLE_LIBRARY %s %s\n"%(VERSION,len(header))).encode()
+    start=(len(first)+len(header)+ALIGN-1)//ALIGN*ALIGN
+
+    tmp="%s.%s.tmp"%(fname,os.getpid())
+    f=open(tmp,"wb")
+    f.write(first)
+    f.write(header)
+    f.write(b"\0"*(start-len(first)-len(header)))
+    for a in arrays:
+        f.write(a.tobytes())
+        f.write(b"\0"*((a.nbytes+ALIGN-1)//ALIGN*ALIGN-a.nbytes))
+    f.close()
+    os.replace(tmp,fname)
+
+
+class Reader(object):
+
+    ## library file opened for reading (no molecule is available if it is missing, or has another format version or mode).
+    # @param fname library file name
+    # @param mode pdb or gromacs
+    def __init__(self,fname,mode):
+
+        self.items={}
+        self.sources={}
+        self.checked={}
+
+        try:
+            f=open(fname,"rb")
+        except IOError:
+            return
+
+        try:
+            w=f.readline().split()
+            if len(w)!=3 or w[0]!=b"ASSEMBLE_LIBRARY" or int(w[1])!=VERSION:
+                return
+
+            header=json.loads(f.read(int(w[2])).decode())
+            if header["mode"]!=mode:
+                return
+
+            self.start=(f.tell()+ALIGN-1)//ALIGN*ALIGN
+            self.buf=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            self.items=dict((item["code"],item) for item in header["molecules"])
+            self.sources=dict((src[0],src) for src in header["sources"])
+
+        except (ValueError,KeyError,OSError):
+            self.items={}
+
+        finally:
+            f.close()
+
+
+    #the file mapping is not transferred to other processes (library may have been rewritten since), no molecule is available there
+    def __getstate__(self):
+        return {"items":{},"sources":{},"checked":{}}
+
+
+    ## check whether a molecule can be read from library: it has been compiled from the provided files, and they are unchanged.
+    # @param code one letter code
+    # @param pdbfile pdb file of molecule
+    # @param topfile topology file of molecule (empty string in pdb mode)
+    # @retval True if available
+    def available(self,code,pdbfile,topfile=""):
+
+        item=self.items.get(code)
+        if item is None or item["pdbfile"]!=pdbfile or item["topfile"]!=topfile:
+            return False
+
+        for f in [pdbfile,topfile]:
+            if f=="":
+                continue
+            if f not in self.checked:
+                self.checked[f]=f in self.sources and _unchanged(self.sources[f])
+            if not self.checked[f]:
+                return False
+
+        return True
+
+
+    #view on an array of the file
+    def _array(self,desc):
+        a=np.frombuffer(self.buf,dtype=np.dtype(desc["dtype"]),count=int(np.prod(desc["shape"])),offset=self.start+desc["offset"])
+        return a.reshape(desc["shape"])
+
+
+    ## read a molecule (arrays are read-only views on the library file).
+    # @param code one letter code
+    # @retval Molecule object
+    def get(self,code):
+
+        item=self.items[code]
+        m=Molecule()
+        m.pdbfile=item["pdbfile"]
+        m.topfile=item["topfile"]
+        m.atom=item["atom"]
+        m.res=item["res"]
+        m.chain=item["chain"]
+        m.atomtype=item["atomtype"]
+        m.limit=item["limit"]
+        m.data=self._array(item["data"])
+
+        if "topology" in item:
+            t=T.Topology()
+            for name in ["head","tail","replace_cter","replace_nter"]:
+                setattr(t,name,item["topology"][name])
+            for name in TOPOLOGY_ARRAYS:
+                setattr(t,name,self._array(item["topology"][name]))
+            m.topology=t
+
+        m._build_index()
+        return m
@@ -26,6 +26,7 @@
 #packages
 import numpy as np
 import Topology as T
+import Writer as W
 
 class Molecule:
 
@@ -40,6 +41,12 @@ class Molecule:
         #structure(whole pdb in numeric format, via hashtable)
         self.data=[]
 
+        #inverse hashtables (number to name, as arrays indexed by number), and rows where every atom name appears
+        self._atom_names=np.array([""])
+        self._res_names=np.array([""])
+        self._chain_names=np.array([""])
+        self._atom_rows={}
+
         #atoms connectivity (hash calling bonds, angles, and dihedrals, corresponding a table)
         self.topology=T.Topology()
         
@@ -122,6 +129,7 @@ class Molecule:
                                
                 
         self.data=np.array(data_in).astype(float)
+        self._build_index()
         
         if self.data.shape[0]<3:
             raise IOError("molecule %s should contain at least three atoms!")
@@ -154,9 +162,10 @@ class Molecule:
                 raise IOError("Atom %s found in topology but not on coordinates!"%self.topology.mapping[i,0])
         
         #verify also that every atom in structure corresponds to an atom in topology            
-        for i in range(0, len(self.atom), 1):
-            if not np.any(self.topology.mapping[:,0]==list(self.atom)[i]):
-                raise IOError("Atom %s found in topology but not on coordinates"%list(self.atom)[i])
+        names=set(self.topology.mapping[:,0])
+        for a in self.atom:
+            if a not in names:
+                raise IOError("Atom %s found in topology but not on coordinates"%a)
             
         #compute index of termini (extract termini name, and look for its index in pdb file)
         self.limit['head']=self.index_from_name(self.topology.head[0])
@@ -165,6 +174,39 @@ class Molecule:
         return
 
 
+    #build number to name arrays, and name to rows hashtable (called once structure is loaded)
+    def _build_index(self):
+
+        def inverse(table):
+            names=np.empty(len(table)+1,dtype=object)
+            names[0]=""
+            for k,v in table.items():
+                names[v]=k
+            return names
+
+        self._atom_names=inverse(self.atom)
+        self._res_names=inverse(self.res)
+        self._chain_names=inverse(self.chain)
+
+        ids=self.data[:,1].astype(int)
+        order=np.argsort(ids,kind="stable")
+        bounds=np.searchsorted(ids[order],np.arange(len(self._atom_names)+1))
+        self._atom_rows={}
+        for k,v in self.atom.items():
+            self._atom_rows[k]=order[bounds[v]:bounds[v+1]]
+
+
+    #make molecule data and topology read-only (used for templates shared between polymers)
+    def freeze(self):
+        
+        self.data.setflags(write=False)
+        
+        #topology is loaded in gromacs mode only
+        for name in ["bonds","angles","dihedrals","impropers","mapping"]:
+            if hasattr(self.topology,name):
+                getattr(self.topology,name).setflags(write=False)
+        
+
     def index_from_name(self,name):
         return int(self.atomselect("*","*",name,True)[0][0,0])
         
@@ -173,6 +215,11 @@ class Molecule:
         return self.data[:,5:8]
 
 
+    #name of every atom of the structure
+    def get_atomnames(self):
+        return self._atom_names[self.data[:,1].astype(int)]
+
+
     def set_xyz(self,coords):
         self.data[:,5:8]=coords
 
@@ -212,32 +259,32 @@ class Molecule:
 
     def atomselect(self,chain,res,atom,get_index=False):
 
-        #chain name boolean selector
-        if chain=='*':
-            chain_query=True
-        else:
-            chain_query=self.data[:,3]==self.chain[chain]
+        #selection by atom name only: rows are directly known
+        if chain=='*' and res=='*' and atom!='*':
+            if atom not in self.atom:
+                raise KeyError(atom)
+            query=self._atom_rows[atom]
 
-        #resid boolean selector
-        if res=='*':
-            res_query=True
         else:
-            res_query=self.data[:,4]==res
+            query=np.ones(len(self.data),dtype=bool)
 
-        #atom name boolean selector
-        if atom=='*':
-            atom_query=True
-        else:
-            atom_query=self.data[:,1]==self.atom[atom]
+            #chain name boolean selector
+            if chain!='*':
+                query&=self.data[:,3]==self.chain[chain]
 
-        #mask needed in case chain, res and atom selection are all set to true
-        select_all=self.data[:,0]!=-1
+            #resid boolean selector
+            if res!='*':
+                query&=self.data[:,4]==res
 
-        #slice data array and return result (colums 5 to 7 contain xyz coords)
-        query=np.logical_and(select_all,np.logical_and(np.logical_and(chain_query,res_query),atom_query))
+            #atom name boolean selector
+            if atom!='*':
+                query&=self.data[:,1]==self.atom[atom]
+
+            query=np.where(query)[0]
 
+        #slice data array and return result (colums 5 to 7 contain xyz coords)
         if get_index==True:
-            return [self.data[query],np.where(query==True)[0]]
+            return [self.data[query],query]
         else:
             #UPDATED! Was initially just return self.data[query]
             return self.data[query,5:8]
@@ -245,19 +292,18 @@ class Molecule:
     
     def mapping(self,data):
 
-        data_list=[]
-        for i in range(0,len(data),1):
-            #backmap to strings
-            atom=[k for k, v in self.atom.items() if v == data[i,1]][0]
-            res=[k for k, v in self.res.items() if v == data[i,2]][0]
-            chain=[k for k, v in self.chain.items() if v == data[i,3]][0]
-            #atomtype=[k for k, v in self.atomtype.items() if v == data[i,10]][0]
-            atomtype=""
-             
-            l=(int(self.data[i,0]),atom,res,chain,int(self.data[i,4]),self.data[i,5],self.data[i,6],self.data[i,7],self.data[i,8],self.data[i,9],atomtype)
-            data_list.append(l)
-    
-        return data_list
+        #backmap to strings
+        atom=self._atom_names[data[:,1].astype(int)].tolist()
+        res=self._res_names[data[:,2].astype(int)].tolist()
+        chain=self._chain_names[data[:,3].astype(int)].tolist()
+        #atomtype=[k for k, v in self.atomtype.items() if v == data[i,10]][0]
+        atomtype=[""]*len(data)
+
+        index=data[:,0].astype(int).tolist()
+        resid=data[:,4].astype(int).tolist()
+        values=data[:,5:10].tolist()
+
+        return [(index[i],atom[i],res[i],chain[i],resid[i])+tuple(values[i])+(atomtype[i],) for i in range(0,len(data),1)]
 
 
     def write_pdb(self,outname,data=[]):
@@ -270,12 +316,8 @@ class Molecule:
 
         f_out=open(outname,"w")
 
-        for i in range(0,len(data_list),1):
-
-            #create and write PDB line
-            l=(data_list[i][0],data_list[i][1],data_list[i][2],data_list[i][3],data_list[i][4],data_list[i][5],data_list[i][6],data_list[i][7],data_list[i][8],data_list[i][9],data_list[i][10])
-            L='ATOM  %5i  %-4s%-4s%1s%4i    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n'%l
-            f_out.write(L)            
+        #create and write PDB lines
+        W.write_rows(f_out,W.PDB_LINE,data_list)
 
         f_out.close()
         return
@@ -0,0 +1,162 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# from Packing import Packer
+# p=Packer(0.3)
+# com,rot,box=p.pack([crds1,crds1,crds2],10.0) #three molecules (centered coordinates) in a periodic cubic box of side 10
+# placed=np.dot(crds1,rot[0])+com[0]
+
+import numpy as np
+import logging
+from CellList import CellList
+import Geometry as G
+
+class Packer(object):
+
+    ## random packing of rigid molecules in a periodic cubic box.
+    # molecules are inserted one by one with random position and orientation, rejecting insertions closer than cutoff
+    # to any atom already placed (or to their periodic images). If a molecule cannot be inserted, the box is grown
+    # and insertion continues. Once all molecules are placed, the box is shrunk back in steps towards the
+    # requested size. After every change of box size, molecules which clash are reinserted
+    # (rigid molecules can get closer when their centers are scaled). Shrinking stops if reinsertion fails.
+    # @param cutoff minimal distance between atoms of different molecules
+    # @param attempts insertion attempts per molecule, before growing the box
+    # @param batch insertion attempts tested at once
+    # @param growth box size scaling factor, when an insertion fails
+    # @param shrink minimal box size scaling factor, per shrinking step
+    def __init__(self,cutoff,attempts=1000,batch=16,growth=1.05,shrink=0.98):
+
+        self.cutoff=cutoff
+        self.attempts=attempts
+        self.batch=batch
+        self.growth=growth
+        self.shrink=shrink
+
+        self.logger=logging.getLogger('assemble')
+
+
+    ## pack molecules.
+    # @param molecules list of Nx3 coordinates arrays (centered on origin), one per molecule to insert
+    # @param box requested box side
+    # @retval molecules centers (Mx3) and rotations (Mx3x3, to be applied as np.dot(crds,R)), and box side
+    def pack(self,molecules,box):
+
+        self.molecules=molecules
+        self.box=float(box)
+        self.com=np.zeros((len(molecules),3))
+        self.rot=np.tile(np.identity(3),(len(molecules),1,1))
+        self.placed=np.zeros(len(molecules),dtype=bool)
+        self._rebuild()
+
+        #largest molecules are inserted first (molecules removed when growing the box are inserted again)
+        order=np.argsort([-len(m) for m in molecules],kind="stable")
+        while not np.all(self.placed):
+            i=order[np.argmin(self.placed[order])]
+            if not self._insert(i):
+                self._scale(self.growth)
+                self.logger.info(">> could not insert molecule %s of %s, box side increased to %8.3f nm"%(np.sum(self.placed)+1,len(molecules),self.box))
+
+        #shrink box back towards requested size
+        while self.box>box*(1.0+1e-9):
+            if not self._compress(max(box/self.box,self.shrink)):
+                self.logger.info(">> could not shrink box further")
+                break
+
+        return self.com,self.rot,self.box
+
+
+    #coordinates of a molecule, given its rotation and center
+    def _place(self,i,rot,com):
+        return np.matmul(self.molecules[i],rot)+com[...,np.newaxis,:]
+
+
+    #spatial index of all placed molecules. Molecules clashing with those indexed before them are removed from box
+    def _rebuild(self):
+
+        self.cells=CellList(self.cutoff,box=np.full(3,self.box))
+        for i in np.flatnonzero(self.placed):
+            crds=self._place(i,self.rot[i],self.com[i])
+            if self.cells.clash(crds) or self._self_clash(crds):
+                self.placed[i]=False
+            else:
+                self.cells.add(crds)
+
+
+    #attempt inserting a molecule at random positions and orientations, return True if successful
+    def _insert(self,i):
+
+        for start in range(0,self.attempts,self.batch):
+            n=min(self.batch,self.attempts-start)
+            rot=G.random_rotation(n)
+            com=np.random.rand(n,3)*self.box
+            crds=self._place(i,rot,com)
+
+            ok=np.logical_not(self.cells.clash_batch(crds))
+            for j in np.flatnonzero(ok):
+                if self._self_clash(crds[j]):
+                    continue
+                self.com[i]=com[j]
+                self.rot[i]=rot[j]
+                self.placed[i]=True
+                self.cells.add(crds[j])
+                return True
+
+        return False
+
+
+    #check whether a molecule clashes with its own periodic images
+    def _self_clash(self,crds):
+
+        #molecule is far from its images
+        if np.all(G.extent(crds)+self.cutoff<=self.box):
+            return False
+
+        #couples of atoms close only through periodic boundaries
+        c=CellList(self.cutoff,box=np.full(3,self.box))
+        c.add(crds)
+        query,stored=c.pairs(crds)
+        d=crds[stored]-crds[query]
+        image=np.any(np.round(d/self.box)!=0,axis=1)
+        if not np.any(image):
+            return False
+
+        d=d[image]
+        d-=self.box*np.round(d/self.box)
+        return np.any(np.sum(d**2,axis=1)<self.cutoff**2)
+
+
+    #scale box and molecules positions (molecules are rigid, those clashing after that are removed from box)
+    def _scale(self,factor):
+
+        self.box*=factor
+        self.com*=factor
+        self._rebuild()
+
+
+    #shrink box, and reinsert molecules clashing after that. Return False (and restore box) if not possible
+    def _compress(self,factor):
+
+        state=[self.box,self.com.copy(),self.rot.copy(),self.placed.copy()]
+
+        #keep molecules not clashing with those kept before them, and reinsert the others
+        self._scale(factor)
+        for i in np.flatnonzero(np.logical_not(self.placed)):
+            if not self._insert(i):
+                self.box,self.com,self.rot,self.placed=state
+                self._rebuild()
+                return False
+
+        return True
@@ -29,19 +29,40 @@ class Parser:
 		self.add('default_angle','default_angle','float',114)
 		self.add('default_dihedral','default_dihedral','float',120)
 		self.add('clash_threshold','clash_thresh','float',0.9)
+		self.add('search_batch','search_batch','int',64)
+		self.add('spin_step','spin_step','float',10.0)
+		self.add('growth_engine','engine','str',"grid")
+		self.add('cbmc_trials','cbmc_trials','int',8)
+		self.add('cbmc_backoff','cbmc_backoff','int',3)
+		self.add('cbmc_regrowths','cbmc_regrowths','int',10)
+		self.add('temperature','temperature','float',300.0)
+		self.add('precision','precision','str',"double")
+		self.add('workers','workers','int',1)
+		self.add('seed','seed','int',-1)
 		self.add('interchain_dist','interchain_dist','float',0.2)
 		self.add('gromacs_nrxl','gromacs_nrxl','int',3)
         
 		self.add('database','db','str',"")
+		self.add('database_cache','db_cache','str',"none")
 		self.add('residue','residue','dictionary',{})
 		
 		self.add('molecule','molecule','array str',np.array([]))
 		self.add('chain','chain','dictionary',{})
 		self.add('composition','percentage','dictionary',{})
 		self.add('length','length','dictionary',{})
+		self.add('chain_model','chain_model','dictionary',{})
+		self.add('transition','transition','dictionary',{})
+		self.add('length_distribution','length_distribution','dictionary',{})
+		self.add('chain_count','chain_count','dictionary',{})
 		
 		self.add('concentration','concentration','dictionary',{})		
 		self.add('box_grid_shape','box_grid_shape','array int',np.array([0.0,0.0,0.0]))
+		self.add('box_sampling','box_sampling','str',"random")
+		self.add('packing','packing','str',"grid")
+		self.add('density','density','float',0.5)
+		self.add('packing_attempts','packing_attempts','int',1000)
+		self.add('conformers','conformers','int',1)
+		self.add('concentration_unit','concentration_unit','str',"number")
 				
 		self.add('system_name','output','str',"system")
 		self.add('output_folder','output_folder','str',".")
@@ -117,6 +138,54 @@ class Parser:
 			print("ERROR: forcefield file not found!")
 			sys.exit(1)
 		
+		if self.engine not in ["grid","adaptive","cbmc"]:
+			print("ERROR: growth_engine should be equal to grid, adaptive or cbmc!")
+			sys.exit(1)
+
+		if self.engine!="grid" and self.mode!="gromacs":
+			print("ERROR: %s growth engine requires gromacs mode!"%self.engine)
+			sys.exit(1)
+
+		if self.cbmc_trials<1 or self.cbmc_backoff<0 or self.cbmc_regrowths<0:
+			print("ERROR: cbmc_trials should be positive, cbmc_backoff and cbmc_regrowths not negative!")
+			sys.exit(1)
+
+		if self.precision!="double" and self.precision!="single":
+			print("ERROR: precision should be equal to double or single!")
+			sys.exit(1)
+
+		if self.spin_step<=0 or self.spin_step>360:
+			print("ERROR: spin_step should be an angle between 0 (excluded) and 360 degrees!")
+			sys.exit(1)
+
+		if self.search_batch<1:
+			print("ERROR: search_batch should be a positive integer!")
+			sys.exit(1)
+
+		if self.workers<1:
+			print("ERROR: workers should be a positive integer!")
+			sys.exit(1)
+
+		if self.box_sampling!="random" and self.box_sampling!="exact":
+			print("ERROR: box_sampling should be equal to random or exact!")
+			sys.exit(1)
+
+		if self.packing!="grid" and self.packing!="random" and self.packing!="growth":
+			print("ERROR: packing should be equal to grid, random or growth!")
+			sys.exit(1)
+
+		if self.density<=0 or self.packing_attempts<1:
+			print("ERROR: density and packing_attempts should be positive!")
+			sys.exit(1)
+
+		if self.conformers<1:
+			print("ERROR: conformers should be a positive integer!")
+			sys.exit(1)
+
+		if self.concentration_unit!="number" and self.concentration_unit!="mass":
+			print("ERROR: concentration_unit should be equal to number or mass!")
+			sys.exit(1)
+
 		if len(self.molecule)==0:
 			print("ERROR: no molecule name has been provided (keyword \"molecule\")!")
 			sys.exit(1)
@@ -152,7 +221,7 @@ class Parser:
 	
 				p=[]
 				cnt=0
-				for x in range(0,len(self.percentage[m])/2,1):
+				for x in range(0,len(self.percentage[m])//2,1):
 					try:
 						p_f=float(self.percentage[m][x*2+1])
 					except ValueError:
@@ -167,6 +236,74 @@ class Parser:
 					return -1	
 				
 				self.percentage[m]=p
+
+			#reformat sequence model statement
+			if m in self.chain_model:
+				self.chain_model[m]=self.chain_model[m][0]
+				if self.chain_model[m] not in ["bernoulli","shuffle","markov","block"]:
+					print("ERROR: chain_model of molecule %s should be equal to bernoulli, shuffle, markov or block!"%m)
+					sys.exit(1)
+
+			#reformat transition statement into a matrix (rows and columns ordered as percentages)
+			if self.chain_model.get(m)=="markov":
+				if m not in self.transition or m not in self.percentage:
+					print("ERROR: markov chain_model of molecule %s requires composition and transition keywords!"%m)
+					sys.exit(1)
+
+				if len(self.transition[m])%3!=0:
+					print("ERROR: transition keyword should be a list of two one letter codes followed by a float!")
+					sys.exit(1)
+
+				codes=[c[0] for c in self.percentage[m]]
+				t=np.zeros((len(codes),len(codes)))
+				for x in range(0,len(self.transition[m])//3,1):
+					a,b,v=self.transition[m][x*3:x*3+3]
+					if a not in codes or b not in codes:
+						print("ERROR: transition %s %s of molecule %s involves a monomer not in its composition!"%(a,b,m))
+						sys.exit(1)
+					t[codes.index(a),codes.index(b)]=float(v)
+
+				if np.any(np.sum(t,axis=1)<=0):
+					print("ERROR: every monomer of molecule %s must have at least one transition!"%m)
+					sys.exit(1)
+
+				self.transition[m]=t
+
+			#reformat length distribution statement: distribution name and its parameters
+			if m in self.length_distribution:
+				v=self.length_distribution[m]
+				if m in self.chain or m not in self.percentage:
+					print("ERROR: length_distribution of molecule %s requires composition keyword, and no chain!"%m)
+					sys.exit(1)
+
+				try:
+					values=[float(x) for x in v[1:]]
+				except ValueError:
+					print("ERROR: length_distribution parameters of molecule %s should be numbers!"%m)
+					sys.exit(1)
+
+				if v[0]=="schulz_zimm" or v[0]=="lognormal":
+					if len(values)!=2 or values[0]<1 or values[1]<=0 or (v[0]=="lognormal" and values[1]<1):
+						print("ERROR: %s length_distribution of molecule %s requires number average length and %s!"%(v[0],m,"shape (k>0)" if v[0]=="schulz_zimm" else "dispersity (>=1)"))
+						sys.exit(1)
+				elif v[0]=="histogram":
+					if len(values)==0 or len(values)%2!=0 or np.any(np.array(values[0::2])<1) or np.any(np.array(values[1::2])<0) or np.sum(values[1::2])<=0:
+						print("ERROR: histogram length_distribution of molecule %s should be a list of lengths each followed by its weight!"%m)
+						sys.exit(1)
+				else:
+					print("ERROR: length_distribution of molecule %s should be equal to schulz_zimm, lognormal or histogram!"%m)
+					sys.exit(1)
+
+				self.length_distribution[m]=[v[0],values]
+
+				if m in self.chain_count:
+					self.chain_count[m]=int(self.chain_count[m][0])
+				else:
+					self.chain_count[m]=100
+
+				if self.chain_count[m]<1:
+					print("ERROR: chain_count of molecule %s should be a positive integer!"%m)
+					sys.exit(1)
 				
 			'''
 			#test concentration statement
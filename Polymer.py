@@ -15,49 +15,104 @@ import numpy as np
 from copy import deepcopy
 import logging
 from ForceField import ForceField
+from CellList import CellList
+import Geometry as G
+import Writer as W
 
 class Polymer(object):
 
     def __init__(self,db,ff,molname,mode,nrxl):
         self.db=db
-        self.poly=[]
+
+        #struct of arrays storage of the chain (buffers grow geometrically): coordinates (double or single precision)
+        #and atom name id of every atom, monomer type id and first atom index of every residue
+        self.precision="double"
+        self._xyz=np.zeros((0,3))
+        self._atomname=np.zeros(0,dtype=np.int32)
+        self._restype=np.zeros(0,dtype=np.int32)
+        self._resoffset=np.zeros(1,dtype=np.int64)
+        self.natoms=0
+        self.nres=0
+
+        #names tables: monomer code of every type id, atom name of every atom name id
+        self.codes=[]
+        self.atomnames=[]
+        self._atomname_ids={}
+
         self.ff=ff
         self.molname=molname
         self.nrxl=nrxl
         self.mode=mode        
         self.clash_thresh=0.9
+        self.search_batch=64
+        self.spin_step=10
+
+        #growth engine (grid scan, coarse to fine search or configurational-bias), and engines parameters
+        self.engine="grid"
+        self.search_steps=[30,10,5]
+        self.refine_best=3
+        self.cbmc_trials=8
+        self.cbmc_backoff=3
+        self.cbmc_regrowths=10
+        self.temperature=300.0
+
+        #candidate placements tables per couple of monomer types, and rigid transformation
+        #bringing each residue template in its position in chain (valid while chain is grown)
+        self.candidates={}
+        self._rot=np.zeros((0,3,3))
+        self._trans=np.zeros((0,3))
         self.chain=""
         self.search_grid=self._make_search_grid()
         
         self.mass=0
+
+        #alternative conformations of the chain (stack of coordinates arrays), if generated
+        self.conformers=None
         
         self.logger=logging.getLogger('assemble')
  
 
-    #in gromacs mode, calculate mass of chain
+    #in gromacs mode, calculate mass of chain (from monomers properties tables of database)
     def get_mass(self):
         
         if len(self.chain)==0:
             raise Exception("no chain provided!")
-        
-        mass=0
-        
-        for c in self.chain:
-            mol = self.db.molecules[c]
-            mapping = mol.topology.mapping
-            for l in mol.data[:, 0]:
-                atomname = list(mol.atom)[np.where(list(mol.atom.values())==l)[0][0]]
-                
-                try:
-                    atomtype=mapping[np.where(mapping==atomname)[0],1][0]
-                    thismass=self.ff.nonbonded[atomtype][1]
-                    mass+=float(thismass)
-
-                except Exception as e:
-                    raise Exception("Could not find mass of atom %s"%atomname)
-          
-        self.mass=mass  
-        return mass
+
+        self.mass=self.db.get_chain_mass(self.chain)
+        return self.mass
+
+
+    #monomer code and properties variant of chain termini
+    def _terminals(self):
+        if len(self.chain)==1:
+            return [(self.chain[0],"both")]
+        else:
+            return [(self.chain[0],"nterminal"),(self.chain[-1],"cterminal")]
+
+
+    ## get atom type id (index in database atomtypes), mass and charge of every atom in chain.
+    # values are gathered from monomers properties tables of database, with terminal variants for chain termini.
+    # @retval atom types, masses and charges numpy arrays
+    def get_atom_properties(self):
+
+        props=[self.db.get_properties(c) for c in self.codes]
+        idx=self._template_rows()
+
+        values=[]
+        for key in ["types","mass","charge"]:
+            v=np.concatenate([p[key] for p in props])[idx]
+            values.append(v)
+
+        #terminal monomers
+        offsets=self.get_residue_offsets()
+        termini=self._terminals()
+        for resid,t in zip([0,self.nres-1][:len(termini)],termini):
+            p=self.db.get_properties(t[0],t[1])
+            for v,key in zip(values,["types","mass","charge"]):
+                v[offsets[resid]:offsets[resid+1]]=p[key]
+
+        return values
+
     
         
     def make(self,chain):
@@ -78,257 +133,79 @@ class Polymer(object):
             
             self.logger.info(">> mass: %s Da"%self.mass)
         
-        #add first element in the chain
-        m = deepcopy(self.db.molecules[self.chain[0]])
-        self.poly.append(m)
+        #preallocate buffers for the whole chain
+        self._clear()
+        self._reserve(np.sum([len(self.db.molecules[c].data) for c in self.chain]),len(self.chain))
+
+        #add first element in the chain (its template frame is the reference one)
+        self._add_monomer(self.chain[0],self.db.molecules[self.chain[0]].get_xyz(),np.identity(3),np.zeros(3))
+        self.candidates={}
+
+        #spatial index of the growing chain, used for clash detection
+        self.cell_list=CellList(self.clash_thresh,source=self._xyz_buffer)
+        self.cell_list.add(self.get_xyz())
+
+        #coarse to fine search measures clearance of candidates from the chain, over a larger range
+        if self.engine=="adaptive":
+            self.clearance_cells=CellList(max(5.0,2*self.clash_thresh),source=self._xyz_buffer)
+            self.clearance_cells.add(self.get_xyz())
+            self.clearance=[]
+            evaluations=0
 
         #if debug: #DEBUG: print positions of HOOKS IN A SEPARATE FILE
         #    f_out = open("hooks.pdb", 'w')
                 
-        #iterate over chain string and build data structure
-        for x in range(1,len(self.chain),1):
-        
-            #get new monomer
-            m_new=deepcopy(self.db.molecules[self.chain[x]])
+        #configurational-bias growth (gromacs mode only), builds the whole chain
+        if self.mode=="gromacs" and self.engine=="cbmc":
+            self._grow_cbmc()
 
-            #get head (of new monomer) and tail (of chain) coordinates
-            tail=deepcopy(m.data[m.data[:,0]==int(m.limit['tail']),5:8][0])
-            head=deepcopy(m_new.data[m_new.data[:,0]==int(m_new.limit['head']),5:8][0])
+        #iterate over chain string and build data structure (scanning search grid)
+        for x in range(self.nres,len(self.chain),1):
+        
+            #get template of chain tail, and of new monomer (from database, it will be placed in the chain once positioned)
+            m=self.db.molecules[self.chain[x-1]]
+            m_new=self.db.molecules[self.chain[x]]
 
             #compute hooking point of existing polymer chain for new monomer
-            if self.mode=="pdb":
-                tail_hook=deepcopy(m.data[m.data[:,0]==int(m.limit['tail_hook']),5:8][0])
+            if self.mode=="pdb": #no clash detection for pdb mode
+
+                #get head (of new monomer) and tail (of chain) coordinates
+                crds_tail=self.get_residue_xyz(x-1)
+                tail=deepcopy(crds_tail[m.data[:,0]==int(m.limit['tail'])][0])
+                head=deepcopy(m_new.data[m_new.data[:,0]==int(m_new.limit['head']),5:8][0])
+                tail_hook=deepcopy(crds_tail[m.data[:,0]==int(m.limit['tail_hook'])][0])
                 head_hook=deepcopy(m_new.data[m_new.data[:,0]==int(m_new.limit['head_hook']),5:8][0])
 
-            else:
-                #get head and tail atomnames
-                tailname=m.topology.tail[0]
-                headname=m_new.topology.head[0]
-                
-                ###GET BOND###
-                #get bond type within head and tail (must be one and one only!)
-                b1=m.topology.search_next_bond(tailname,headname) #with plus
-                b2=m_new.topology.search_prev_bond(tailname,headname) #with minus
-                
-                #check consistency between head and tail molecule topologies for bonds
-                b=[]              
-                if len(b1)>0 and len(b2)>0:             
-                    b=np.unique(np.concatenate((b1[:,2],b2[:,2])))
-                elif len(b1)>0 and len(b2)==0:
-                    b=np.unique(b1[:,2])
-                elif len(b1)==0 and len(b2)>0:
-                    b=np.unique(b2[:,2])
-                if len(b)>1:
-                    raise IOError("inconsistency in bond descriptions in topologies of %s and %s"%(self.chain[x],self.chain[x-1]))
-                if len(b)==0:
-                    #print "ERROR: connection between %s and %s not found!"%(tailname,headname)
-                    raise IOError("connection between %s and %s not found!"%(tailname,headname))
-               
-                #get bond distance in angstrom (same for both current and new molecules)
-                try:
-                    bond=self.ff.get_bond(b[0])
-                except:
-                    raise IOError("bond type %s not found in force field"%b[0])
-
-                ###GET DIHEDRAL CURRENT###
-                keep=[0]
-                a_tmp=m.topology.search_next_dihedral(tailname,headname,'+') #need 1 plus     
-                a=self._remove_prev_to_next(a_tmp) 
-                                                                                                                                                                                                                                                                                                       
-                #if search failed on current molecule, look for parameters on next one
-                if len(a)==0:  
-                    keep=[]                  
-                    a_tmp=m_new.topology.search_next_dihedral(tailname,headname,'-') #need double minus!
-                    a=self._remove_prev_to_next(a_tmp) 
-                    
-                    #verify existence of all atoms in current molecule, if getting info from next one, and reformat
-                    for i in range(0,len(a),1):
-                                       
-                        for j in range(0,4,1):
-                            if "-" in  a[i,j]:
-                                atomname=a[i,j].split("-")[1]
-                                if atomname in m.atom:
-                                    keep.append(i)
-                                    a[i,j]=atomname
-                            else:
-                                    keep.append(i)
-                                    atomname="+%s"%a[i,j]
-                                    a[i,j]=atomname
-                                    
-                #check if a match was found in topologies of current or next molecule
-                if len(keep)==0:
-                    raise IOError("no match found for dihedral for forward hook involving atoms\n %s in %s and %s in %s!"%(tailname, m.topfile, headname, m_new.topfile))
-  
-  
-                #get dihedral angle value
-                try:
-                    dihedral_val_tail=self.ff.get_dihedral(a[keep[0],4])
-                except:
-                    raise IOError("dihedral type %s not found in force field"%a[keep[0],4])  
-                
-                #extract names of atoms forming angle and dihedral with head and tail
-                if "+" in a[keep[0],0] and a[keep[0],1]==tailname:
-                    anglename=a[keep[0],2]
-                    dihedralname=a[keep[0],3]
-                elif "+" in a[keep[0],3] and a[keep[0],2]==tailname:
-                    anglename=a[keep[0],1]
-                    dihedralname=a[keep[0],0]
-                else:
-                    IOError("umm... a dihedral potential looks weird...")
-                
-                               
-                #SEARCH FOR ANGLENAME AS WELL!
-                ###GET ANGLE CURRENT###
-                keep=[0]
-                a=m.topology.search_next_angle(tailname,headname,'+') #need 1 plus   
-                #if search failed on current molecule, look for parameters on next one
-                if len(a)==0:
-                    keep=[]                    
-                    a=m_new.topology.search_next_angle(tailname,headname,'-') #need double minus!
-                    #verify existence of all atoms in current molecule, if getting info from next one
-                    for i in range(0,len(a),1):
-                        for j in range(0,3,1):
-                            if "-" in  a[i,j]:
-                                atomname=a[i,j].split("-")[1]
-                                if  atomname in m.atom:
-                                    keep.append(i)
-                                    a[i,j]=atomname
-                            else:
-                                    keep.append(i)
-                                    atomname="+%s"%a[i,j]
-                                    a[i,j]=atomname
-                                              
-                #check that one solution was found
-                if len(keep)==0:
-                    raise IOError("no match found for angle for forward hook involving atoms\n %s in %s and %s in %s!"%(tailname, m.topfile, headname, m_new.topfile))
-                
-                try:
-                    angle_val_tail=self.ff.get_angle(a[keep[0],3])
-                except:
-                    raise IOError("angle type %s not found in force field"%a[keep[0],3])         
+                rot,trans=self._superimpose(tail,tail_hook,head_hook,head)
+                crds_new=np.dot(m_new.get_xyz(),rot)+trans
+                solved=True
 
-                
-                #compute hooking point position for current molecule
-                coor_bond_tail=m.atomselect("*","*",tailname)[0]
-                coor_angle_tail=m.atomselect("*","*",anglename)[0]
-                coor_dihedral_tail=m.atomselect("*","*",dihedralname)[0]
-                tail_hook=self._place_pseudoatom(coor_bond_tail,coor_angle_tail,coor_dihedral_tail,bond,angle_val_tail,dihedral_val_tail)
-
-                ###GET DIHEDRAL NEXT###
-                keep=[0]
-                a_tmp=m_new.topology.search_prev_dihedral(tailname,headname,'-') #need 1 minus 
-                a=self._remove_prev_to_next(a_tmp) 
-                
-                #if search failed on current molecule, look for parameters on next one
-                if len(a)==0:  
-                    keep=[]                  
-                    a_tmp=m.topology.search_prev_dihedral(tailname,headname,'+') #need double plus!
-                    a=self._remove_prev_to_next(a_tmp) 
-                    
-                    #verify existence of all atoms in current molecule, if getting info from next one
-                    for i in range(0,len(a),1):
-                        for j in range(0,4,1):
-                            if "+" in a[i,j]:
-                                atomname=a[i,j].split("+")[1]
-                                if  atomname in m.atom:
-                                    keep.append(i)
-                                    a[i,j]=atomname
-                            else:
-                                    keep.append(i)
-                                    atomname="-%s"%a[i,j]
-                                    a[i,j]=atomname
-                                
-                #check that one solution was found
-                if len(keep)==0:
-                    raise IOError("no match found for dihedral for backward hook involving atoms\n %s in %s and %s in %s!"%(headname, m_new.topfile,tailname, m.topfile))
-                
-                try:
-                    dihedral_val_head=self.ff.get_dihedral(a[keep[0],4])
-                except:
-                    raise IOError("dihedral type %s not found in force field"%a[keep[0],4])
-                
-                #extract names of atoms forming angle and dihedral with head and tail
-                if "-" in a[keep[0],0] and a[keep[0],1]==headname:
-                    anglename=a[keep[0],2]
-                    dihedralname=a[keep[0],3]
-                elif "-" in a[keep[0],3] and a[keep[0],2]==headname:
-                    anglename=a[keep[0],1]
-                    dihedralname=a[keep[0],0]
+            else:
+                #get candidate placements of new monomer, in the frame of the template of the chain tail
+                candidates=self._get_candidates(self.chain[x-1],self.chain[x])
+
+                rot_tail=self._rot[x-1]
+                trans_tail=self._trans[x-1]
+
+                #coarse to fine search, keeping placement with largest clearance
+                if self.engine=="adaptive":
+
+                    #rotation around the new bond is not constrained by hooks, pick one at random.
+                    #candidates clashing with the tail monomer alone are skipped
+                    spin=np.random.randint(0,int(np.ceil(360.0/self.spin_step)))
+                    todo=np.flatnonzero(np.logical_not(self._self_clash(candidates,spin)))
+                    crds_new,rot,trans,solved,cnt=self._search_adaptive(candidates,spin,todo,m_new,rot_tail,trans_tail)
+                    evaluations+=cnt
+                    self.logger.debug(">> monomer %s: %s candidates tested, clearance %.2f A"%(x,cnt,self.clearance[-1]))
                 else:
-                    IOError("%s dihedral potential looks weird..."%a[keep[0],:])
-                 
-                ###GET ANGLE NEXT###
-                keep=[0]
-                a=m_new.topology.search_prev_angle(tailname,headname,'-') #need 1 minus 
-                #if search failed on current molecule, look for parameters on next one
-                if len(a)==0:                    
-                    a=m.topology.search_prev_angle(tailname,headname,'+') #need double plus!
-                    #verify existence of all atoms in current molecule, if getting info from next one
-                    keep=[]
-                    for i in range(0,len(a),1):
-                        for j in range(0,3,1):
-                            if "+" in  a[i,j]:
-                                atomname=a[i,j].split("+")[1]
-                                if atomname in m.atom:
-                                    keep.append(i)
-                                    a[i,j]=atomname
-                            else:
-                                    keep.append(i)
-                                    atomname="-%s"%a[i,j]
-                                    a[i,j]=atomname
-                
-                #check that one solution was found
-                if len(keep)==0:
-                    raise IOError("no match found for angle for backward hook involving atoms\n %s in %s and %s in %s!"%(headname, m_new.topfile,tailname, m.topfile))
-               
-                try:
-                    angle_val_head=self.ff.get_angle(a[keep[0],3])
-                except:
-                    raise IOError("angle type %s not found in force field"%a[keep[0],3])
-
-                #compute hooking point position for next molecule
-                coor_bond_head=m_new.atomselect("*","*",headname)[0]
-                coor_angle_head=m_new.atomselect("*","*",anglename)[0]
-                coor_dihedral_head=m_new.atomselect("*","*",dihedralname)[0]
-                head_hook=self._place_pseudoatom(coor_bond_head,coor_angle_head,coor_dihedral_head,bond,angle_val_head,dihedral_val_head)
-            
-            #ADD NEW CHAIN WITH CLASH DETECTION, IF IN GROMACS MODE###
-            solved=False
-            for i in range(0,len(self.search_grid),1):
-                    
-                ###compute superimposition###
-                #prepare data to compute superimposition within previous tail and new head           
-                t=np.array([tail,tail_hook])        
-                h=np.array([head_hook,head])
-
-                COM_h=np.sum(h,axis=0)/float(len(h))
-                COM_t=np.sum(t,axis=0)/float(len(t))
-            
-                #compute the rotation matrix superimposing the current head with the previous tail
-                trans=self._rmsd(t,h)[0]
-
-                #bring new monomer to origin, rotate it, and translate it so that tail_hook superimposes with head
-                crds_new=np.dot(m_new.get_xyz()-COM_h,trans)+COM_t
-            
-                if self.mode=="pdb": #no clash detection for pdb mode
-                    solved=True
-                    break
-            
-                if not self._clash_test(crds_new,self.get_xyz()): #if new molecule is clash free, add to chain
-                    solved=True
-                    break
-                
-                #perturb hooks position
-                head_hook=self._place_pseudoatom(coor_bond_head,coor_angle_head,coor_dihedral_head,bond,angle_val_head,dihedral_val_head+self.search_grid[i,0])
-                tail_hook=self._place_pseudoatom(coor_bond_tail,coor_angle_tail,coor_dihedral_tail,bond,angle_val_tail,dihedral_val_tail+self.search_grid[i,1])
-                    
-                if solved:
-                    break
+                    crds_new,rot,trans,solved=self._scan_spins(candidates,m_new,rot_tail,trans_tail)
 
             if not solved:
-                self.logger.info(">> WARNING: unsolved clash between %s and %s. Continuing..."%(m.topfile, m_new.topfile))
+                self.logger.warning(">> WARNING: unsolved clash between %s and %s. Continuing..."%(m.topfile, m_new.topfile))
             
-            m_new.set_xyz(crds_new)
+            self.cell_list.add(crds_new)
+            if self.mode=="gromacs" and self.engine=="adaptive":
+                self.clearance_cells.add(crds_new)
 
             #coor_bond=m_new.atomselect("*","*",headname)[0]
             
@@ -353,22 +230,368 @@ class Polymer(object):
                 f_out.write(L)               
             '''    
                 
-            #push new monomer in chain
-            self.poly.append(m_new)
-            
-            #newly added monomer becomes first of existing chain (and therefore reference for next monomer to hook to the chain)
-            m=deepcopy(m_new)
+            #push new monomer in chain (it becomes the reference for next monomer to hook to the chain)
+            self._add_monomer(self.chain[x],crds_new,rot,trans)
 
 
         #if debug: #DEBUG: print positions of HOOKS IN A SEPARATE FILE       
         #    f_out.close()
 
+        if self.mode=="gromacs" and self.engine=="adaptive" and len(self.clearance)>0:
+            self.logger.info(">> coarse to fine search: %s evaluations, clearance of placements: min %.2f A, mean %.2f A"%(evaluations,np.min(self.clearance),np.mean(self.clearance)))
+
+        self._end_growth()
+
         #extract all atom coordinates and align them along inertia tensor
         crds=self.get_xyz()
-        crds=self._align_axes(crds)
+        crds=G.align_axes(crds)
         self.set_xyz(crds)
-        
-        
+
+
+    ## scan search grid for a random rotation around the new bond (not constrained by hooks), and for the other rotations
+    # in turn if no clash free placement is found. Candidates clashing with the tail monomer alone are skipped.
+    # @param candidates candidate placements table
+    # @param m_new template of new monomer
+    # @param rot_tail rotation of chain tail template
+    # @param trans_tail translation of chain tail template
+    # @retval coordinates, rotation and translation of new monomer, and True if clash free (if not, placement found for the first rotation)
+    def _scan_spins(self,candidates,m_new,rot_tail,trans_tail):
+
+        nspins=int(np.ceil(360.0/self.spin_step))
+        first=np.random.randint(0,nspins)
+
+        fallback=None
+        for k in range(0,nspins,1):
+            spin=(first+k)%nspins
+            todo=np.flatnonzero(np.logical_not(self._self_clash(candidates,spin)))
+            crds,rot,trans,solved=self._scan_grid(candidates,spin,todo,m_new,rot_tail,trans_tail)
+            if solved:
+                return crds,rot,trans,True
+            if fallback is None:
+                fallback=[crds,rot,trans,False]
+
+        return fallback
+
+
+    ## scan search grid in blocks of increasing size, moving all candidates of a block in the chain frame at once.
+    # The first clash free candidate in grid order is kept, if none is found the last candidate of the search grid is.
+    # @param candidates candidate placements table
+    # @param spin index of rotation around new bond
+    # @param allowed indices of candidates not clashing with the tail monomer alone
+    # @param m_new template of new monomer
+    # @param rot_tail rotation bringing chain tail template in chain frame
+    # @param trans_tail translation bringing chain tail template in chain frame
+    # @retval coordinates, rotation and translation of chosen placement, and True if clash free
+    def _scan_grid(self,candidates,spin,allowed,m_new,rot_tail,trans_tail):
+
+        start=0
+        block=1
+        while start<len(allowed):
+
+            rot,trans=self._candidate_frames(candidates,allowed[start:start+block],spin,rot_tail,trans_tail)
+            crds_block=np.matmul(m_new.get_xyz(),rot)+trans[:,np.newaxis,:]
+            clashes=self._clash_test(crds_block)
+
+            if not np.all(clashes): #if new molecule is clash free, add to chain
+                best=np.argmin(clashes)
+                return crds_block[best],rot[best],trans[best],True
+
+            start+=block
+            block=max(1,min(2*block,self.search_batch))
+
+        #no solution found, keep last candidate of search grid
+        rot,trans=self._candidate_frames(candidates,[len(self.search_grid)-1],spin,rot_tail,trans_tail)
+        return np.dot(m_new.get_xyz(),rot[0])+trans[0],rot[0],trans[0],False
+
+
+    ## start growing the chain monomer by monomer (see grow_monomer), placing its first monomer.
+    # the spatial index used for clash detection can be shared with other chains growing in the same space.
+    # @param chain sequence of monomers one letter codes
+    # @param cell_list CellList object, to which chain atoms are added
+    # @param rot rotation of first monomer template (to be applied as np.dot(crds,rot))
+    # @param trans translation of first monomer template
+    def start_chain(self,chain,cell_list,rot,trans):
+
+        self.chain=chain
+        self._clear()
+        self._reserve(np.sum([len(self.db.molecules[c].data) for c in self.chain]),len(self.chain))
+
+        crds=np.dot(self.db.molecules[self.chain[0]].get_xyz(),rot)+trans
+        self._add_monomer(self.chain[0],crds,rot,trans)
+        self.cell_list=cell_list
+        self.cell_list.add(crds)
+
+
+    ## append the next monomer to a chain started with start_chain (search grid scan).
+    # @retval True if a clash free placement has been found
+    def grow_monomer(self):
+
+        x=self.nres
+        m_new=self.db.molecules[self.chain[x]]
+        candidates=self._get_candidates(self.chain[x-1],self.chain[x])
+
+        crds_new,rot,trans,solved=self._scan_spins(candidates,m_new,self._rot[x-1],self._trans[x-1])
+
+        self.cell_list.add(crds_new)
+        self._add_monomer(self.chain[x],crds_new,rot,trans)
+        if self.nres==len(self.chain):
+            self._end_growth()
+
+        return solved
+
+
+    ## coarse to fine search of the placement of a new monomer.
+    # candidates are first probed on a coarse grid, search is then refined around the ones having the largest clearance
+    # (distance from chain atoms, except the monomer being hooked to). The clash free candidate with largest clearance is kept,
+    # if none is found all remaining candidates are tested. Candidates are tested in batches of search_batch, and search stops
+    # as soon as one is clear of the chain over the whole measured range (no better candidate can be found).
+    # @param candidates candidate placements table
+    # @param spin index of rotation around new bond
+    # @param allowed indices of candidates not clashing with the tail monomer alone
+    # @param m_new template of new monomer
+    # @param rot_tail rotation bringing chain tail template in chain frame
+    # @param trans_tail translation bringing chain tail template in chain frame
+    # @retval coordinates, rotation and translation of chosen placement, True if clash free, and number of tested candidates
+    def _search_adaptive(self,candidates,spin,allowed,m_new,rot_tail,trans_tail):
+
+        grid=self.search_grid
+        todo=np.zeros(len(grid),dtype=bool)
+        todo[allowed]=True
+
+        tested=[]
+        score=[]
+        frames=[]
+        crds=[]
+        clear=False
+        for level in range(0,len(self.search_steps),1):
+
+            if clear:
+                break
+
+            step=self.search_steps[level]
+            select=np.logical_and(todo,np.all(grid%step==0,axis=1))
+
+            #beyond coarse level, only look around the best candidates found so far
+            if level>0 and len(tested)>0:
+                window=self.search_steps[level-1]/2.0
+                best=np.concatenate(tested)[np.argsort(np.concatenate(score))[::-1][:self.refine_best]]
+                near=np.all(np.abs(grid[np.newaxis,:,:]-grid[best][:,np.newaxis,:])<=window,axis=2)
+                select=np.logical_and(select,np.any(near,axis=0))
+
+            selected=np.flatnonzero(select)
+            for start in range(0,len(selected),self.search_batch):
+                idx=selected[start:start+self.search_batch]
+                todo[idx]=False
+                results=self._clearance_test(candidates,idx,spin,m_new,rot_tail,trans_tail)
+                tested.append(idx)
+                score.append(results[0])
+                frames.append(results[1:3])
+                crds.append(results[3])
+
+                #candidate clear of the chain over the whole measured range, no refinement needed
+                if np.max(results[0])>=self.clearance_cells.cutoff:
+                    clear=True
+                    break
+
+        #no clash free placement found, test all remaining candidates
+        if len(tested)==0 or np.max(np.concatenate(score))<0:
+            remaining=np.flatnonzero(todo)
+            for start in range(0,len(remaining),256):
+                idx=remaining[start:start+256]
+                results=self._clearance_test(candidates,idx,spin,m_new,rot_tail,trans_tail)
+                tested.append(idx)
+                score.append(results[0])
+                frames.append(results[1:3])
+                crds.append(results[3])
+
+        cnt=int(np.sum([len(i) for i in tested]))
+
+        #no candidate at all (all clash with tail monomer), keep last candidate of search grid
+        if cnt==0:
+            rot,trans=self._candidate_frames(candidates,[len(grid)-1],spin,rot_tail,trans_tail)
+            self.clearance.append(0.0)
+            return np.dot(m_new.get_xyz(),rot[0])+trans[0],rot[0],trans[0],False,cnt
+
+        score=np.concatenate(score)
+        best=np.argmax(score)
+        rot=np.concatenate([f[0] for f in frames])[best]
+        trans=np.concatenate([f[1] for f in frames])[best]
+        self.clearance.append(max(score[best],0.0))
+
+        return np.concatenate(crds)[best],rot,trans,score[best]>=0,cnt
+
+
+    #place a stack of candidates, and measure their clearance from the chain (up to range of clearance cells).
+    #return clearance (-1 for clashing candidates), rotations, translations and coordinates of candidates
+    def _clearance_test(self,candidates,idx,spin,m_new,rot_tail,trans_tail):
+
+        rot,trans=self._candidate_frames(candidates,idx,spin,rot_tail,trans_tail)
+        crds=np.matmul(m_new.get_xyz(),rot)+trans[:,np.newaxis,:]
+
+        clearance=np.full(len(idx),self.clearance_cells.cutoff)
+        near=self.clearance_cells.neighbours(crds.reshape(-1,3))
+        near=near[near<self._resoffset[self.nres-1]]
+        if len(near)>0:
+            dists=np.sqrt(np.sum((crds[:,:,np.newaxis,:]-self.clearance_cells.points[near][np.newaxis,np.newaxis,:,:])**2,axis=3))
+            clearance=np.minimum(clearance,np.min(dists,axis=(1,2)))
+
+        clearance[self._clash_test(crds)]=-1
+
+        return clearance,rot,trans,crds
+
+
+    ## grow the chain by configurational-bias Monte Carlo.
+    # for every new monomer, a few random trial placements (search grid perturbation and spin around the new bond) are weighted
+    # by their Boltzmann factor, computed from a soft Lennard-Jones energy against the chain, and one is picked accordingly.
+    # When all trials clash (dead end), the last monomers are removed and regrown (up to cbmc_regrowths times per monomer).
+    def _grow_cbmc(self):
+
+        types,sigma,epsilon=self._get_nonbonded()
+        kT=0.0083144626*self.temperature #kJ/mol
+        nspins=int(np.ceil(360.0/self.spin_step))
+
+        #spatial index for energy evaluation, cells as large as the interaction range
+        self.energy_cells=CellList(2.5*np.max(sigma),source=self._xyz_buffer)
+        self.energy_cells.add(self.get_xyz())
+
+        logw=[] #log of Rosenbluth factor of each added monomer
+        trials=0
+        regrowths=0
+        dead_ends=np.zeros(len(self.chain),dtype=int) #regrowths triggered by every monomer
+        x=self.nres
+        while x<len(self.chain):
+
+            m_new=self.db.molecules[self.chain[x]]
+            candidates=self._get_candidates(self.chain[x-1],self.chain[x])
+            rot_tail=self._rot[x-1]
+            trans_tail=self._trans[x-1]
+
+            #generate random trial placements
+            idx=np.random.randint(0,len(self.search_grid),self.cbmc_trials)
+            spin=np.random.randint(0,nspins,self.cbmc_trials)
+            rot,trans=self._candidate_frames(candidates,idx,spin,rot_tail,trans_tail)
+            crds=np.matmul(m_new.get_xyz(),rot)+trans[:,np.newaxis,:]
+            trials+=self.cbmc_trials
+
+            #energy is not computed against the monomer trials are bonded to
+            energy=self._trial_energy(crds,types[self.natoms:self.natoms+len(m_new.data)],types,sigma,epsilon,self._resoffset[x-1])
+            clash=self._clash_test(crds)
+
+            if np.all(clash):
+
+                #dead end, remove last monomers (keeping the first one) and regrow them
+                if dead_ends[x]<self.cbmc_regrowths:
+                    dead_ends[x]+=1
+                    regrowths+=1
+                    n=min(self.cbmc_backoff,x-1)
+                    if n>0:
+                        self._remove_monomers(n)
+                        del logw[-n:]
+                        x-=n
+                    continue
+
+                #too many regrowths, keep trial having the lowest energy (reported once per monomer, which can be regrown again later)
+                if dead_ends[x]==self.cbmc_regrowths:
+                    dead_ends[x]+=1
+                    self.logger.warning(">> WARNING: unsolved clash between %s and %s. Continuing..."%(self.db.molecules[self.chain[x-1]].topfile, m_new.topfile))
+                best=np.argmin(energy)
+                logw.append(-np.inf)
+
+            else:
+                #pick a trial according to its Boltzmann weight (energies shifted for numerical stability)
+                e0=np.min(energy[np.logical_not(clash)])
+                w=np.exp(-(energy-e0)/kT)
+                w[clash]=0
+                best=np.random.choice(len(w),p=w/np.sum(w))
+                logw.append(np.log(np.sum(w)/len(w))-e0/kT)
+
+            self.cell_list.add(crds[best])
+            self.energy_cells.add(crds[best])
+            self._add_monomer(self.chain[x],crds[best],rot[best],trans[best])
+            x+=1
+
+        self.logger.info(">> configurational-bias growth: %s trials, %s regrowths, log Rosenbluth weight %.3f"%(trials,regrowths,np.sum(logw)))
+
+
+    #soft-core Lennard-Jones energy of a stack of trial placements, against chain atoms within interaction range.
+    #chain atoms from index excluded onwards (the monomer trials are bonded to) are ignored
+    def _trial_energy(self,crds,types_new,types,sigma,epsilon,excluded):
+
+        idx=self.energy_cells.neighbours(crds.reshape(-1,3))
+        idx=idx[idx<excluded]
+        if len(idx)==0:
+            return np.zeros(len(crds))
+
+        r2=np.sum((crds[:,:,np.newaxis,:]-self.energy_cells.points[idx][np.newaxis,np.newaxis,:,:])**2,axis=3)
+        s2=sigma[types_new[:,np.newaxis],types[idx][np.newaxis,:]]**2
+        e=epsilon[types_new[:,np.newaxis],types[idx][np.newaxis,:]]
+
+        #energy is finite at null distance, and neglected beyond cutoff
+        with np.errstate(divide='ignore'):
+            x=0.5+(r2/s2)**3
+        u=4*e*(1.0/x**2-1.0/x)
+        u[r2>self.energy_cells.cutoff**2]=0
+
+        return np.sum(u,axis=(1,2))
+
+
+    #nonbonded type index of every atom of the chain, and sigma (A) and epsilon (kJ/mol) between every couple of types
+    def _get_nonbonded(self):
+
+        names=self.db.atomtypes
+        params=np.array([self.ff.nonbonded[n][4:6] for n in names]).astype(float)
+
+        #convert force field parameters into sigma and epsilon, according to combination rule
+        comb=int(self.ff.combination[1])
+        if comb==1: #C6 and C12 provided
+            c6=params[:,0]
+            c12=params[:,1]
+            valid=np.logical_and(c6>0,c12>0)
+            sig=np.where(valid,(c12/np.where(valid,c6,1.0))**(1.0/6.0),0.0)*10.0
+            eps=np.where(valid,c6**2/(4.0*np.where(valid,c12,1.0)),0.0)
+        else:
+            sig=params[:,0]*10.0
+            eps=params[:,1]
+
+        if comb==2: #Lorentz-Berthelot
+            sigma=(sig[:,np.newaxis]+sig[np.newaxis,:])/2.0
+        else:
+            sigma=np.sqrt(sig[:,np.newaxis]*sig[np.newaxis,:])
+        epsilon=np.sqrt(eps[:,np.newaxis]*eps[np.newaxis,:])
+
+        #type of every atom in chain
+        types=np.concatenate([self.db.get_properties(c)["types"] for c in self.chain])
+
+        return types,sigma,epsilon
+
+
+    #remove the last monomers of the chain (while it is grown)
+    def _remove_monomers(self,n):
+
+        self.nres-=n
+        self.natoms=self._resoffset[self.nres]
+
+        self.cell_list.truncate(self.natoms)
+        self.energy_cells.truncate(self.natoms)
+
+
+    ## rebuild an already generated polymer (e.g. in another process) from its sequence and coordinates.
+    # residues are hooked to templates of the local database.
+    # @param chain sequence of monomers one letter codes
+    # @param crds Nx3 numpy array of all atoms coordinates
+    # @param mass polymer mass (gromacs mode)
+    def set_chain(self,chain,crds,mass=0):
+
+        self.chain=chain
+        self.mass=mass
+        self._clear()
+        self._reserve(len(crds),len(chain),False)
+
+        #transformations from templates are unknown (and not needed once chain is built)
+        for c in self.chain:
+            self._add_monomer(c,crds[self.natoms:self.natoms+len(self.db.molecules[c].data)])
+
+
     def write_polymer(self,typef="pdb", mypath="."):
                 
         #renumber atoms index and resid, set same chain name to all polymer
@@ -380,70 +603,175 @@ class Polymer(object):
         f_out.write("REMARK generated with Assemble.py, by Matteo Degiacomi and Valentina Erastova, 2014-2018\n")
         f_out.write("REMARK sequence: %s\n"%self.chain)
 
-        index=1    
-        for j in range(0,len(self.poly),1):
-            data_list=self.poly[j].mapping(self.poly[j].data)
-            
-            if typef=="pdb":
-                tail_hook=int(self.poly[j].limit['tail_hook'])
-                head_hook=int(self.poly[j].limit['head_hook'])
-            else:
-                tail_hook=""
-                head_hook=""
-            
-            for i in range(0,len(data_list),1):
-                #create and write PDB line of non pseudoatoms
-                if data_list[i][0]!=head_hook and data_list[i][0]!=tail_hook:        
-                #if True:       
-                    l=(index,data_list[i][1],data_list[i][2],'P',j+1,data_list[i][5],data_list[i][6],data_list[i][7],data_list[i][8],data_list[i][9],data_list[i][10])
-                    L='ATOM  %5i  %-4s%-4s%1s%4i    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n'%l
-                    f_out.write(L)        
-                    index+=1
+        names=self.get_atomnames()
+        resnames=self.get_resnames()
+        resids=self.get_resids()
+        crds=self.get_xyz()
+        occupancy=self._template_column(8)
+        beta=self._template_column(9)
+
+        #pseudoatoms (hooks) are not written
+        keep=np.ones(self.natoms,dtype=bool)
+        if typef=="pdb":
+            index=self._template_column(0)
+            for key in ['head_hook','tail_hook']:
+                hook=np.array([int(self.db.molecules[c].limit[key]) for c in self.codes])
+                keep[index==np.repeat(hook[self._restype[:self.nres]],np.diff(self._resoffset[:self.nres+1]))]=False
+
+        keep=np.flatnonzero(keep)
+        n=len(keep)
+        W.write_columns(f_out,W.PDB_LINE,[np.arange(1,n+1),names[keep],resnames[keep],['P']*n,resids[keep],crds[keep,0],crds[keep,1],crds[keep,2],occupancy[keep],beta[keep],[""]*n])
 
         f_out.close()
 
 
-    #return coordinates of all the atoms in the system
+    #return coordinates of all the atoms in the system (view on polymer coordinates buffer)
     def get_xyz(self):
+        return self._xyz[:self.natoms]
 
-        #count amount of atoms and extract all atomic coordinates
-        cnt=0
-        pos=[] #atom positions (need for easily computing box size)
-        for j in range(0,len(self.poly),1):
-            data_list=self.poly[j].mapping(self.poly[j].data)
-            cnt+=len(data_list)
-            for i in range(0,len(data_list),1):
-                pos.append([data_list[i][5],data_list[i][6],data_list[i][7]]) #store atom position
 
-        return np.array(pos)
+    #coordinates buffer of the chain (spatial indices of the chain read atoms positions there)
+    def _xyz_buffer(self):
+        return self._xyz
 
 
     #push atom coordinates in all molecules composing the polymer (suppose length matching)
     def set_xyz(self,crds):
+        self._xyz[:self.natoms]=crds
+
+
+    #coordinates of a residue (view on polymer coordinates buffer)
+    def get_residue_xyz(self,resid):
+        return self._xyz[self._resoffset[resid]:self._resoffset[resid+1]]
 
-        cnt=0
-        for j in range(0,len(self.poly),1):        
-            for i in range(0, len(self.poly[j].data),1):
-                self.poly[j].data[i][5]=crds[cnt,0]
-                self.poly[j].data[i][6]=crds[cnt,1]
-                self.poly[j].data[i][7]=crds[cnt,2]
-                cnt+=1
+
+    #index of the first atom of every residue, followed by the total amount of atoms
+    def get_residue_offsets(self):
+        return self._resoffset[:self.nres+1]
+
+
+    #name of every atom (numpy array of strings)
+    def get_atomnames(self):
+        return np.array(self.atomnames)[self._atomname[:self.natoms]]
+
+
+    #residue name of every atom (numpy array of strings)
+    def get_resnames(self):
+        names=np.array([list(self.db.molecules[c].res)[0] for c in self.codes])
+        return np.repeat(names[self._restype[:self.nres]],np.diff(self._resoffset[:self.nres+1]))
+
+
+    #residue number (starting from 1) of every atom
+    def get_resids(self):
+        return np.repeat(np.arange(1,self.nres+1),np.diff(self._resoffset[:self.nres+1]))
+
+
+    #value of a column of monomer templates data (e.g. atom index, occupancy, beta factor), for every atom
+    def _template_column(self,col):
+        return np.concatenate([self.db.molecules[c].data[:,col] for c in self.codes])[self._template_rows()]
+
+
+    #index of every atom in templates of all monomer types, stacked in type id order
+    def _template_rows(self):
+
+        start=np.cumsum([0]+[len(self.db.molecules[c].data) for c in self.codes])[:-1]
+        sizes=np.diff(self._resoffset[:self.nres+1])
+        rows=np.arange(self.natoms)-np.repeat(self._resoffset[:self.nres],sizes)
+        return np.repeat(start[self._restype[:self.nres]],sizes)+rows
+
+
+    #release data needed only while the chain is grown: residues transformations and spatial indices
+    def _end_growth(self):
+        self._rot=np.zeros((0,3,3))
+        self._trans=np.zeros((0,3))
+        self.cell_list=None
+        self.clearance_cells=None
+        self.energy_cells=None
+
+
+    #empty the chain storage
+    def _clear(self):
+        self.natoms=0
+        self.nres=0
+
+
+    #make sure buffers can host a given amount of atoms and residues, growing them geometrically if needed.
+    #residues transformations buffers are reserved only if frames is True
+    def _reserve(self,natoms,nres,frames=True):
+
+        if natoms>len(self._xyz):
+            size=max(natoms,2*len(self._xyz))
+            if self.precision=="single":
+                buf=np.zeros((size,3),dtype=np.float32)
+            else:
+                buf=np.zeros((size,3))
+            buf[:self.natoms]=self._xyz[:self.natoms]
+            self._xyz=buf
+
+            buf=np.zeros(size,dtype=np.int32)
+            buf[:self.natoms]=self._atomname[:self.natoms]
+            self._atomname=buf
+
+        if nres>len(self._restype):
+            size=max(nres,2*len(self._restype))
+
+            buf=np.zeros(size,dtype=np.int32)
+            buf[:self.nres]=self._restype[:self.nres]
+            self._restype=buf
+
+            buf=np.zeros(size+1,dtype=np.int64)
+            buf[:self.nres+1]=self._resoffset[:self.nres+1]
+            self._resoffset=buf
+
+        #transformations are kept in double precision, as they are chained along the whole polymer
+        if frames and nres>len(self._rot):
+            size=max(nres,2*len(self._rot))
+
+            buf=np.zeros((size,3,3))
+            buf[:self.nres]=self._rot[:self.nres]
+            self._rot=buf
+
+            buf=np.zeros((size,3))
+            buf[:self.nres]=self._trans[:self.nres]
+            self._trans=buf
+
+
+    #append a monomer to the chain, given its code, coordinates and the transformation moving its template there (if known)
+    def _add_monomer(self,code,crds,rot=None,trans=None):
+
+        #register monomer type, and names of its atoms
+        if code not in self._atomname_ids:
+            template=self.db.molecules[code]
+            ids=[]
+            for a in template.get_atomnames():
+                if a not in self.atomnames:
+                    self.atomnames.append(a)
+                ids.append(self.atomnames.index(a))
+            self._atomname_ids[code]=np.array(ids,dtype=np.int32)
+            self.codes.append(code)
+
+        n=len(crds)
+        self._reserve(self.natoms+n,self.nres+1,rot is not None)
+        self._xyz[self.natoms:self.natoms+n]=crds
+        self._atomname[self.natoms:self.natoms+n]=self._atomname_ids[code]
+        self._restype[self.nres]=self.codes.index(code)
+        if rot is not None:
+            self._rot[self.nres]=rot
+            self._trans[self.nres]=trans
+        self.natoms+=n
+        self.nres+=1
+        self._resoffset[self.nres]=self.natoms
     
     
     def write_gromacs(self,mypath="."):
 
         ###WRITE .GRO FILE###        
  
-        #count amount of atoms and extract all atomic coordinates
-        cnt=0
-        pos=[] #atom positions (need for easily computing box size)
-        for j in range(0,len(self.poly),1):
-            data_list=self.poly[j].mapping(self.poly[j].data)
-            cnt+=len(data_list)
-            for i in range(0,len(data_list),1):
-                pos.append([data_list[i][5]/10.0,data_list[i][6]/10.0,data_list[i][7]/10.0]) #store atom position
-        
+        #extract all atomic coordinates, atom and residue names
         self.p=self.get_xyz()/10.0
+        names=self.get_atomnames()
+        resnames=self.get_resnames()
+        offsets=self.get_residue_offsets()
 
         #compute box size and position of minimal value (needed to shift the protein in a region defined by the box)
         #NOTE: a 1A padding is added in every direction
@@ -457,26 +785,22 @@ class Polymer(object):
         f_out.write("%s\n"%len(self.p))
         
         #temporary storages for topology-related information
-        at=[] #atom topology information       
         b=[] #bonds topology
         a=[] #angles topology
         d=[] #dihedrals topology
         imp=[] #impropers topology
         
-        polymass=[]
-        
-        index=1 #atom counter
-        for j in range(0,len(self.poly),1):
-
-            data_list=self.poly[j].mapping(self.poly[j].data)
+        for j in range(0,self.nres,1):
 
             #get topology information of current molecule
-            top=self.poly[j].topology
+            top=self.db.molecules[self.chain[j]].topology
             
-            #if molecule is terminal, modify its topology accordingly
+            #if molecule is terminal, modify its topology accordingly (on a copy, templates are shared)
+            if j==0 or j==self.nres-1:
+                top=deepcopy(top)
             if j==0:
                 top.make_terminal("nterminal")
-            if j==len(self.poly)-1:
+            if j==self.nres-1:
                 top.make_terminal("cterminal")                
             
             #gather bonds, angles and dihedrals information for topologies
@@ -485,33 +809,11 @@ class Polymer(object):
             d.append(top.dihedrals)
             imp.append(top.impropers)
             
-            #@todo add helper lines in topology lines, defining what parameters are
-            for i in range(0,len(data_list),1):
-                #create and write line in gromacs format (.gro file)
-                #NOTE: the molecule is moved so that its minimal position is at the origin
-                #resname="%s%s"%(j+1,data_list[i][2])
-                #L='%7s%7s%5i%8.3f%8.3f%8.3f\n'%(resname,data_list[i][1],index,data_list[i][5]/10.0-minpos[0],data_list[i][6]/10.0-minpos[1],data_list[i][7]/10.0-minpos[2])
-                L='%5d%-5s%5s%5d%8.3f%8.3f%8.3f\n'%(j+1,data_list[i][2],data_list[i][1],index,data_list[i][5]/10.0-minpos[0],data_list[i][6]/10.0-minpos[1],data_list[i][7]/10.0-minpos[2])
-                f_out.write(L)
-                
-                ##store topology information for later writing
-                ##atomID, atomtype, resid, resname, atomname, charge group, charge, mass
-                #if j==0 and data_list[i][1]==top.head[0]:
-                #    atomtype=top.head[1]
-                #elif j==len(self.poly)-1 and data_list[i][1]==top.tail[0]:
-                #    atomtype=top.tail[1]
-                #else:
-                atomtype=top.mapping[top.mapping[:,0]==data_list[i][1],1][0]
-                    
-                mass=self.ff.nonbonded[atomtype][1]
-                charge=self.ff.nonbonded[atomtype][2]
-
-                at.append([index,atomtype,j+1,data_list[i][2],data_list[i][1],index,charge,mass])
-                polymass.append(float(mass))
-                
-                index+=1
-                if index>99999:
-                    index=0
+        #write all atoms lines in gromacs format (.gro file), wrapping residue and atom counts
+        #NOTE: the molecule is moved so that its minimal position is at the origin
+        resids=np.repeat(np.arange(1,self.nres+1),np.diff(offsets))
+        crds=self.p-minpos
+        f_out.write(W.format_gro(W.wrap(resids),W.gro_names(resnames,names),W.wrap(np.arange(1,len(self.p)+1)),crds[:,0],crds[:,1],crds[:,2]))
 
         #print box size at the end of gromacs coordinates file
         f_out.write("%10.5f%10.5f%10.5f\n"%(self.box[0],self.box[1],self.box[2]))
@@ -520,7 +822,14 @@ class Polymer(object):
         ###GENERATE TOPOLOGY FILE### 
         self.logger.info(">> writing Gromacs topology file %s.itp"%self.molname) 
         #prepare data structure for indexing in numpy format
-        atom_top=np.array(at).astype(str)
+        #atomID, atomtype, resid, resname, atomname, charge group, charge, mass (gathered from database properties tables)
+        types,masses,charges=self.get_atom_properties()
+        atomtypes=np.array(self.db.atomtypes)
+        ff_mass=np.array([self.ff.nonbonded[t][1] for t in self.db.atomtypes]) #force field text, as written in topology
+        ff_charge=np.array([self.ff.nonbonded[t][2] for t in self.db.atomtypes])
+        ff_charge=np.array([str(int(float(c))) for c in ff_charge]) #charges are written as integers
+        ids=W.wrap(np.arange(1,len(self.p)+1)).astype(str)
+        atom_top=np.column_stack([ids,atomtypes[types],resids.astype(str),resnames,names,ids,ff_charge[types],ff_mass[types]]).astype(str)
         
         f_out = open("%s/%s.itp"%(mypath,self.molname), 'w')
         f_out.write("; generated with Assemble.py, by Matteo Degiacomi and Valentina Erastova, 2014\n")
@@ -531,60 +840,33 @@ class Polymer(object):
         
         #write atoms lines
         f_out.write("\n [ atoms ]\n")
-        for j in range(0,len(atom_top),1):
-            f_out.write("%6s%11s%7s%7s%7s%7s%11s%11s\n"%(atom_top[j,0],atom_top[j,1],atom_top[j,2],atom_top[j,3],atom_top[j,4],atom_top[j,5],int(float(atom_top[j,6])),atom_top[j,7]))
+        W.write_columns(f_out,"%6s%11s%7s%7s%7s%7s%11s%11s\n",list(atom_top.T))
     
         #INSERT PARAMETERS VALUES FROM FORCE FIELD INSTEAD OF S-BN...
     
         #write bond lines
+        local=self._local_index()
         f_out.write("\n [ bonds ] \n")
-        for j in range(0,len(b),1):
-            for x in range(0,len(b[j]),1):
-                b0=self._get_index(atom_top,j,b[j][x][0])
-                b1=self._get_index(atom_top,j,b[j][x][1])
-                if b0!=False and b1!=False:
-                    vals_text='  '.join(self.ff.bonded[b[j][x][2]].astype(str))
-                    f_out.write("%5s %6s %6s %8s\n"%(b0,b1,self.ff.fftype[0],vals_text))
+        idx,keys=self._resolve_terms(b,2,local)
+        self._write_terms(f_out,idx,keys,self.ff.fftype[0])
 
         if self.nrxl>1:
             #write angles lines
             f_out.write("\n [ angles ] \n")
-            for j in range(0,len(a),1):
-                for x in range(0,len(a[j]),1):
-                    b0=self._get_index(atom_top,j,a[j][x][0])
-                    b1=self._get_index(atom_top,j,a[j][x][1])
-                    b2=self._get_index(atom_top,j,a[j][x][2])
-                    if b0!=False and b1!=False and b2!=False:
-                        vals_text='  '.join(self.ff.bonded[a[j][x][3]].astype(str))
-                        f_out.write("%5s %6s %6s %6s %8s\n"%(b0,b1,b2,self.ff.fftype[1],vals_text))
+            idx,keys=self._resolve_terms(a,3,local)
+            self._write_terms(f_out,idx,keys,self.ff.fftype[1])
 
         if self.nrxl>2:
             #write dihedrals lines
             f_out.write("\n [ dihedrals ] \n")
-            for j in range(0,len(d),1):
-                for x in range(0,len(d[j]),1):
-                    b0=self._get_index(atom_top,j,d[j][x][0])
-                    b1=self._get_index(atom_top,j,d[j][x][1])
-                    b2=self._get_index(atom_top,j,d[j][x][2])
-                    b3=self._get_index(atom_top,j,d[j][x][3])
-                               
-                    if b0!=False and b1!=False and b2!=False and b3!=0:
-                        vals_text='  '.join(self.ff.bonded[d[j][x][4]].astype(str))
-                        f_out.write("%5s %6s %6s %6s %6s %8s\n"%(b0,b1,b2,b3, self.ff.fftype[2], vals_text))
+            idx,keys=self._resolve_terms(d,4,local)
+            self._write_terms(f_out,idx,keys,self.ff.fftype[2])
 
         if self.nrxl>2:
             #write impropers lines
             #f_out.write("\n [ impropers ] \n")
-            for j in range(0,len(imp),1):
-                for x in range(0,len(imp[j]),1):
-                    b0=self._get_index(atom_top,j,imp[j][x][0])
-                    b1=self._get_index(atom_top,j,imp[j][x][1])
-                    b2=self._get_index(atom_top,j,imp[j][x][2])
-                    b3=self._get_index(atom_top,j,imp[j][x][3])
-                               
-                    if b0!=False and b1!=False and b2!=False and b3!=0:
-                        vals_text='  '.join(self.ff.bonded[imp[j][x][4]].astype(str))
-                        f_out.write("%5s %6s %6s %6s %6s %8s\n"%(b0,b1,b2,b3,self.ff.fftype[3],vals_text))
+            idx,keys=self._resolve_terms(imp,4,local)
+            self._write_terms(f_out,idx,keys,self.ff.fftype[3])
 
 
         f_out.write("\n#ifdef POSRES\n#include \"posre.itp\"\n#endif\n")
@@ -593,7 +875,7 @@ class Polymer(object):
         
         # print infos about polymer
         self.logger.info(">> number of beads  :  %s", len(self.p))
-        self.logger.info(">> molecular weight :  %s g/mol", sum(polymass))
+        self.logger.info(">> molecular weight :  %s g/mol", np.sum(masses))
         
 
         return
@@ -615,230 +897,197 @@ class Polymer(object):
         
         return np.array(a)
   
-    #check whether two ensembles of points have a couple at a distance less than a given threshold
+    #check whether points have an atom of the chain at a distance less than a given threshold
+    #(only atoms in neighbouring cells of the chain spatial index are tested)
+    #points can be a single set of coordinates, or a stack of candidate placements (one boolean per candidate returned)
     #return true if clash detected, false otherwise
-    def _clash_test(self,points1,points2):
-        
-        for i in range(0,len(points1),1):
-            dists=np.sqrt(np.sum((points2-points1[i])**2,axis=1))
-            if np.any(dists<self.clash_thresh):
-                return True
-        
-        return False
-    
-    ## compute matrix needed to rotate the system around an arbitrary axis (using Euler-Rodrigues formula).
-    # @param axis 3d vector (numpy array), representing the axis around which to rotate
-    # @param theta desired rotation angle
-    # @retval 3x3 rotation matrix
-    def _rotation_matrix(self, axis, theta):
-
-        #if rotation angle is equal to zero, no rotation is needed
-        if theta==0:
-                return np.identity(3)
-
-        #method taken from http://stackoverflow.com/questions/6802577/python-rotation-of-3d-vector
-        axis = axis/np.sqrt(np.dot(axis,axis))
-        a = np.cos(theta/2)
-        b,c,d = -axis*np.sin(theta/2)
-        return np.array([[a*a+b*b-c*c-d*d, 2*(b*c-a*d), 2*(b*d+a*c)],
-                         [2*(b*c+a*d), a*a+c*c-b*b-d*d, 2*(c*d-a*b)],
-                         [2*(b*d-a*c), 2*(c*d+a*b), a*a+d*d-b*b-c*c]])
+    def _clash_test(self,points):
+        if points.ndim==3:
+            return self.cell_list.clash_batch(points)
+        else:
+            return self.cell_list.clash(points)
 
-  
-  
-    ## compute Structure's principal axes.
-    # @retval 3x3 numpy array, containing the 3 principal axes ranked from smallest to biggest.
-    def _get_principal_axes(self,points):
-        #method taken from chempy source code, geometry.py, method getMomentOfInertiaTensor()
-
-        #compute moment of inertia tensor
-        I0 = np.zeros((3,3), np.float64)
-        for i in range(0,len(points),1):
-            mass = 1#self.mass[atom] / constants.Na
-            I0[0,0] += mass * (points[i,1] * points[i,1] + points[i,2] * points[i,2])
-            I0[1,1] += mass * (points[i,0] * points[i,0] + points[i,2] * points[i,2])
-            I0[2,2] += mass * (points[i,0] * points[i,0] + points[i,1] * points[i,1])
-            I0[0,1] -= mass * points[i,0] * points[i,1]
-            I0[0,2] -= mass * points[i,0] * points[i,2]
-            I0[1,2] -= mass * points[i,1] * points[i,2]
-
-        I0[1,0] = I0[0,1]
-        I0[2,0] = I0[0,2]
-        I0[2,1] = I0[1,2]
-
-        #Calculate and return the principal moments of inertia and corresponding
-        #principal axes for the current geometry.
-        e_values,e_vectors = np.linalg.eig(I0)
-
-        indices = np.argsort(e_values)
-        e_values = e_values[indices]
-        e_vectors = e_vectors.T[indices]
-
-        return e_vectors
 
-     
-    ##align structure on its principal axes.
-    # first principal axis aligned along x, second along y and third along z.
-    def _align_axes(self,points):
-    
-        #this method is inspired from the procedure followed in in VMD's orient package:
-        ## set I [draw principalaxes $sel]           <--- show/calc the principal axes
-        ## set A [orient $sel [lindex $I 2] {0 0 1}] <--- rotate axis 2 to match Z
-        ## $sel move $A
-        ## set I [draw principalaxes $sel]           <--- recalc principal axes to check
-        ## set A [orient $sel [lindex $I 1] {0 1 0}] <--- rotate axis 1 to match Y
-        ## $sel move $A
-        ## set I [draw principalaxes $sel]           <--- recalc principal axes to check
-
-        #center polymer to origin
-        c=np.mean(points,axis=0)
-        points[:,0]-=c[0]
-        points[:,1]-=c[1]
-        points[:,2]-=c[2]
-
-        #get principal axes (ranked from smallest to biggest)
-        axes=self._get_principal_axes(points)
-
-        #align smallest principal axis against z axis
-        rotvec=np.cross(axes[0],np.array([1,0,0])) #rotation axis
-        sine=np.linalg.norm(rotvec)
-        cosine=np.dot(axes[0],np.array([1,0,0]))
-        angle=np.arctan2(sine,cosine) #angle to rotate around axis
-
-        rotmatrix=self._rotation_matrix(rotvec,angle)
-        points=np.dot(points, rotmatrix)
-
-        #compute new principal axes (after previous rotation)
-        axes=self._get_principal_axes(points)
-
-        #align second principal axis against y axis
-        rotvec=np.cross(axes[1],np.array([0,1,0])) #rotation axis
-        sine=np.linalg.norm(rotvec)
-        cosine=np.dot(axes[1],np.array([0,1,0]))
-        angle=np.arctan2(sine,cosine) #angle to rotate around axis
-
-        rotmatrix=self._rotation_matrix(rotvec,angle)
-        points=np.dot(points, rotmatrix)
-    
-        return points
-
-    #test for connection between previous and next molecule. If existing, remove from pool
-    def _remove_prev_to_next(self, a):
-        keep = []
-        for i in range(0, len(a), 1):    
-            prevmol = False
-            nextmol = False
-            for j in range(0, 4, 1):
-                if "-" in a[i, j]:
-                    prevmol = True
-                if "+" in a[i, j]:
-                    nextmol = True                                
-                
-            if not (prevmol and nextmol):
-                keep.append(i)
-        
-        if len(keep)>0:
-            return a[keep]
-        else:
-            return []
+    ## compute rigid transformation moving a monomer so that its head and head hook superimpose with the tail hook and tail of the chain.
+    # hooks can be single points, or stacks of points (one per candidate placement).
+    # @retval rotation matrix and translation vector (stacked if hooks are stacked), to apply as np.dot(crds,rot)+trans
+    def _superimpose(self,tail,tail_hook,head_hook,head):
 
+        #prepare data to compute superimposition within previous tail and new head
+        t=np.stack(np.broadcast_arrays(tail,tail_hook),axis=-2)
+        h=np.stack(np.broadcast_arrays(head_hook,head),axis=-2)
 
-    def _get_index(self,top,resid,b0):
-        if "+" in b0:
-            name=top[np.logical_and(top[:,2]==str(resid+2), top[:,4]==b0.split("+")[1]),0]
-        elif "-" in b0:
-            name=top[np.logical_and(top[:,2]==str(resid), top[:,4]==b0.split("-")[1]),0]
-        else:
-            name=top[np.logical_and(top[:,2]==str(resid+1), top[:,4]==b0),0]
-                
-        if len(name)==0:
-            return False
-        elif len(name)==1:
-            return name[0]
-        else:
-            raise IOError("ERROR: multiple instances of atom %s found in residue %s!"%(b0,resid))
-    
-    def _rmsd(self,m1,m2):
-        
-        L = len(m1)
-        
-        ##protein is already centered, don't need centering!
-        COM1 = np.sum(m1,axis=0) / float(L)
-        COM2 = np.sum(m2,axis=0) / float(L)
-        m1 -= COM1
-        m2 -= COM2
-     
-        E0 = np.sum( np.sum(m1*m1,axis=0),axis=0) + np.sum( np.sum(m2*m2,axis=0),axis=0)
-     
-        #This beautiful step provides the answer. V and Wt are the orthonormal
-        # bases that when multiplied by each other give us the rotation matrix, U.
-        # S, (Sigma, from SVD) provides us with the error!  Isn't SVD great!
-        V, S, Wt = np.linalg.svd( np.dot( np.transpose(m2), m1))
+        COM_h=np.sum(h,axis=-2)/float(h.shape[-2])
+        COM_t=np.sum(t,axis=-2)/float(t.shape[-2])
 
-        reflect = float(str(float(np.linalg.det(V) * np.linalg.det(Wt))))
-        
-        if reflect == -1.0:
-            S[-1] = -S[-1]
-            V[:,-1] = -V[:,-1]
+        #compute the rotation matrix superimposing the current head with the previous tail
+        rot=G.kabsch(t,h)[0]
 
-        RMSD = E0 - (2.0 * sum(S))
-        RMSD = np.sqrt(abs(RMSD / L))
+        #bring new monomer to origin, rotate it, and translate it so that tail_hook superimposes with head
+        return rot, COM_t-np.matmul(COM_h[...,np.newaxis,:],rot)[...,0,:]
+
+
+    #compute (once per couple of monomer types) all the candidate placements of a monomer after another one,
+    #as rigid transformations in the frame of the template of the latter
+    def _get_candidates(self,code_tail,code_head):
+
+        key=(code_tail,code_head)
+        if key in self.candidates:
+            return self.candidates[key]
+
+        junction=self.db.get_junction(code_tail,code_head)
+        m=self.db.molecules[code_tail]
+        m_new=self.db.molecules[code_head]
+
+        #get head (of new monomer) and tail (of chain) coordinates
+        tail=m.get_xyz()[m.data[:,0]==int(m.limit['tail'])][0]
+        head=m_new.get_xyz()[m_new.data[:,0]==int(m_new.limit['head'])][0]
+
+        #compute hooks position for every perturbation of the search grid
+        coor_bond,coor_angle,coor_dihedral=m_new.get_xyz()[junction["head_index"]]
+        head_hooks=G.place_pseudoatom(coor_bond,coor_angle,coor_dihedral,junction["bond"],junction["head_angle"],junction["head_dihedral"]+self.search_grid[:,0])
+        coor_bond,coor_angle,coor_dihedral=m.get_xyz()[junction["tail_index"]]
+        tail_hooks=G.place_pseudoatom(coor_bond,coor_angle,coor_dihedral,junction["bond"],junction["tail_angle"],junction["tail_dihedral"]+self.search_grid[:,1])
+
+        rot,trans=self._superimpose(tail,tail_hooks,head_hooks,head)
+
+        #axes of new bonds, around which the new monomer can spin
+        axis=tail_hooks-tail
+        axis/=np.linalg.norm(axis,axis=1)[:,np.newaxis]
+
+        c={"rot":rot,"trans":trans,"axis":axis,"pivot":tail,"xyz_tail":m.get_xyz(),"xyz_head":m_new.get_xyz(),"clash":{}}
+        self.candidates[key]=c
+
+        return c
+
+
+    #rigid transformations of selected candidates, after spinning them around the new bond (spin can also be one per candidate).
+    #if the frame of the chain tail is provided, transformations are expressed in chain frame
+    def _candidate_frames(self,c,idx,spin,rot_tail=None,trans_tail=None):
+
+        s=G.rotation_matrix(c["axis"][idx],np.deg2rad(spin*self.spin_step))
+        rot=np.matmul(c["rot"][idx],s)
+        trans=np.matmul((c["trans"][idx]-c["pivot"])[:,np.newaxis,:],s)[:,0,:]+c["pivot"]
+
+        if rot_tail is None:
+            return rot,trans
+
+        return np.matmul(rot,rot_tail),np.matmul(trans,rot_tail)+trans_tail
+
+
+    #flag candidates (for a given spin) in which the new monomer clashes with the tail monomer alone.
+    #flags are computed once and stored with candidates
+    def _self_clash(self,c,spin):
+
+        if spin in c["clash"]:
+            return c["clash"][spin]
+
+        clash=np.zeros(len(c["rot"]),dtype=bool)
+        for start in range(0,len(clash),256):
+            idx=np.arange(start,min(start+256,len(clash)))
+            rot,trans=self._candidate_frames(c,idx,spin)
+            crds=np.matmul(c["xyz_head"],rot)+trans[:,np.newaxis,:]
+            dists=np.sqrt(np.sum((crds[:,:,np.newaxis,:]-c["xyz_tail"][np.newaxis,np.newaxis,:,:])**2,axis=3))
+            clash[idx]=np.any(dists<self.clash_thresh,axis=(1,2))
+
+        c["clash"][spin]=clash
+        return clash
+
+
+    #index of every atom name (as in self.atomnames) within every monomer type (rows ordered as self.codes).
+    #-1 if atom is not in monomer, -2 if monomer has multiple instances of it
+    def _local_index(self):
+
+        local=-np.ones((len(self.codes),len(self.atomnames)),dtype=int)
+        for i,c in enumerate(self.codes):
+            ids=self._atomname_ids[c]
+            local[i,ids[::-1]]=np.arange(len(ids))[::-1]
+            local[i,np.bincount(ids,minlength=len(self.atomnames))>1]=-2
+
+        return local
+
+
+    ## resolve topology terms (bonds, angles, dihedrals or impropers) of all residues into atom indices in chain.
+    # atoms are referred to by name, prefixed by - or + if they belong to previous or next residue.
+    # @param terms list of topology terms arrays, one per residue
+    # @param n number of atoms per term
+    # @param local atom names index within monomers (see _local_index)
+    # @retval Nxn array of atom indices (-1 if atom is not in chain), and N terms types
+    def _resolve_terms(self,terms,n,local):
+
+        names=dict((a,i) for i,a in enumerate(self.atomnames))
+
+        #relative residue and atom name id of every atom of the terms of a monomer type.
+        #atom names do not change with terminal variants, so each monomer type is parsed once
+        parsed={}
+        shift=[]
+        nameid=[]
+        text=[]
+        resid=[]
+        keys=[]
+        for j in range(0,self.nres,1):
+            if len(terms[j])==0:
+                continue
+
+            c=self.chain[j]
+            if c not in parsed:
+                sh=np.zeros((len(terms[j]),n),dtype=int)
+                ni=np.zeros((len(terms[j]),n),dtype=int)
+                for x in range(0,len(terms[j]),1):
+                    for y in range(0,n,1):
+                        a=terms[j][x][y]
+                        if "+" in a:
+                            sh[x,y]=1
+                            a=a.split("+")[1]
+                        elif "-" in a:
+                            sh[x,y]=-1
+                            a=a.split("-")[1]
+                        ni[x,y]=names.get(a,-1)
+                parsed[c]=(sh,ni)
+
+            shift.append(parsed[c][0])
+            nameid.append(parsed[c][1])
+            text.append(terms[j][:,:n])
+            keys.append(terms[j][:,n])
+            resid.append(np.full(len(terms[j]),j))
+
+        if len(resid)==0:
+            return np.zeros((0,n),dtype=int),np.zeros(0,dtype=str)
+
+        shift=np.concatenate(shift)
+        nameid=np.concatenate(nameid)
+        resid=np.concatenate(resid)
+
+        #residue each atom belongs to, and its index within that residue
+        target=resid[:,np.newaxis]+shift
+        valid=np.logical_and(np.logical_and(target>=0,target<self.nres),nameid>=0)
+        target=np.clip(target,0,self.nres-1)
+        idx=np.where(valid,local[self._restype[target],np.maximum(nameid,0)],-1)
+
+        if np.any(idx==-2):
+            p,q=np.argwhere(idx==-2)[0]
+            raise IOError("ERROR: multiple instances of atom %s found in residue %s!"%(np.concatenate(text)[p,q],resid[p]))
+
+        offsets=self._resoffset[:self.nres]
+        idx=np.where(idx>=0,offsets[target]+idx,-1)
+
+        return idx,np.concatenate(keys)
+
+
+    #write in topology the terms having all their atoms in chain, followed by their force field parameters
+    def _write_terms(self,f_out,idx,keys,fftype):
+
+        keep=np.all(idx>=0,axis=1)
+        ids=((idx[keep]+1)%100000).tolist()
+
+        vals={}
+        for k in np.unique(keys[keep]):
+            vals[k]='  '.join(self.ff.bonded[k].astype(str))
+
+        fmt="%5s"+" %6s"*(idx.shape[1]-1)+" %6s %8s\n"
+        f_out.write("".join([fmt%tuple(i+[fftype,vals[k]]) for i,k in zip(ids,keys[keep].tolist())]))
 
-        U = np.dot(V, Wt)
-                
-        return U, RMSD
-        
-    
-    def _place_pseudoatom(self,coor_bond,coor_angle,coord_dihedral,bond,ang,di):
-        
-        angle=np.deg2rad(ang)
-        dihed=np.deg2rad(di)
-
-        ###inspired by https://github.com/molmod/molmod/blob/master/molmod/zmatrix.py###
-        #coor_bond      #bond atom (tail/head)
-        #coord_angle    #angle atom
-        #coord_dihedral #furthest dihedral atom
-        # define frame axes
-        new_z = coor_angle - coor_bond #pos of angle atom - pos of tail/head
-        norm_z = np.linalg.norm(new_z)
-        if norm_z < 1e-15:
-            new_z = np.array([0, 0, 1], float)
-        else:
-            new_z /= np.linalg.norm(new_z)
-        new_x = coord_dihedral - coor_bond #bond atom - origin
-        new_x -= np.dot(new_x, new_z)*new_z
-        norm_x = np.linalg.norm(new_x)
-        if norm_x < 1e-15:
-            new_x = self._random_orthonormal(new_z)
-        else:
-            new_x /= np.linalg.norm(new_x)
-        # we must make our axes frame left handed due to the poor IUPAC
-        # definition of the sign of a dihedral angle.
-        new_y = -np.cross(new_z, new_x)
-        # coordinates of new atom:
-        x = bond*np.cos(dihed)*np.sin(angle)
-        y = bond*np.sin(dihed)*np.sin(angle)
-        z = bond*np.cos(angle)
-        coordinates = coor_bond + x*new_x + y*new_y + z*new_z
-
-        return coordinates
-        
 
-    def _random_orthonormal(self,normal):
-        #"""Return a random normalized vector orthogonal to the given vector"""
-        normal_fns = [lambda a: np.array([0.0, -a[2], a[1]]),
-                      lambda a: np.array([a[2], 0.0, -a[0]]),
-                      lambda a: np.array([-a[1], a[0], 0.0])]
-        
-        u = normal_fns[np.argmin(np.fabs(normal))](normal)
-        u /= np.linalg.norm(u)
-        v = np.cross(normal, u)
-        v /= np.linalg.norm(v)
-        alpha = np.random.uniform(0.0, np.pi*2)
-        return np.cos(alpha)*u + np.sin(alpha)*v
-    
-    
-    
 if __name__=="__main__":
 
     import os,sys    
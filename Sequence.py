@@ -0,0 +1,202 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# import Sequence as S
+# rng=np.random.default_rng(42)
+# s=S.bernoulli(rng,[60,40],1000) #monomer type ids, each drawn independently
+# s=S.shuffle(rng,[60,40],1000) #exactly 600 of type 0 and 400 of type 1, randomly ordered
+# s=S.markov(rng,[[0.9,0.1],[0.2,0.8]],1000,[60,40]) #first-order Markov chain (blocky)
+# s=S.block([60,40],1000) #600 of type 0, followed by 400 of type 1
+# chain=S.to_string(s,["A","B"])
+# lengths=S.sample_lengths(rng,"schulz_zimm",[50,2],1000) #lengths of 1000 chains, number average 50 and dispersity 1.5
+#
+# Sequences are numpy arrays of monomer type ids (indices in the list of monomers codes).
+
+import numpy as np
+
+#available sequence models
+MODELS=["bernoulli","shuffle","markov","block"]
+
+#available chain length distributions
+LENGTH_MODELS=["schulz_zimm","lognormal","histogram"]
+
+
+## integer counts summing to length, as close as possible to percentages (largest remainder method).
+# @param percentage percentage (or any weight) of each type
+# @param length total count
+# @retval numpy array of counts
+def apportion(percentage,length):
+
+    percentage=np.asarray(percentage,dtype=float)
+    quota=percentage*length/np.sum(percentage)
+    counts=np.floor(quota)
+
+    #assign remaining units to largest fractional parts (first types first, in case of ties)
+    missing=int(round(length-np.sum(counts)))
+    order=np.argsort(-(quota-counts),kind="stable")
+    counts[order[:missing]]+=1
+
+    return counts.astype(int)
+
+
+## draw every monomer independently, according to percentages.
+# @param rng numpy random Generator
+# @param percentage percentage (or any weight) of each type
+# @param length number of monomers
+# @retval sequence of type ids
+def bernoulli(rng,percentage,length):
+
+    p=np.asarray(percentage,dtype=float)
+    return rng.choice(len(p),size=length,p=p/np.sum(p))
+
+
+## random permutation of a sequence having exactly the desired composition (up to rounding).
+# @param rng numpy random Generator
+# @param percentage percentage (or any weight) of each type
+# @param length number of monomers
+# @retval sequence of type ids
+def shuffle(rng,percentage,length):
+    return rng.permutation(block(percentage,length))
+
+
+## blocks of each type, in the order they are provided, sized according to percentages.
+# @param percentage percentage (or any weight) of each type
+# @param length number of monomers
+# @retval sequence of type ids
+def block(percentage,length):
+    return np.repeat(np.arange(len(percentage)),apportion(percentage,length))
+
+
+## first-order Markov chain: type of each monomer depends on the previous one.
+# the chain is cut in segments, all simulated at once for every possible starting type, and segments are then joined.
+# @param rng numpy random Generator
+# @param transitions KxK matrix, probability (or weight) of type j following type i in row i
+# @param length number of monomers
+# @param initial percentage (or weight) of each type for the first monomer (stationary distribution if not provided)
+# @retval sequence of type ids
+def markov(rng,transitions,length,initial=None):
+
+    T=np.asarray(transitions,dtype=float)
+    T=T/np.sum(T,axis=1)[:,np.newaxis]
+    k=len(T)
+    cumulative=np.cumsum(T,axis=1)
+    cumulative[:,-1]=1.0
+
+    if initial is None:
+        e_values,e_vectors=np.linalg.eig(T.T)
+        initial=np.abs(np.real(e_vectors[:,np.argmin(np.abs(e_values-1.0))]))
+
+    seq=np.zeros(length,dtype=int)
+    if length==0:
+        return seq
+    seq[0]=bernoulli(rng,initial,1)[0]
+    if length==1:
+        return seq
+
+    #segments of size ~sqrt(length), padded to fill all of them
+    n=length-1
+    size=int(np.ceil(np.sqrt(n)))
+    nseg=int(np.ceil(n/float(size)))
+    u=rng.random((size,nseg)) #position within segment, segment
+
+    #type following each possible type, at every position (amount of cumulative probabilities not greater than u).
+    #Values of u are binned: in bins containing no cumulative probability all values lead to the same types,
+    #read from a table. In the few others, u is compared to cumulative probabilities
+    dtype=np.min_scalar_type(k)
+    bins=2**16
+    edges=np.arange(bins)/float(bins)
+    table=np.stack([np.searchsorted(cumulative[i,:-1],edges,side="right") for i in range(0,k,1)],axis=1).astype(dtype)
+    mixed=np.zeros(bins,dtype=bool)
+    mixed[np.minimum((cumulative[:,:-1]*bins).astype(int),bins-1).ravel()]=True
+
+    b=(u*bins).astype(np.int32)
+    traj=table[b]
+    todo=np.flatnonzero(mixed[b.ravel()])
+    for i in range(0,k,1):
+        traj.reshape(-1,k)[todo,i]=np.searchsorted(cumulative[i,:-1],u.ravel()[todo],side="right")
+
+    #trajectory of each segment, for every type preceding it (overwriting next types maps)
+    base=np.arange(nseg)[:,np.newaxis]*k
+    state=np.tile(np.arange(k),(nseg,1))
+    for t in range(0,size,1):
+        state=traj[t].ravel()[base+state]
+        traj[t]=state
+
+    #join segments: each starts from the last type of the previous one
+    start=np.zeros(nseg,dtype=int)
+    prev=seq[0]
+    for s in range(0,nseg,1):
+        start[s]=prev
+        prev=traj[-1,s,prev]
+
+    seq[1:]=traj[np.arange(size)[np.newaxis,:],np.arange(nseg)[:,np.newaxis],start[:,np.newaxis]].ravel()[:n]
+    return seq
+
+
+## generate a sequence according to a model.
+# @param rng numpy random Generator
+# @param model one of MODELS
+# @param percentage percentage (or weight) of each type
+# @param length number of monomers
+# @param transitions transition matrix (markov model only)
+# @retval sequence of type ids
+def make_sequence(rng,model,percentage,length,transitions=None):
+
+    if model=="bernoulli":
+        return bernoulli(rng,percentage,length)
+    elif model=="shuffle":
+        return shuffle(rng,percentage,length)
+    elif model=="markov":
+        if transitions is None:
+            raise Exception("markov sequence model requires a transition matrix!")
+        return markov(rng,transitions,length,percentage)
+    elif model=="block":
+        return block(percentage,length)
+    else:
+        raise Exception("sequence model should be one of %s!"%", ".join(MODELS))
+
+
+## convert a sequence of type ids into a chain string.
+# @param seq sequence of type ids
+# @param codes one letter code of each type
+# @retval chain string
+def to_string(seq,codes):
+    return np.array(codes,dtype="S1")[seq].tobytes().decode()
+
+
+## draw chain lengths (degrees of polymerization) from a distribution.
+# schulz_zimm parameters are the number average length and the shape k (dispersity (k+1)/k),
+# lognormal ones the number average length and the dispersity, histogram ones a list of lengths each followed by its weight.
+# @param rng numpy random Generator
+# @param model one of LENGTH_MODELS
+# @param values distribution parameters
+# @param count number of chains
+# @retval numpy array of lengths (at least 1)
+def sample_lengths(rng,model,values,count):
+
+    if model=="schulz_zimm":
+        mean,k=values
+        lengths=rng.gamma(k,mean/float(k),count)
+    elif model=="lognormal":
+        mean,pdi=values
+        sigma2=np.log(pdi)
+        lengths=rng.lognormal(np.log(mean)-sigma2/2.0,np.sqrt(sigma2),count)
+    elif model=="histogram":
+        lengths=np.asarray(values[0::2],dtype=float)[bernoulli(rng,values[1::2],count)]
+    else:
+        raise Exception("length distribution should be one of %s!"%", ".join(LENGTH_MODELS))
+
+    return np.maximum(np.rint(lengths),1).astype(int)
@@ -0,0 +1,74 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# import Shared
+# a,shm=Shared.create((32,1000,3)) #numpy array in shared memory
+# desc=Shared.describe(a,shm) #picklable description, to be sent to other processes
+# b,shm_b=Shared.attach(*desc) #in another process: same memory
+# shm_b.close()
+# Shared.release(shm) #in creating process, once all processes are done
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+## allocate a numpy array in shared memory (zero filled).
+# @param shape array shape
+# @param dtype array data type
+# @retval numpy array, and SharedMemory object holding it (see release)
+def create(shape,dtype=np.float64):
+
+    size=int(np.prod(shape))*np.dtype(dtype).itemsize
+    shm=shared_memory.SharedMemory(create=True,size=max(size,1))
+    return np.ndarray(shape,dtype=dtype,buffer=shm.buf),shm
+
+
+## description of an array in shared memory, allowing other processes to attach to it.
+# @param a numpy array returned by create
+# @param shm SharedMemory object returned by create
+# @retval shared memory name, shape and data type
+def describe(a,shm):
+    return shm.name,a.shape,a.dtype.str
+
+
+## attach to an array in shared memory, created by another process.
+# @param name shared memory name
+# @param shape array shape
+# @param dtype array data type
+# @retval numpy array, and SharedMemory object holding it (to be closed once done)
+def attach(name,shape,dtype):
+
+    #memory is owned by its creator, attaching processes must not destroy it when exiting.
+    #Before python 3.13, processes started by multiprocessing share the resource tracker of their parent,
+    #and tracking ends when the creator unlinks memory
+    try:
+        shm=shared_memory.SharedMemory(name=name,track=False)
+    except TypeError:
+        shm=shared_memory.SharedMemory(name=name)
+
+    return np.ndarray(shape,dtype=dtype,buffer=shm.buf),shm
+
+
+## free shared memory (creating process only, once no process needs it anymore).
+# @param shm SharedMemory object returned by create
+def release(shm):
+
+    #arrays still using the memory keep it mapped until they are gone
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    shm.unlink()
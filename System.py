@@ -11,8 +11,73 @@
 #
 # Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
 
+import os
 import numpy as np
 import logging
+import multiprocessing
+import Geometry as G
+import Writer as W
+import Sequence as S
+import Shared
+from Packing import Packer
+from Growth import Grower
+from Polymer import Polymer
+
+#maximal amount of atoms placed at once, when replicating polymers in box
+REPLICA_ATOMS=2**20
+
+#atom indices per part of index file (multiple of 15, the amount per line)
+NDX_IDS=15*W.BLOCK
+
+#data shared with system writing processes
+_shared={}
+
+
+#format a chunk of replicas of a polymer (.gro file), or a part of a group of indices (.ndx file)
+def _format_task(task,types,voxel_half):
+
+    if task[0]=="gro":
+        name,shift,cntres,index_full,rot,conf=task[3:]
+        names,resids,pos,nres=types[name]
+
+        #conformation of every replica, if polymer has several
+        if conf is not None:
+            pos=pos[conf]
+
+        #place replicas by broadcasting coordinates over cells (rotated first, if needed), wrapping residue and atom counts.
+        #grown chains provide the coordinates of every replica instead of cells offsets
+        n=len(shift)
+        if shift.ndim==3:
+            crds=(shift+voxel_half).reshape(-1,3)
+        elif rot is None:
+            crds=(pos+shift[:,np.newaxis,:]+voxel_half).reshape(-1,3)
+        else:
+            crds=(np.matmul(pos,rot)+shift[:,np.newaxis,:]+voxel_half).reshape(-1,3)
+        res=cntres+(np.arange(n)*nres)[:,np.newaxis]+resids[np.newaxis,:]
+        index=np.arange(index_full+1,index_full+len(crds)+1)
+        return W.format_gro(W.wrap(res.ravel()),np.tile(names,n),W.wrap(index),crds[:,0],crds[:,1],crds[:,2])
+
+    else:
+        header,first,last=task[3:]
+        return header+W.format_ndx(np.arange(first,last+1))
+
+
+def _init_writer(types,voxel_half):
+
+    #conformations stacks are attached from shared memory (described by name, shape and type)
+    for t in types.values():
+        if isinstance(t[2],tuple):
+            t[2],shm=Shared.attach(*t[2])
+            _shared.setdefault("memory",[]).append(shm)
+
+    _shared["types"]=types
+    _shared["voxel_half"]=voxel_half
+
+
+#format a task in a process of the pool, and write it at its position in file
+def _write_task(task):
+    W.pwrite(task[1],_format_task(task,_shared["types"],_shared["voxel_half"]),task[2])
+
 
 class System:
      
@@ -20,11 +85,16 @@ class System:
         self.ff=ff
         self.polymers=polymers
         self.params=params
+
+        #shared memory holding conformations of polymers (per polymer name), while system is generated
+        self.shared={}
         
         self.logger=logging.getLogger('assemble')
         
-    #generate a random distribution of molecules in a box, given their percentages
-    def make_box(self, dim, data_in, use_fractional_mass):
+    #generate a random distribution of molecules in a box, given their percentages.
+    #in random sampling, each cell is filled by roulette (best of 100 attempts),
+    #in exact sampling, counts are apportioned to percentages and cells filled by a random permutation
+    def make_box(self, dim, data_in, use_fractional_mass, sampling="random"):
         
         #prepare data
         names=[]
@@ -35,7 +105,7 @@ class System:
         
         #if reference percentage is a fractional mass, tweak it using monomers mass
         if use_fractional_mass:
-            percentage=self.convert_concentration(np.array(v), get_fractional=True)
+            percentage=self.convert_concentration(np.array(v), get_fractional=True, names=names)
         else:
             percentage=np.array(v)
         
@@ -52,6 +122,13 @@ class System:
             raise IOError("ERROR: expected 3 values for dimensions")
         
         length=dim[0]*dim[1]*dim[2]
+
+        if sampling=="exact":
+            counterbest=S.apportion(percentage,length).astype(float)
+            cbest=np.random.permutation(np.repeat(np.array(names),counterbest.astype(int)))
+            counterbest/=float(length)
+            counterbest*=100.0
+            return self._report_box(names,counterbest,cbest,dim)
         
         #make roulette array
         roulette=[percentage[0]]
@@ -66,21 +143,12 @@ class System:
         #attempt distributing molecules in box according to desired concentration
         #keep best of 100 attemps
         for i in range(1,100):
-
-            c=[]
     
             #pick a random monomer according to desired percentages
-            counter=np.zeros(len(roulette))
-            for x in range(0,length,1):
-                rnd=np.random.rand(1)[0]*100
-                index=0
-                while True:
-                    if roulette[index]>rnd:
-                        break
-                    else:
-                        index+=1
-                c.append(names[index])
-                counter[index]+=1
+            rnd=np.random.rand(length)*100
+            index=np.minimum(np.searchsorted(roulette,rnd,side="right"),len(roulette)-1)
+            c=np.array(names)[index]
+            counter=np.bincount(index,minlength=len(roulette)).astype(float)
     
             #chain completed, report produced percentages:
             counter/=float(length)
@@ -94,18 +162,17 @@ class System:
                 counterbest=counter.copy()
 
         #print(counterbest)
+        return self._report_box(names,counterbest,cbest,dim)
 
-        #if reference percentage is a fractional mass, tweak it using monomers mass
-        if use_fractional_mass:
-            perc=self.convert_concentration(counterbest, get_fractional=False) #convert into percentage
-            perc/=np.sum(perc)
-            perc*=100.0
-            mw=counterbest.copy() #this is already a fractional mass
-        else:
-            perc=counterbest.copy()
-            mw=self.convert_concentration(counterbest, get_fractional=True)
-            mw/=np.sum(mw)
-            mw*=100.0
+
+    #log produced box composition, and return box
+    def _report_box(self,names,counterbest,cbest,dim):
+
+        #produced percentages are always units counts, convert them into fractional mass using polymers mass
+        perc=counterbest.copy()
+        mw=self.convert_concentration(counterbest.copy(), get_fractional=False, names=names)
+        mw/=np.sum(mw)
+        mw*=100.0
         
         self.logger.info("> polymer units in box:")
         for x in range(0,len(counterbest),1):
@@ -120,13 +187,151 @@ class System:
         return np.reshape(cbest,dim)
 
         
-    #if get_fractional=True, percentage is edited using monomers mass
-    #if get_fractional=False, fractional mass is converted into percentage
-    def convert_concentration(self, c, get_fractional=True):
+    ## write system .gro and .ndx files.
+    # if all .gro records have the same size, position of every chunk in files is known in advance: files are preallocated,
+    # and chunks formatted and written in parallel by a pool of processes. Otherwise, they are written in sequence.
+    # @param gro_name .gro file name
+    # @param ndx_name .ndx file name
+    # @param gro header and footer (box) of .gro file
+    # @param chunks replicas chunks: polymer name, cells offsets, first residue and first atom, rotations and conformations
+    # @param ndx index file parts: group header, first and last index
+    # @param types polymers data: names columns, residue indices, centered coordinates (stack of conformations, if several) and number of residues
+    # @param voxel_half half of voxel size
+    # @param fixed True if all .gro records have the same size
+    def _write_system(self,gro_name,ndx_name,gro,chunks,ndx,types,voxel_half,fixed):
+
+        tasks=[]
+        for c in chunks:
+            tasks.append(["gro",gro_name,len(gro[0])+W.GRO_RECORD*c[3]]+c)
+
+        offset=0
+        for c in ndx:
+            tasks.append(["ndx",ndx_name,offset]+c)
+            offset+=len(c[0].encode())+W.ndx_size(c[1],c[2])
+
+        workers=min(self.params.workers,len(tasks))
+        if workers>1 and fixed and hasattr(os,"pwrite"):
+
+            self.logger.info("> writing system with %s workers..."%workers)
+            natoms=chunks[-1][3]+len(chunks[-1][1])*len(types[chunks[-1][0]][1])
+            for name,header,size,footer in [[gro_name,gro[0],len(gro[0])+W.GRO_RECORD*natoms,gro[1]],[ndx_name,"",offset,"\n"]]:
+                f_out=open(name,"w")
+                f_out.write(header)
+                f_out.truncate(size)
+                f_out.seek(size)
+                f_out.write(footer)
+                f_out.close()
+
+            #conformations in shared memory are not copied to processes
+            shared={}
+            for name in types:
+                shared[name]=list(types[name])
+                if name in self.shared:
+                    shared[name][2]=Shared.describe(types[name][2],self.shared[name])
+
+            pool=multiprocessing.Pool(workers,_init_writer,(shared,voxel_half))
+            for _ in pool.imap_unordered(_write_task,tasks):
+                pass
+            pool.close()
+            pool.join()
+
+        else:
+            f_gro=open(gro_name,"w")
+            f_ndx=open(ndx_name,"w")
+            f_gro.write(gro[0])
+            for t in tasks:
+                if t[0]=="gro":
+                    f_gro.write(_format_task(t,types,voxel_half))
+                else:
+                    f_ndx.write(_format_task(t,types,voxel_half))
+            f_gro.write(gro[1])
+            f_ndx.write("\n")
+            f_gro.close()
+            f_ndx.close()
+
+
+    ## pack molecules with random orientations in a periodic cubic box, at the requested density.
+    # @param molecules names of polymers to insert (one per molecule)
+    # @param index_poly polymer name to index in polymers list
+    # @param conf centered conformations (nm) of polymers having several of them
+    # @param choice conformation of every molecule
+    # @retval molecules centers and rotations, and box side (nm)
+    def _pack(self,molecules,index_poly,conf,choice):
+
+        #centered coordinates (nm) of every polymer type, shared between its molecules
+        crds={}
+        mass=0.0
+        for name in molecules:
+            p=self.polymers[index_poly[name]]
+            if name not in crds and name not in conf:
+                pos=p.get_xyz()/10.0
+                crds[name]=pos-np.mean(pos,axis=0)
+            mass+=p.mass
+
+        #box volume, converting Da to g and nm^3 to cm^3
+        side=(mass*1.66054e-3/self.params.density)**(1.0/3.0)
+        self.logger.info("\n> packing %s molecules at %s g/cm^3 (box side %8.3f nm)..."%(len(molecules),self.params.density,side))
+
+        packer=Packer(self.params.interchain_dist,self.params.packing_attempts)
+        com,rot,box=packer.pack([conf[name][c] if name in conf else crds[name] for name,c in zip(molecules,choice)],side)
+
+        self.logger.info(">> density: %s g/cm^3"%(mass*1.66054e-3/box**3))
+        return com,rot,box
+
+
+    ## grow all molecules together in a periodic cubic box, at the requested density.
+    # every molecule is a new chain having the sequence of its polymer, grown with the same settings.
+    # @param molecules names of polymers to grow (one per molecule)
+    # @param index_poly polymer name to index in polymers list
+    # @retval coordinates (nm) of every molecule, and box side (nm)
+    def _grow(self,molecules,index_poly):
+
+        mass=np.sum([self.polymers[index_poly[name]].mass for name in molecules])
+        side=(mass*1.66054e-3/self.params.density)**(1.0/3.0)
+        self.logger.info("\n> growing %s molecules at %s g/cm^3 (box side %8.3f nm)..."%(len(molecules),self.params.density,side))
+
+        #candidate placements tables are shared by all chains
+        chains=[]
+        candidates={}
+        for name in molecules:
+            p=self.polymers[index_poly[name]]
+            c=Polymer(p.db,p.ff,p.molname,p.mode,p.nrxl)
+            c.clash_thresh=p.clash_thresh
+            c.search_batch=p.search_batch
+            c.spin_step=p.spin_step
+            c.precision=p.precision
+            c.candidates=candidates
+            chains.append(c)
+
+        grower=Grower(self.polymers[0].clash_thresh,self.params.packing_attempts)
+        unsolved=grower.grow(chains,[self.polymers[index_poly[name]].chain for name in molecules],side*10.0)
+        if unsolved>0:
+            self.logger.warning(">> WARNING: %s monomers placed with unsolved clashes"%unsolved)
+
+        return [c.get_xyz()/10.0 for c in chains],side
+
+
+    #centered coordinates (nm) of all the conformations of a polymer, in shared memory
+    def _conformers(self,p):
+
+        pos,shm=Shared.create(p.conformers.shape)
+        pos[:]=p.conformers/10.0
+        pos-=np.mean(pos,axis=1)[:,np.newaxis,:]
+        self.shared[p.molname]=shm
+        return pos
+
+
+    #if get_fractional=True, fractional mass is converted into percentage of units
+    #if get_fractional=False, percentage of units is converted into fractional mass
+    #values are ordered as polymers, or as provided polymer names
+    def convert_concentration(self, c, get_fractional=True, names=None):
         m=[]
         for x in range(0,len(self.polymers),1):
             m.append(self.polymers[x].mass)
-        allmasses=np.array(m)
+        if names is not None:
+            molnames=[p.molname for p in self.polymers]
+            m=[m[molnames.index(n)] for n in names]
+        allmasses=np.array(m,dtype=float)
         allmasses/=np.sum(allmasses)
 
         for x in range(0,len(allmasses),1):
@@ -143,16 +348,18 @@ class System:
     def create_system(self,mypath="."):
 
         ### CREATE BOX ###                         
-        self.systembox=self.make_box(self.params.box_grid_shape, self.params.concentration, use_fractional_mass=False)
+        self.systembox=self.make_box(self.params.box_grid_shape, self.params.concentration, use_fractional_mass=self.params.concentration_unit=="mass", sampling=self.params.box_sampling)
 
         #get maximal box between existing polymers, to define voxel size
         voxel_size=np.array([0.,0.,0.])
         for x in range(0,len(self.polymers),1):
-            atoms=self.polymers[x].get_xyz()
-            currentbox=np.max(atoms,axis=0)-np.min(atoms,axis=0)
-            for k in range(0,3,1):
-                if currentbox[k]>voxel_size[k]:
-                    voxel_size[k]=currentbox[k]
+            p=self.polymers[x]
+            if p.conformers is None:
+                voxel_size=np.maximum(voxel_size,G.extent(p.get_xyz()))
+            else:
+                #conformations get a random orientation, cells must host their bounding sphere
+                c=p.conformers-np.mean(p.conformers,axis=1)[:,np.newaxis,:]
+                voxel_size=np.maximum(voxel_size,2.0*np.max(np.sqrt(np.sum(c**2,axis=2))))
 
         #use nanometers, increase voxel size by interchain_dist input
         voxel_size/=10.0
@@ -194,18 +401,10 @@ class System:
 
 
         ### GENERATE SYSTEM GRO FILE ###
-        
-        fout_index=open("%s/index_%s.ndx"%(mypath,self.params.output),'w')
-        
-        f_out=open("%s/%s.gro"%(mypath,self.params.output),'w')
-        f_out.write("system\n")
-        f_out.write("%s\n"%atomcount)
 
         #iterate over all box
-        index=1 #atom counter
         minpos=[]
         maxpos=[]
-        cntres=0
         
         #must sort the molecules according to their polymer name
         flatsystem=self.systembox.flatten()
@@ -221,79 +420,137 @@ class System:
             contmols.append([name,cnt])
    
         #counters needed for index file creation
-        index_full=1 #atom counter without wrapping
-        index_per_mol=1 #atom counter per molecule type (for pretty formatting)
-        cont_mol=0 #count how many molecules of a specific kind passed
-        cont_mol_kind=0 #count how many molecule kinds passed
-
-        fout_index.write("[ %s ]\n"%contmols[0][0])
-        for ndx in indices:
-
-            #insert new molecule kind in index file
-            cont_mol+=1
-            if cont_mol>contmols[cont_mol_kind][1] and cont_mol_kind+1<len(contmols):
-                cont_mol=1
-                cont_mol_kind+=1
-                fout_index.write("\n[ %s ]\n"%contmols[cont_mol_kind][0])
-                index_per_mol=1 #atom counter per molecule type (for pretty formatting)
-            
-            pos=np.unravel_index(ndx,self.systembox.shape)
-            x=pos[0]
-            y=pos[1]
-            z=pos[2]
-                
-            p=self.polymers[index_poly[self.systembox[x,y,z]]]
-                          
-            #compute polyhedron center
+        index_full=0 #atom counter without wrapping
+        cntres=0 #residue counter without wrapping
+        groups={} #first and last atom of each molecule kind
+
+        #polymers having several conformations: every molecule (in sorted order) draws one
+        conf={}
+        choice=np.zeros(len(sortedflat),dtype=int)
+        for name in uniquesorted:
+            p=self.polymers[index_poly[name]]
+            if p.conformers is not None and self.params.packing!="growth":
+                conf[name]=self._conformers(p)
+                choice[sortedflat==name]=np.random.randint(0,len(conf[name]),np.sum(sortedflat==name))
+
+        #in random packing, molecules (in sorted order) get a random orientation and position in a periodic box
+        if self.params.packing=="random":
+            com,rot,side=self._pack(sortedflat,index_poly,conf,choice)
+            voxel_size=np.zeros(3)
+
+        #in growth mode, every molecule (in sorted order) is a chain grown in a periodic box together with all others
+        if self.params.packing=="growth":
+            grown,side=self._grow(sortedflat,index_poly)
+            voxel_size=np.zeros(3)
+
+        types={} #polymers data, decoded once
+        chunks=[] #chunks of replicas to write: polymer name, cells offsets, first residue, first atom and rotations
+        for name in uniquesorted:
+
+            #decode polymer once: residue and atom names columns, residue index of every atom, and centered coordinates
+            p=self.polymers[index_poly[name]]
+            names=np.array(W.gro_names(p.get_resnames(),p.get_atomnames()))
+            resids=np.repeat(np.arange(1,p.nres+1),np.diff(p.get_residue_offsets()))
             pos=p.get_xyz()/10.0
-            cntr=np.mean(pos,axis=0)/10.0
-            
-            #store min and max atom positions, for box size definition
-            minpos.append(np.min(pos-cntr+voxel_size*np.array([x,y,z]),axis=0))
-            maxpos.append(np.max(pos-cntr+voxel_size*np.array([x,y,z]),axis=0))
-            
-            #iterate over elements
-            for j in range(0,len(p.poly),1):
-                cntres+=1
-                #wrap counting in case too many residues are present
-                if cntres>99999:
-                    cntres=0
-                data_list=p.poly[j].mapping(p.poly[j].data)
-
-                for i in range(0,len(data_list),1):
-                    #create and write line in gromacs format (.gro file)
-                    L='%5d%-5s%5s%5d%8.3f%8.3f%8.3f\n'%(cntres,data_list[i][2],data_list[i][1],index,\
-													data_list[i][5]/10.0-cntr[0]+voxel_size[0]*x+voxel_size[0]/2.0,\
-													data_list[i][6]/10.0-cntr[1]+voxel_size[1]*y+voxel_size[1]/2.0,\
-													data_list[i][7]/10.0-cntr[2]+voxel_size[2]*z+voxel_size[2]/2.0)
-                    f_out.write(L)
-
-                    fout_index.write("%s "%index_full)
-                    if np.mod(index_per_mol,15)==0:
-                        fout_index.write("\n")
-
-                    index+=1
-                    index_full+=1
-                    index_per_mol+=1
-                    
-                    #wrapping!
-                    if index>99999:
-                        index=0
-
-        minbox=np.min(np.array(minpos),axis=0)
-        maxbox=np.max(np.array(maxpos),axis=0)
-        box=maxbox-minbox
-        # account for intermolecular separation beyond periodic boundary condition
-        box+=self.params.interchain_dist
+            natoms=len(pos)
+
+            #conformation of every replica
+            confs=None
+            if name in conf:
+                pos=conf[name]
+                confs=choice[sortedflat==name]
+
+            if self.params.packing=="random":
+                if confs is None:
+                    pos=pos-np.mean(pos,axis=0)
+                shift=com[sortedflat==name]
+                rots=rot[sortedflat==name]
+
+                #store bounds of atom positions, for records size definition
+                r=np.max(np.sqrt(np.sum(pos**2,axis=-1)))
+                minpos.append(shift-r)
+                maxpos.append(shift+r)
+
+            elif self.params.packing=="growth":
+                shift=np.array([grown[i] for i in np.flatnonzero(sortedflat==name)])
+                rots=None
+
+                #store min and max atom positions, for box size definition
+                minpos.append(np.min(shift,axis=1))
+                maxpos.append(np.max(shift,axis=1))
+
+            else:
+                #position of all the cells hosting this polymer (in sorted molecules order)
+                cells=np.array(np.unravel_index(indices[sortedflat==name],self.systembox.shape)).T
+                shift=voxel_size*cells
+
+                #conformations get a random orientation in their cell
+                if confs is not None:
+                    rots=G.random_rotation(len(shift))
+                    r=np.max(np.sqrt(np.sum(pos**2,axis=-1)))
+                    minpos.append(shift-r)
+                    maxpos.append(shift+r)
+
+                else:
+                    cntr=np.mean(pos,axis=0)/10.0
+                    pos=pos-cntr
+                    rots=None
+
+                    #store min and max atom positions, for box size definition
+                    minpos.append(np.min(pos,axis=0)+shift)
+                    maxpos.append(np.max(pos,axis=0)+shift)
+
+            types[name]=[names,resids,pos,p.nres]
+            groups[name]=[index_full+1,index_full+len(shift)*natoms]
+
+            #replicas are placed a chunk of cells at a time, to bound memory
+            chunk=max(1,REPLICA_ATOMS//natoms)
+            for start in range(0,len(shift),chunk):
+                n=len(shift[start:start+chunk])
+                c=[name,shift[start:start+chunk],cntres,index_full,None,None]
+                if rots is not None:
+                    c[4]=rots[start:start+chunk]
+                if confs is not None:
+                    c[5]=confs[start:start+chunk]
+                chunks.append(c)
+                cntres+=n*p.nres
+                index_full+=n*natoms
+
+        minbox=np.min(np.concatenate(minpos),axis=0)
+        maxbox=np.max(np.concatenate(maxpos),axis=0)
+        if self.params.packing!="grid":
+            box=np.full(3,side)
+        else:
+            box=maxbox-minbox
+            # account for intermolecular separation beyond periodic boundary condition
+            box+=self.params.interchain_dist
 
         self.logger.info("\n> box size: %10.5f x %10.5f x %10.5f nm^3"%(box[0],box[1],box[2]))
 
+        #index file, a group per molecule kind, split in parts of whole lines
+        ndx=[]
+        for i in range(0,len(contmols),1):
+            first,last=groups[contmols[i][0]]
+            header=W.ndx_header(contmols[i][0],i==0)
+            for start in range(first,last+1,NDX_IDS):
+                ndx.append([header,start,min(start+NDX_IDS-1,last)])
+                header=""
+
         ### BOX INFORMATION TO ADD! ###
-        f_out.write("%10.5f%10.5f%10.5f\n"%(box[0],box[1],box[2]))
-        f_out.close()
+        gro=["system\n%s\n"%atomcount,"%10.5f%10.5f%10.5f\n"%(box[0],box[1],box[2])]
+
+        #coordinates fit in .gro fields if they are between -999.999 and 9999.999 nm
+        crds_min=np.min(minbox+voxel_size/2.0)
+        crds_max=np.max(maxbox+voxel_size/2.0)
+        fixed=crds_min>-999.99 and crds_max<9999.99 and np.all([len(n.encode())==10 for t in types.values() for n in t[0]])
+
+        self._write_system("%s/%s.gro"%(mypath,self.params.output),"%s/index_%s.ndx"%(mypath,self.params.output),gro,chunks,ndx,types,voxel_size/2.0,fixed)
 
-        fout_index.write("\n")
-        fout_index.close()
+        #conformations are not needed anymore
+        del conf,types,pos
+        for shm in self.shared.values():
+            Shared.release(shm)
+        self.shared={}
 
         ### CREATE TOP FILE ###
     
@@ -314,8 +571,10 @@ class System:
             #f_out.write("{:<8}{:<8}{:<9}{:<8}{:<7}{:<10}{:<15}\n".format(l,line[0],line[1],line[2],line[3],line[4],line[5]))
             f_out.write("%8s%8s%9s%8s%7s%10s%15s\n"%(l,line[0],line[1],line[2],line[3],line[4],line[5]))                  
 
+        #topologies of molecules in box only (a polydisperse population can have more)
         for x in range(0,len(self.polymers),1):
-            f_out.write("\n#include \"%s.itp\""%self.polymers[x].molname)
+            if self.polymers[x].molname in uniquesorted:
+                f_out.write("\n#include \"%s.itp\""%self.polymers[x].molname)
  
         f_out.write("\n\n[ system ]\n%s\n"%self.params.output)
         f_out.write("\n[ molecules ]\n")
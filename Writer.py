@@ -0,0 +1,249 @@
+# Copyright (c) 2014-2018 Matteo Degiacomi and Valentina Erastova
+#
+# Assemble is free software ;
+# you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation ;
+# either version 2 of the License, or (at your option) any later version.
+# Assemble is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with Assemble ;
+# if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA.
+#
+# Authors : Matteo Degiacomi, matteo.degiacomi@gmail.com, Valentina Erastova, valentina.erastova@gmail.com
+
+
+# Usage example:
+#
+# import Writer as W
+# f=open("out.gro","w")
+# f.write(W.format_gro(resids,W.gro_names(resnames,names),W.wrap(index),x,y,z))
+# W.write_ndx_group(f,"P1",np.arange(1,1001),first=True)
+#
+# Fixed-width records are formatted a block of lines at a time (one formatting operation per block),
+# producing exactly the same text as formatting them line by line. .gro atom lines, by far the most numerous,
+# are instead built as a characters array, one column per character, with the same result.
+
+import os
+import numpy as np
+from itertools import chain
+
+#lines formatted at once
+BLOCK=8192
+
+#.gro atom line: resid, residue and atom name (precomputed, see gro_names), atom index, x, y, z
+GRO_LINE="%5d%s%5d%8.3f%8.3f%8.3f\n"
+
+#bytes of a .gro atom line (44 characters and newline), if no field overflows
+GRO_RECORD=45
+
+#.pdb atom line
+PDB_LINE="ATOM  %5i  %-4s%-4s%1s%4i    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n"
+
+#.ndx atoms per line
+NDX_WIDTH=15
+
+
+## wrap atom or residue numbers the way Gromacs does in fixed-width files (99999 is followed by 0).
+# @param values numbers to wrap (numpy array)
+# @retval wrapped numbers
+def wrap(values):
+    return np.mod(values,100000)
+
+
+## precompute residue and atom name column of .gro lines.
+# @param resnames residue names, one per atom
+# @param names atom names
+# @retval list of strings
+def gro_names(resnames,names):
+    return ["%-5s%5s"%(r,n) for r,n in zip(list(resnames),list(names))]
+
+
+## format records, each given as a tuple of values.
+# @param f file to write into
+# @param fmt format of a single record
+# @param rows list of tuples
+def write_rows(f,fmt,rows):
+
+    for start in range(0,len(rows),BLOCK):
+        block=rows[start:start+BLOCK]
+        f.write((fmt*len(block))%tuple(chain.from_iterable(block)))
+
+
+## format records, given as columns of values, into a string.
+# @param fmt format of a single record
+# @param columns list of numpy arrays or lists (all of same length), one per field in format
+# @retval formatted text
+def format_columns(fmt,columns):
+
+    columns=[c.tolist() if isinstance(c,np.ndarray) else c for c in columns]
+    rows=list(zip(*columns))
+    return "".join([(fmt*len(rows[start:start+BLOCK]))%tuple(chain.from_iterable(rows[start:start+BLOCK])) for start in range(0,len(rows),BLOCK)])
+
+
+## format records, given as columns of values.
+# @param f file to write into
+# @param fmt format of a single record
+# @param columns list of numpy arrays or lists (all of same length), one per field in format
+def write_columns(f,fmt,columns):
+
+    columns=[c.tolist() if isinstance(c,np.ndarray) else c for c in columns]
+    write_rows(f,fmt,list(zip(*columns)))
+
+
+#write non negative integers right aligned in columns [start,start+width) of a characters array (one row per line),
+#padded with fill character. Return False if a number does not fit
+def _put_int(buf,start,width,values,fill=" "):
+
+    values=np.asarray(values,dtype=np.int64)
+    if len(values)>0 and (np.min(values)<0 or np.max(values)>=10**width):
+        return False
+
+    for k in range(0,width,1):
+        digit=(values//10**k)%10+ord("0")
+        buf[:,start+width-1-k]=np.where(np.logical_or(values>=10**k,k==0),digit,ord(fill))
+
+    return True
+
+
+#write numbers as "%{width}.3f" in columns [start,start+width) of a characters array (one row per line).
+#return False if a number does not fit
+def _put_float(buf,start,width,values):
+
+    values=np.asarray(values,dtype=np.float64)
+    if not np.all(np.isfinite(values)):
+        return False
+
+    #thousandths, rounded as % does (values close to a tie are rounded by % itself)
+    scaled=np.abs(values)*1000.0
+    thousandths=np.rint(scaled).astype(np.int64)
+    tie=np.flatnonzero(np.abs(scaled-np.floor(scaled)-0.5)<1e-6)
+    for i in tie:
+        thousandths[i]=int(("%.3f"%abs(values[i])).replace(".",""))
+
+    #integer part digits (at least one), preceded by the sign of negative numbers (also if rounded to zero)
+    units=thousandths//1000
+    negative=np.signbit(values)
+    digits=np.ones(len(values),dtype=np.int64)
+    for k in range(1,width,1):
+        digits+=units>=10**k
+    if len(values)>0 and np.max(digits+negative+4)>width:
+        return False
+
+    _put_int(buf,start+width-3,3,thousandths%1000,"0")
+    buf[:,start+width-4]=ord(".")
+    for k in range(0,width-4,1):
+        col=start+width-5-k
+        buf[:,col]=np.where(k<digits,(units//10**k)%10+ord("0"),np.where(np.logical_and(negative,k==digits),ord("-"),ord(" ")))
+
+    return True
+
+
+## format .gro atom lines into a string, building the characters of all lines in a single array.
+# Text is the same as formatting GRO_LINE line by line (which is done if a field does not fit its width).
+# @param resids residue numbers (wrapped)
+# @param names residue and atom name column of each atom (see gro_names)
+# @param index atom numbers (wrapped)
+# @param x x coordinates
+# @param y y coordinates
+# @param z z coordinates
+# @retval formatted text
+def format_gro(resids,names,index,x,y,z):
+
+    names=np.asarray(names,dtype=str)
+    n=len(names)
+    buf=np.empty((n,GRO_RECORD),dtype=np.uint8)
+    buf[:,GRO_RECORD-1]=ord("\n")
+
+    #names column as characters (10 wide, ascii only)
+    chars=names.astype("U10").view(np.uint32).reshape(n,10)
+    ok=np.all(np.char.str_len(names)==10) and np.all(chars<128)
+
+    if ok:
+        buf[:,5:15]=chars
+        ok=_put_int(buf,0,5,resids) and _put_int(buf,15,5,index)
+    for start,values in [[20,x],[28,y],[36,z]]:
+        ok=ok and _put_float(buf,start,8,values)
+
+    if not ok:
+        return format_columns(GRO_LINE,[resids,names.tolist(),index,x,y,z])
+
+    return buf.tobytes().decode("ascii")
+
+
+## header of a group in a Gromacs index file.
+# @param name group name
+# @param first True if group is the first of the file
+# @retval header text
+def ndx_header(name,first=False):
+
+    if first:
+        return "[ %s ]\n"%name
+    else:
+        return "\n[ %s ]\n"%name
+
+
+## format atom indices of a Gromacs index file group, 15 per line.
+# @param ids atom indices (a part of a group, starting at a multiple of 15 within it)
+# @retval formatted text
+def format_ndx(ids):
+
+    ids=np.asarray(ids).tolist()
+    full=len(ids)-len(ids)%NDX_WIDTH
+    line="%s "*NDX_WIDTH+"\n"
+    text=[]
+    for start in range(0,full,BLOCK*NDX_WIDTH):
+        block=ids[start:min(start+BLOCK*NDX_WIDTH,full)]
+        text.append((line*(len(block)//NDX_WIDTH))%tuple(block))
+
+    text.append(("%s "*(len(ids)-full))%tuple(ids[full:]))
+    return "".join(text)
+
+
+## bytes needed by format_ndx to write all the indices from first to last (included).
+# @param first first index (positive)
+# @param last last index
+# @retval number of bytes
+def ndx_size(first,last):
+
+    #decimal digits of all numbers, one space after each, and one newline every 15
+    size=0
+    digits=1
+    low=1
+    while low<=last:
+        a=max(first,low)
+        b=min(last,low*10-1)
+        if a<=b:
+            size+=(b-a+1)*digits
+        low*=10
+        digits+=1
+
+    n=last-first+1
+    return size+n+n//NDX_WIDTH
+
+
+## write a group of atom indices in a Gromacs index file.
+# @param f file to write into
+# @param name group name
+# @param ids atom indices
+# @param first True if group is the first of the file
+def write_ndx_group(f,name,ids,first=False):
+
+    f.write(ndx_header(name,first))
+    f.write(format_ndx(ids))
+
+
+## write text at a given position of an existing file (several processes can write disjoint parts of a file).
+# @param path file name
+# @param text text to write
+# @param offset position in file, in bytes
+def pwrite(path,text,offset):
+
+    fd=os.open(path,os.O_WRONLY)
+    try:
+        data=text.encode()
+        while len(data)>0:
+            n=os.pwrite(fd,data,offset)
+            data=data[n:]
+            offset+=n
+    finally:
+        os.close(fd)
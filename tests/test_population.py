@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Assemble
+
+
+#polydisperse population of a monomer of mass 100
+def _population():
+    rng=np.random.default_rng(3)
+    population=Assemble.make_population("P",200,["schulz_zimm",[20.0,1.5]],[["A",100.0]],rng=rng)
+    masses=np.array([100.0*len(chain) for name,chain,cnt in population])
+    return population,masses
+
+
+def test_split_number():
+
+    population,masses=_population()
+    split=Assemble.split_concentration(population,30.0)
+
+    counts=np.array([cnt for name,chain,cnt in population],dtype=float)
+    assert [s[0] for s in split]==[p[0] for p in population]
+    assert np.allclose([s[1] for s in split],30.0*counts/np.sum(counts))
+
+
+def test_split_mass():
+
+    population,masses=_population()
+    split=Assemble.split_concentration(population,30.0,masses)
+    c=np.array([s[1] for s in split])
+
+    #mass fractions sum to the concentration of the polydisperse molecule
+    assert np.isclose(np.sum(c),30.0)
+
+    #converted back to amounts of chains, the population is recovered
+    counts=np.array([cnt for name,chain,cnt in population],dtype=float)
+    assert np.allclose((c/masses)/np.sum(c/masses),counts/np.sum(counts))
+
+    #longer chains carry a larger share of mass than of chains
+    longest=np.argmax(masses)
+    assert c[longest]/30.0>counts[longest]/np.sum(counts)
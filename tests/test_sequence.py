@@ -0,0 +1,76 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Sequence as S
+
+
+def _dispersity(lengths):
+    lengths=lengths.astype(float)
+    return np.sum(lengths**2)*len(lengths)/np.sum(lengths)**2
+
+
+def test_apportion():
+
+    assert list(S.apportion([60,40],1000))==[600,400]
+    assert list(S.apportion([1,1,1],10))==[4,3,3]
+    assert list(S.apportion([10,20,70],7))==[1,1,5]
+    assert np.sum(S.apportion([33.3,33.3,33.4],101))==101
+
+
+def test_shuffle_composition():
+
+    rng=np.random.default_rng(1)
+    seq=S.shuffle(rng,[50,30,20],997)
+    assert list(np.bincount(seq,minlength=3))==list(S.apportion([50,30,20],997))
+
+    #randomly ordered, not in blocks
+    assert np.count_nonzero(np.diff(seq))>100
+
+
+def test_block_composition():
+
+    seq=S.block([50,30,20],997)
+    counts=S.apportion([50,30,20],997)
+    assert list(np.bincount(seq,minlength=3))==list(counts)
+    assert list(seq)==[0]*counts[0]+[1]*counts[1]+[2]*counts[2]
+
+
+def test_markov_transitions():
+
+    rng=np.random.default_rng(2)
+    T=np.array([[0.9,0.1,0.0],[0.2,0.5,0.3],[0.05,0.15,0.8]])
+    seq=S.markov(rng,T,500000)
+
+    #empirical frequency of each type following each other type
+    pairs=np.zeros((3,3))
+    np.add.at(pairs,(seq[:-1],seq[1:]),1)
+    assert np.allclose(pairs/np.sum(pairs,axis=1)[:,np.newaxis],T,atol=0.01)
+    assert pairs[0,2]==0
+
+
+def test_markov_initial():
+
+    rng=np.random.default_rng(3)
+    T=[[0.5,0.5],[0.5,0.5]]
+    first=np.array([S.markov(rng,T,5,initial=[80,20])[0] for i in range(0,4000,1)])
+    assert abs(np.mean(first==0)-0.8)<0.03
+
+    #weights are not needed to be normalized, a type of zero weight never starts a chain
+    first=np.array([S.markov(rng,T,5,initial=[0,3])[0] for i in range(0,200,1)])
+    assert np.all(first==1)
+
+
+def test_sample_lengths():
+
+    rng=np.random.default_rng(4)
+    for model,values,mean,pdi in [["schulz_zimm",[200.0,2.0],200.0,1.5],["lognormal",[200.0,1.2],200.0,1.2]]:
+        lengths=S.sample_lengths(rng,model,values,200000)
+        assert np.min(lengths)>=1
+        assert abs(np.mean(lengths)/mean-1.0)<0.01
+        assert abs(_dispersity(lengths)-pdi)<0.01
+
+    lengths=S.sample_lengths(rng,"histogram",[10,1,20,3],100000)
+    assert set(np.unique(lengths))=={10,20}
+    assert abs(np.mean(lengths==20)-0.75)<0.01
@@ -0,0 +1,40 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Writer as W
+
+
+def _reference(resids,names,index,crds):
+    return W.format_columns(W.GRO_LINE,[resids,list(names),index,crds[:,0],crds[:,1],crds[:,2]])
+
+
+def test_gro_lines():
+
+    rng=np.random.default_rng(5)
+    n=20000
+    names=np.array(W.gro_names(["STY"]*n,["C%d"%(i%50) for i in range(n)]))
+    resids=W.wrap(np.arange(n)//50+99990)
+    index=W.wrap(np.arange(1,n+1)+99000)
+
+    #coordinates close to rounding ties, rounded to a negative zero, and as wide as the fields allow
+    crds=rng.uniform(-999.0,9999.0,(n,3))
+    crds[:5000]=np.round(rng.uniform(-3,3,(5000,3)),3)+rng.choice([0.0,0.0005,-0.0005],(5000,3))
+    crds[5000:5100]=rng.uniform(-1e-4,1e-4,(100,3))
+    crds[5100]=[-0.0,9999.9994,-999.9994]
+
+    assert W.format_gro(resids,names,index,*crds.T)==_reference(resids,names,index,crds)
+
+
+def test_gro_overflow():
+
+    names=np.array(W.gro_names(["STY"]*3,["C1","C2","C3"]))
+    crds=np.zeros((3,3))
+    crds[1,2]=-1000.0
+    assert W.format_gro([1,1,1],names,[1,2,3],*crds.T)==_reference([1,1,1],names,[1,2,3],crds)
+
+    names=names.astype("U11")
+    names[1]="LONGRESNAME"
+    crds[1,2]=0.0
+    assert W.format_gro([1,1,1],names,[1,2,3],*crds.T)==_reference([1,1,1],names,[1,2,3],crds)